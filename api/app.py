@@ -1,23 +1,167 @@
 # Import required FastAPI components for building the API
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel
 
 # Import required libraries
+import asyncio
+import json
 import os
-import tempfile
-import uuid
-from typing import Optional, List
+import sys
+import time
+from contextlib import ExitStack, asynccontextmanager
+from typing import Callable, Iterator, Optional, List
 
-# Import PDF processing libraries
-import PyPDF2
+# Make the sibling modules in this directory importable no matter where the app is started from
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# For OpenAI API
-from openai import OpenAI
+# Pooled async OpenAI clients (one per API key) for non-blocking streaming
+from openai_pool import OpenAIClientPool
+
+# Server-side store of extracted documents, keyed by content hash
+from document_store import DocumentStore
+
+# Content-addressed cache of PDF extraction results
+from extraction_cache import ExtractionCache
+
+# Page-level PDF extraction across a process pool
+from pdf_extraction import PageExtractor, open_pdf
+
+# Page texts cached by page content, so a revised PDF only extracts the pages that changed
+from page_cache import PageReuse, PageTextCache, extract_pages_incremental
+
+# Bounded-memory reading of uploads (in memory, or spooled to disk when large)
+from upload_ingest import DEFAULT_SPOOL_THRESHOLD, SpooledUpload, UploadTooLarge, ingest_upload
+
+# Persistent queue of background PDF extraction jobs
+from extraction_jobs import JobQueue
+
+# Exact-match cache of complete chat responses
+from response_cache import ResponseCache
+
+# Per-thread conversation history, windowed to a token budget with a running summary
+from thread_store import DEFAULT_HISTORY_TOKENS, DEFAULT_SUMMARY_MAX_TOKENS, DEFAULT_SUMMARY_MODEL, ThreadStore, build_summary_messages
+
+# Whole-document answers: the question is put to every chunk concurrently, then the answers are merged
+from map_reduce import DEFAULT_MAP_CHUNK_OVERLAP, DEFAULT_MAP_CHUNK_SIZE, DEFAULT_MAX_MAP_CHUNKS, build_reduce_context, label_chunks, map_chunks
+
+# Single-pass, precompiled section heading detection
+from section_segmenter import SECTION_MARKER_PATTERN, join_pages, segment_sections
+
+# Sections cut at the PDF's outline (bookmarks) entries, when it has one
+from outline_segmenter import DEFAULT_SEGMENTATION, read_outline, segment_by_outline
+
+# BM25 retrieval of the chunks relevant to each question
+from bm25_index import BM25Index, ChunkEntryCache, IndexCache
+
+# Token-budget chunking with a pluggable, cached tokenizer
+from token_chunking import chunk_document_by_tokens, chunk_text_by_tokens, get_tokenizer
+
+# Strips page boilerplate and overlap from document text before it reaches the prompt
+from context_compression import CompressionStats, compress_document, dedupe_overlap, measure_savings
+
+# Offset-based chunks that share one text buffer
+from chunk_spans import ChunkSpan, pack_paragraphs
+
+# Stage latency histograms and counters (/api/metrics), and the Server-Timing header
+from metrics import (
+    ServerTimingMiddleware,
+    bytes_processed,
+    chat_requests,
+    documents_processed,
+    observe_stage,
+    pages_processed,
+    registry,
+    timed,
+)
+
+# Generator pipelines behind the streaming (NDJSON) endpoints
+from streaming import (
+    NDJSON_MEDIA_TYPE,
+    PageProgress,
+    iter_chunk_records,
+    iter_extraction_records,
+    iter_pdf_sections,
+    iter_section_chunks,
+    iter_text_chunks,
+    iter_token_chunks,
+)
+
+# Response formats (JSON, MessagePack), compression and field selection negotiated per request
+from response_encoding import ResponseEncoding, dumps_json, iter_selected, parse_fields, select_fields
+
+# Shared pool of AsyncOpenAI clients, reused across chat requests
+client_pool = OpenAIClientPool()
+
+# Documents registered by /api/upload, referenced by chat requests via document_ids
+document_store = DocumentStore()
+
+# Extraction results keyed by upload hash, shared by every endpoint that parses PDFs
+extraction_cache = ExtractionCache()
+
+# Worker processes for page extraction (count set by PDF_EXTRACTION_WORKERS)
+page_extractor = PageExtractor()
+
+# Extracted page texts by page fingerprint, reused when a revised document is uploaded
+page_cache = PageTextCache()
+
+# Retrieval indexes per stored document, built when the document is uploaded
+index_cache = IndexCache()
+
+# Per-chunk index entries (BM25 term counts, dense vectors), reused for the unchanged chunks of revised documents
+chunk_entries = ChunkEntryCache()
+vector_entries = ChunkEntryCache(max_entries=int(os.environ.get("DENSE_VECTOR_CACHE_ENTRIES", "10000")))
+
+# Finished chat answers, replayed when the exact same prompt comes in again
+response_cache = ResponseCache()
+
+# What context compression has saved so far
+compression_stats = CompressionStats()
+# Paragraph token counts for measuring those savings; kept apart so they don't push out the retrieval entries
+compression_token_counts = ChunkEntryCache(max_entries=int(os.environ.get("CONTEXT_TOKEN_CACHE_ENTRIES", "5000")))
+
+# Conversation threads; turns are counted with the base tokenizer so they don't churn the block cache
+thread_store = ThreadStore(count_tokens=lambda text: len(get_tokenizer().tokenizer.offsets(text)))
+
+# Running-summary updates in flight, at most one per thread
+summary_tasks = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hook."""
+    # Resume background extraction jobs left over from the last run
+    await extraction_jobs.start()
+    if WARM_UP:
+        print(f"Warmed up: {await warm_up()}")
+    else:
+        # Thread turns are counted with it, so load it (and maybe download its encoding) now, not on the first turn
+        await run_in_threadpool(get_tokenizer)
+    yield
+    # Running jobs are checkpointed and pick up where they left off next time
+    await extraction_jobs.stop()
+    # Unfinished summaries are simply redone after the next turn
+    for task in list(summary_tasks.values()):
+        task.cancel()
+    # Close pooled HTTP connections on shutdown
+    await client_pool.aclose()
+    document_store.close()
+    thread_store.close()
+    page_cache.close()
+    page_extractor.shutdown()
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that encodes with orjson when available, timed as the "serialization" stage."""
+
+    def render(self, content) -> bytes:
+        with timed("serialization"):
+            body = dumps_json(content)
+        bytes_processed.inc(len(body), "serialization")
+        return body
 
 # Initialize FastAPI application with a title
-app = FastAPI(title="OpenAI Chat API")
+app = FastAPI(title="OpenAI Chat API", lifespan=lifespan, default_response_class=TimedJSONResponse)
 
 # Configure CORS (Cross-Origin Resource Sharing) middleware
 # This allows the API to be accessed from different domains/origins
@@ -27,8 +171,12 @@ app.add_middleware(
     allow_credentials=True,  # Allows cookies to be included in requests
     allow_methods=["*"],  # Allows all HTTP methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers in requests
+    expose_headers=["Server-Timing"],  # Lets browser devtools show the stage timings
 )
 
+# Report each request's stage timings in a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+
 # Define the data model for chat requests using Pydantic
 # This ensures incoming request data is properly validated
 class ChatRequest(BaseModel):
@@ -37,6 +185,9 @@ class ChatRequest(BaseModel):
     model: Optional[str] = "gpt-4.1-mini"  # Optional model selection with default
     api_key: str          # OpenAI API key for authentication
     thread_id: Optional[str] = None  # Thread ID for continuing conversations
+    document_ids: Optional[List[str]] = None  # IDs returned by /api/upload; the server adds their text as context
+    mode: Optional[str] = "retrieval"  # "retrieval" (best-matching chunks) or "map_reduce" (every chunk)
+    cache: Optional[bool] = True  # False skips the response cache: the answer is neither replayed nor stored
 
 # Define a model for file upload responses
 class FileUploadResponse(BaseModel):
@@ -46,185 +197,673 @@ class FileUploadResponse(BaseModel):
     bytes: int
     text_content: Optional[str] = None
     page_count: Optional[int] = None
+    context_tokens_saved: Optional[int] = None  # Tokens context compression removed from the document
+    pages_reused: Optional[int] = None  # PDF pages whose text came from the page cache (unchanged since an earlier upload)
+    pages_extracted: Optional[int] = None  # PDF pages that had to be extracted
+
+# Retrieval settings: documents are indexed in chunks of this size, and each
+# document contributes at most RETRIEVAL_CONTEXT_CHARS of its best-matching chunks
+RETRIEVAL_CHUNK_SIZE = int(os.environ.get("RETRIEVAL_CHUNK_SIZE", "2000"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP", "200"))
+RETRIEVAL_CONTEXT_CHARS = int(os.environ.get("RETRIEVAL_CONTEXT_CHARS", "30000"))
+# "bm25" (keyword) or "dense" (embeddings in memory-mapped files; needs numpy)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "bm25")
+# Embedder for dense mode: "hashing" (offline, deterministic) or "openai" (uses OPENAI_API_KEY)
+DENSE_EMBEDDER = os.environ.get("DENSE_EMBEDDER", "hashing")
+# Set to "0" to send document text to the model without compressing it
+CONTEXT_COMPRESSION = os.environ.get("CONTEXT_COMPRESSION", "1") != "0"
+
+# /api/upload/batch: files extracted at the same time, and files accepted per request
+UPLOAD_BATCH_CONCURRENCY = int(os.environ.get("UPLOAD_BATCH_CONCURRENCY", "4"))
+UPLOAD_BATCH_MAX_FILES = int(os.environ.get("UPLOAD_BATCH_MAX_FILES", "100"))
+
+# Set to "1" to load the OpenAI client, PyPDF2, extraction workers and tokenizer at startup
+# (see warm_up()); by default each loads on the first request that needs it, for faster cold starts
+WARM_UP = os.environ.get("WARM_UP", "0") != "0"
+
+_dense_embedder = None
+
+def get_dense_embedder():
+    """Create the dense-retrieval embedder on first use."""
+    global _dense_embedder
+    if _dense_embedder is None:
+        from vector_index import HashingEmbedder, OpenAIEmbedder
+        if DENSE_EMBEDDER == "openai":
+            from openai import OpenAI
+            _dense_embedder = OpenAIEmbedder(OpenAI())
+        else:
+            _dense_embedder = HashingEmbedder()
+    return _dense_embedder
+
+async def warm_up():
+    """
+    Load everything the first requests would otherwise wait for.
+    
+    The heavy imports (openai, PyPDF2, multiprocessing) are deferred so a cold
+    start only pays for what its first request uses. This loads them all
+    ahead of time, on startup (WARM_UP=1) or from /api/warmup, and returns
+    the seconds each step took.
+    """
+    timings = {}
+    start = time.perf_counter()
+    await client_pool.warm_up()
+    timings["openai_client"] = time.perf_counter() - start
+    
+    steps = [("pdf_extractor", page_extractor.warm_up), ("tokenizer", get_tokenizer)]
+    if RETRIEVAL_MODE == "dense":
+        steps.append(("dense_embedder", get_dense_embedder))
+    for name, step in steps:
+        start = time.perf_counter()
+        await run_in_threadpool(step)
+        timings[name] = time.perf_counter() - start
+    return {name: round(seconds, 4) for name, seconds in timings.items()}
+
+def get_document_index(document):
+    """
+    Return (chunks, chunk lengths, retrieval index, tokens saved) for a stored document, building it once.
+    
+    The index is a BM25Index or, in dense mode, a VectorIndex; both provide
+    select_within_budget(). Chunks come from the compressed text (see
+    context_compression) unless CONTEXT_COMPRESSION is off; tokens saved is
+    what compression removed from the document.
+    """
+    def build():
+        text_content = document.text
+        tokens_saved = 0
+        if CONTEXT_COMPRESSION:
+            text_content = compress_document(document.text)
+            # Counted without the tokenizer's block cache, so whole documents don't fill it;
+            # paragraph counts are kept in their own cache for re-uploads instead
+            chars_removed, tokens_saved = measure_savings(document.text, text_content, get_tokenizer().tokenizer, compression_token_counts)
+            compression_stats.add_document(document.document_id, chars_removed, tokens_saved)
+        
+        with timed("chunking"):
+            chunks = chunk_document_by_sections(text_content, RETRIEVAL_CHUNK_SIZE, RETRIEVAL_CHUNK_OVERLAP)
+        contents = [chunk.content for chunk in chunks]
+        
+        if RETRIEVAL_MODE == "dense":
+            # Imported here so numpy is only required when dense retrieval is enabled
+            from vector_index import VectorIndex, texts_digest
+            embedder = get_dense_embedder()
+            # Named after the chunks themselves (and the extractor version), so a change to the
+            # extractor, chunking or compression never picks up another run's stale vectors
+            vector_key = f"{document.document_id}-{texts_digest(contents, salt=EXTRACTOR_VERSION)}"
+            # Reuse vectors embedded by an earlier run before embedding again
+            index = (
+                VectorIndex.open(vector_key, embedder, rows=len(contents))
+                or VectorIndex.build(vector_key, contents, embedder, entry_cache=vector_entries)
+            )
+        else:
+            index = BM25Index(contents, entry_cache=chunk_entries)
+        
+        return chunks, [len(content) for content in contents], index, tokens_saved
+
+    key = (document.document_id, RETRIEVAL_CHUNK_SIZE, RETRIEVAL_CHUNK_OVERLAP)
+    return index_cache.get_or_build(key, build)
+
+def forget_document_index(document_id: str):
+    """Drop the index of a document the store no longer holds, and in dense mode its vector files."""
+    index_cache.discard((document_id, RETRIEVAL_CHUNK_SIZE, RETRIEVAL_CHUNK_OVERLAP))
+    if RETRIEVAL_MODE == "dense":
+        from vector_index import VectorIndex
+        VectorIndex.delete(f"{document_id}-")
+
+# Set here rather than where the store is created, since it needs the index cache and settings above
+document_store.on_evict = forget_document_index
+
+def build_map_chunks(documents):
+    """
+    Labelled (label, text) chunks of every document, for map-reduce mode.
+    
+    Chunks are much larger than the retrieval ones (each is one map
+    completion) and come from the compressed text too, unless
+    CONTEXT_COMPRESSION is off.
+    """
+    map_inputs = []
+    for document in documents:
+        text_content = compress_document(document.text) if CONTEXT_COMPRESSION else document.text
+        with timed("chunking"):
+            chunks = chunk_document_by_sections(text_content, DEFAULT_MAP_CHUNK_SIZE, DEFAULT_MAP_CHUNK_OVERLAP)
+            if len(chunks) == 1 and len(text_content) > DEFAULT_MAP_CHUNK_SIZE:
+                # No section markers (a text upload): split on paragraphs instead of sending it all at once
+                chunks = pack_paragraphs(text_content, chunks[0].title, DEFAULT_MAP_CHUNK_SIZE, DEFAULT_MAP_CHUNK_OVERLAP)
+        map_inputs.extend(label_chunks(document.filename, chunks))
+    return map_inputs
+
+def build_document_context(documents, query, max_chars=RETRIEVAL_CONTEXT_CHARS):
+    """
+    Build the document context appended to the system message.
+    
+    Each document is searched (BM25 or dense, per RETRIEVAL_MODE) for the
+    chunks most relevant to the query, and as many as fit in max_chars are included in document order.
+    
+    Args:
+        documents: StoredDocument objects to draw context from
+        query: The user's message
+        max_chars: Context budget per document, in characters
+    """
+    parts = []
+    for document in documents:
+        chunks, lengths, index, _ = get_document_index(document)
+        selected = index.select_within_budget(query, lengths, max_chars)
+        
+        document_parts = [f"Document: {document.filename}\n\n"]
+        previous_index = None
+        previous_content = ""
+        for chunk_index in selected:
+            chunk = chunks[chunk_index]
+            content = chunk.content
+            text = content
+            if CONTEXT_COMPRESSION and previous_index == chunk_index - 1:
+                # The previous chunk is in the prompt already, so leave out the overlap repeated from it
+                text = dedupe_overlap(previous_content, content, RETRIEVAL_CHUNK_OVERLAP)
+                compression_stats.add_overlap(document.document_id, chunk_index, len(content) - len(text))
+            previous_index = chunk_index
+            previous_content = content
+            document_parts.append(f"--- SECTION: {chunk.title} ---\n\n{text.strip()}\n\n")
+        if len(selected) < len(chunks):
+            document_parts.append("(other sections omitted as less relevant to the question)\n")
+        parts.append("".join(document_parts))
+
+    return "\n\n".join(parts)
+
+async def summarize_thread(thread_id: str, api_key: str, model: str):
+    """Fold the turns that have fallen out of a thread's history window into its running summary."""
+    try:
+        thread = await run_in_threadpool(thread_store.get, thread_id)
+        if thread is None:
+            return
+        _, pending = thread.window(DEFAULT_HISTORY_TOKENS)
+        if not pending:
+            return
+        # The summary only ever grows forward, so a late update can't overwrite a newer one
+        covered_turns = thread.summarized_turns + len(pending)
+        async with client_pool.lease(api_key) as client:
+            response = await client.chat.completions.create(
+                model=DEFAULT_SUMMARY_MODEL or model,
+                messages=build_summary_messages(thread.summary, pending),
+                max_tokens=DEFAULT_SUMMARY_MAX_TOKENS,
+            )
+        summary = (response.choices[0].message.content or "").strip()
+        if summary:
+            await run_in_threadpool(thread_store.set_summary, thread_id, summary, covered_turns)
+    except Exception as e:
+        # The turns stay pending, and the next turn tries again
+        print(f"Error summarizing thread {thread_id}: {e}")
+    finally:
+        summary_tasks.pop(thread_id, None)
+
+async def record_turn(request: ChatRequest, answer: str):
+    """Add a finished exchange to the request's thread, and summarize off the request path if it's outgrown its window."""
+    # Counting the turn's tokens and saving the thread to SQLite would stall every other stream
+    thread = await run_in_threadpool(thread_store.append, request.thread_id, request.user_message, answer)
+    if thread.window(DEFAULT_HISTORY_TOKENS)[1] and request.thread_id not in summary_tasks:
+        summary_tasks[request.thread_id] = asyncio.create_task(
+            summarize_thread(request.thread_id, request.api_key, request.model)
+        )
 
 # Define the main chat endpoint that handles POST requests
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
     try:
-        # Initialize OpenAI client with the provided API key
-        client = OpenAI(api_key=request.api_key)
-        
+        system_message = request.developer_message
+        mode = request.mode or "retrieval"
+        if mode not in ("retrieval", "map_reduce"):
+            raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+        if mode == "map_reduce" and not request.document_ids:
+            raise HTTPException(status_code=400, detail="map_reduce mode needs document_ids")
+
+        # Look up referenced documents and add their text to the system message
+        map_inputs = None
+        cache_context = ""
+        if request.document_ids:
+            found = await run_in_threadpool(find_documents, request.document_ids)
+            missing = [document_id for document_id, document in found.items() if document is None]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Unknown document_ids: {', '.join(missing)}")
+            if mode == "map_reduce":
+                # Every chunk is read, so the text goes to the map completions instead of the system message
+                map_inputs = await run_in_threadpool(build_map_chunks, list(found.values()))
+                if len(map_inputs) > DEFAULT_MAX_MAP_CHUNKS:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"The documents split into {len(map_inputs)} parts; map_reduce mode reads at most {DEFAULT_MAX_MAP_CHUNKS}",
+                    )
+                # Document IDs are content hashes, so they stand in for the text in the cache key
+                cache_context = f"\n\n[map_reduce: {', '.join(found)}]"
+            else:
+                # Indexing a large document is CPU heavy, so keep it off the event loop
+                with timed("retrieval"):
+                    document_context = await run_in_threadpool(build_document_context, list(found.values()), request.user_message)
+                system_message = f"{system_message}\n\n{document_context}"
+
+        # Continue the thread: the summary of its older turns, then the recent turns verbatim
+        thread = await run_in_threadpool(thread_store.get, request.thread_id) if request.thread_id else None
+        history = []
+        if thread is not None:
+            recent, _ = thread.window(DEFAULT_HISTORY_TOKENS)
+            history = [turn.to_message() for turn in recent]
+            if thread.summary:
+                system_message = f"{system_message}\n\nSummary of the earlier conversation:\n{thread.summary}"
+
+        # The key covers the assembled system message, so it changes with the documents' context too.
+        # In a thread it also covers the summary and the recent turns, i.e. everything the answer depends on,
+        # so a follow-up is replayed only when it's asked after the same conversation.
+        cache_key = None
+        if request.cache is not False:
+            cache_context += json.dumps(history) if history else ""
+            cache_key = ResponseCache.make_key(request.model, system_message + cache_context, request.user_message)
+            cached_response = response_cache.get(cache_key)
+            chat_requests.inc(1, "miss" if cached_response is None else "hit")
+            if cached_response is not None:
+                async def replay():
+                    for piece in response_cache.replay(cached_response):
+                        yield piece
+                    if request.thread_id:
+                        await record_turn(request, cached_response)
+                return StreamingResponse(replay(), media_type="text/plain", headers={"X-Cache": "HIT"})
+        else:
+            chat_requests.inc(1, "bypass")
+
         # Create an async generator function for streaming responses
         async def generate():
-            # Prepare messages with document context if available
+            prompt = system_message
+            if map_inputs is not None:
+                # Map step: the question against every chunk at once; the reduce step streams below
+                try:
+                    result = await map_chunks(client_pool, request.api_key, request.model, request.user_message, map_inputs)
+                except Exception as e:
+                    # The 200 has already gone out, so the stream itself has to say the answer failed
+                    print(f"Map step failed: {e}")
+                    yield f"[Error reading the documents: {e}]"
+                    return
+                prompt = f"{system_message}\n\n{build_reduce_context(result)}"
+            
+            # Prepare messages with document context (and the thread's history) if available
             messages = [
-                {"role": "system", "content": request.developer_message},
+                {"role": "system", "content": prompt},
+                *history,
                 {"role": "user", "content": request.user_message}
             ]
             
-            # Create a streaming chat completion request
-            stream = client.chat.completions.create(
-                model=request.model,
-                messages=messages,
-                stream=True,  # Enable streaming response
-                # The document content is already embedded in the developer_message
-            )
-            
-            # Yield each chunk of the response as it becomes available
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            # Borrow a pooled AsyncOpenAI client for this API key
+            # (waits here if the key already has too many streams in flight)
+            async with client_pool.lease(request.api_key) as client:
+                # Create a streaming chat completion request without blocking the event loop
+                # (the upstream timings start here, so they leave out any wait for a pooled client)
+                started = time.perf_counter()
+                stream = await client.chat.completions.create(
+                    model=request.model,
+                    messages=messages,
+                    stream=True,  # Enable streaming response
+                    # Document content is embedded in the system message
+                )
+                
+                parts = []
+                try:
+                    # Yield each chunk of the response as it becomes available
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content is not None:
+                            if not parts:
+                                observe_stage("chat_ttft", time.perf_counter() - started)
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                    # Only answers that streamed to the end are cached and added to the thread
+                    if parts:
+                        observe_stage("chat_stream", time.perf_counter() - started)
+                        answer = "".join(parts)
+                        if cache_key is not None:
+                            response_cache.put(cache_key, answer)
+                        if request.thread_id:
+                            await record_turn(request, answer)
+                finally:
+                    # If the browser disconnects, Starlette cancels this generator;
+                    # closing the stream aborts the upstream request too
+                    await stream.close()
 
         # Return a streaming response to the client
-        return StreamingResponse(generate(), media_type="text/plain")
+        # Opted-out requests bypass the cache entirely, so they get no X-Cache header
+        headers = {"X-Cache": "MISS"} if cache_key is not None else None
+        return StreamingResponse(generate(), media_type="text/plain", headers=headers)
     
+    except HTTPException:
+        raise
     except Exception as e:
         # Handle any errors that occur during processing
         raise HTTPException(status_code=500, detail=str(e))
 
+async def register_upload(upload: SpooledUpload, filename: str, min_parallel_pages: Optional[int] = None) -> FileUploadResponse:
+    """
+    Extract an upload's text and add it to the document store, as /api/upload does.
+    
+    The caller still owns (and must close) the upload. min_parallel_pages is
+    passed on to the page extractor.
+    """
+    # Extract text if it's a PDF file
+    text_content = None
+    page_count = None
+    reuse = None
+    
+    # The content hash doubles as the document ID and the extraction cache key
+    file_id = upload.sha256
+    
+    if filename.lower().endswith('.pdf'):
+        reuse = PageReuse()
+        text_content, page_count = await extract_pdf_cached(upload, min_parallel_pages, reuse)
+    
+    # For non-PDF text files, read the content directly
+    elif filename.lower().endswith('.txt'):
+        text_content = upload.text()
+        page_count = 1
+    
+    # Register the extracted text so chat requests can reference it by ID
+    tokens_saved = None
+    if text_content is not None:
+        document = document_store.put(file_id, filename, text_content, page_count)
+        # Index (and, in dense mode, embed) the chunks now rather than on the first question
+        _, _, _, tokens_saved = await run_in_threadpool(get_document_index, document)
+    
+    # Chat requests should send file_id in document_ids rather than resending text_content
+    return FileUploadResponse(
+        file_id=file_id,
+        filename=filename,
+        purpose="text-extraction-only",
+        bytes=upload.size,
+        text_content=text_content,
+        page_count=page_count,
+        context_tokens_saved=tokens_saved,
+        pages_reused=reuse.reused if reuse is not None else None,
+        pages_extracted=reuse.extracted if reuse is not None else None,
+    )
+
 # Add file upload endpoint - simplified version that focuses only on text extraction
 @app.post("/api/upload")
 async def upload_file(
     file: UploadFile = File(...),
-    api_key: str = Form(...)
+    api_key: str = Form(...),
+    background: bool = Form(False)
 ):
+    """
+    Extract an uploaded file's text and store it for chat requests.
+    
+    With background=true a PDF is queued as an extraction job instead: the
+    response is 202 with a job_id, and /api/jobs/{job_id} reports progress
+    and the document_id once it's done.
+    """
     try:
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False) as temp:
-            # Write the file content to the temporary file
-            content = await file.read()
-            temp.write(content)
-            temp_path = temp.name
-        
-        # Extract text if it's a PDF file
-        text_content = None
-        page_count = None
-        
-        if file.filename.lower().endswith('.pdf'):
-            text_content, page_count = extract_text_from_pdf(temp_path)
-        
-        # For non-PDF text files, read the content directly
-        elif file.filename.lower().endswith('.txt'):
-            with open(temp_path, 'r', errors='ignore') as f:
-                text_content = f.read()
-            page_count = 1
-        
-        # Clean up the temporary file
-        os.unlink(temp_path)
-        
-        # Generate a simple file ID just for frontend reference
-        file_id = str(uuid.uuid4())
-        
-        # Return the file information with extracted text
-        # This is what the frontend needs - the text content and metadata
-        return FileUploadResponse(
-            file_id=file_id,
-            filename=file.filename,
-            purpose="text-extraction-only",
-            bytes=len(content),
-            text_content=text_content,
-            page_count=page_count
-        )
+        # Read the upload in blocks, hashing it on the way in
+        upload = await read_upload(file)
+        try:
+            if background and file.filename.lower().endswith('.pdf'):
+                job = await run_in_threadpool(extraction_jobs.submit, upload, file.filename)
+                return JSONResponse(
+                    status_code=202,
+                    content={"job_id": job.job_id, "status": job.status, "status_url": f"/api/jobs/{job.job_id}"},
+                )
+            
+            # Return the file information with extracted text
+            return await register_upload(upload, file.filename)
+        finally:
+            # Release the upload (and its temp file, if it was spooled) even if extraction failed
+            upload.close()
         
+    except HTTPException:
+        raise
     except Exception as e:
         # Handle any errors that occur during processing
         raise HTTPException(status_code=500, detail=str(e))
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text content from a PDF file with section detection."""
+def complete_extraction_job(job, page_texts):
+    """
+    Store and index the document of a background job whose pages are all extracted.
+    
+    Runs in a job worker thread; raising marks the job as failed. Returns
+    (text_content, page_count), which the queue keeps with the job.
+    """
+    text_content, page_count = extract_text_from_pdf(job.source_path, page_texts)
+    # extract_text_from_pdf reports failures as page_count 0 rather than raising
+    if page_count == 0:
+        raise RuntimeError(text_content)
+    
+    extraction_cache.put(ExtractionCache.make_key(job.document_id, EXTRACTOR_VERSION), (text_content, page_count))
+    document = document_store.put(job.document_id, job.filename, text_content, page_count)
+    get_document_index(document)
+    return text_content, page_count
+
+# Background extraction jobs submitted with /api/upload?background=true
+extraction_jobs = JobQueue(page_extractor, complete_extraction_job)
+
+def find_documents(document_ids):
+    """
+    document_store.get_many(), restoring the documents of finished background jobs.
+    
+    A job's document only lives in the store, which a restart empties unless
+    DOCUMENT_STORE_PATH is set, while the job keeps reporting its
+    document_id; the queue still has the text, so it's put back from there.
+    """
+    found = document_store.get_many(document_ids)
+    for document_id, document in found.items():
+        if document is None:
+            restored = extraction_jobs.document(document_id)
+            if restored is not None:
+                filename, text_content, page_count = restored
+                found[document_id] = document_store.put(document_id, filename, text_content, page_count)
+    return found
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Progress of a background extraction job.
+    
+    Returns status ("queued", "running", "done", "failed" or "cancelled"),
+    page_count, pages_done, eta_seconds while running, and document_id once done.
+    """
+    status = await run_in_threadpool(extraction_jobs.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id: {job_id}")
+    return status
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running background extraction job."""
+    cancelled = await run_in_threadpool(extraction_jobs.cancel, job_id)
+    status = await run_in_threadpool(extraction_jobs.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id: {job_id}")
+    if not cancelled:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is already {status['status']}")
+    return status
+
+@app.get("/api/threads/{thread_id}")
+async def get_thread(thread_id: str):
+    """A conversation thread's turns, and the running summary of the older ones."""
+    thread = await run_in_threadpool(thread_store.get, thread_id)
+    if thread is None:
+        raise HTTPException(status_code=404, detail=f"Unknown thread_id: {thread_id}")
+    return thread.to_dict()
+
+@app.delete("/api/threads/{thread_id}")
+async def delete_thread(thread_id: str):
+    """Forget a conversation thread."""
+    if not await run_in_threadpool(thread_store.delete, thread_id):
+        raise HTTPException(status_code=404, detail=f"Unknown thread_id: {thread_id}")
+    return {"thread_id": thread_id, "deleted": True}
+
+async def iter_batch_records(filenames: List[str], uploads: list):
+    """
+    The NDJSON lines of an /api/upload/batch response.
+    
+    Every file is processed concurrently, at most UPLOAD_BATCH_CONCURRENCY at
+    a time, and its record is sent as soon as it's done. uploads holds a
+    SpooledUpload per file, or the UploadTooLarge raised while reading it.
+    """
+    semaphore = asyncio.Semaphore(UPLOAD_BATCH_CONCURRENCY)
+    
+    async def process(index, filename, upload):
+        record = {"type": "file", "index": index, "filename": filename}
+        if isinstance(upload, UploadTooLarge):
+            return {**record, "status": "error", "error": str(upload)}
+        try:
+            if not filename.lower().endswith(('.pdf', '.txt')):
+                return {**record, "status": "error", "error": "Unsupported file type. Only PDF and TXT files are supported."}
+            async with semaphore:
+                # Small PDFs go to the process pool too, so files are parsed in parallel
+                response = await register_upload(upload, filename, min_parallel_pages=1)
+        except Exception as e:
+            print(f"Error in batch upload of {filename}: {e}")
+            return {**record, "status": "error", "error": str(e)}
+        finally:
+            upload.close()
+        
+        # extract_text_from_pdf reports failures as page_count 0 rather than raising
+        if response.page_count == 0:
+            return {**record, "status": "error", "error": response.text_content}
+        return {**record, "status": "ok", **response.model_dump()}
+    
+    tasks = [
+        asyncio.ensure_future(process(index, filename, upload))
+        for index, (filename, upload) in enumerate(zip(filenames, uploads))
+    ]
+    ok_count = 0
     try:
-        text_content = ""
-        page_count = 0
-        sections = {}
-        full_text = ""
+        for next_done in asyncio.as_completed(tasks):
+            record = await next_done
+            ok_count += record["status"] == "ok"
+            yield json.dumps(record) + "\n"
+        yield json.dumps({"type": "done", "file_count": len(tasks), "ok_count": ok_count, "error_count": len(tasks) - ok_count}) + "\n"
+    finally:
+        # The client went away: stop the remaining files and release their uploads
+        for task in tasks:
+            task.cancel()
+        for upload in uploads:
+            if isinstance(upload, SpooledUpload):
+                upload.close()
+
+@app.post("/api/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    api_key: str = Form(...)
+):
+    """
+    Upload many files in one request; their text is extracted concurrently.
+    
+    The response is NDJSON with a record per file in the order they finish:
+    {"type": "file", "index", "filename", "status": "ok", ...} with the
+    /api/upload fields, or "status": "error" with an "error" message. A file
+    that fails doesn't affect the others. The last record is {"type": "done",
+    "file_count", "ok_count", "error_count"}.
+    """
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. At most {UPLOAD_BATCH_MAX_FILES} can be uploaded at once.")
+    
+    # The multipart files are closed once this handler returns, so read them all up front
+    uploads = []
+    in_memory = 0
+    try:
+        for file in files:
+            try:
+                # The batch shares one in-memory budget; files past it are spooled to disk
+                upload = await ingest_upload(file, spool_threshold=max(0, DEFAULT_SPOOL_THRESHOLD - in_memory))
+            except UploadTooLarge as e:
+                uploads.append(e)
+                continue
+            if upload.in_memory:
+                in_memory += upload.size
+            uploads.append(upload)
+    except BaseException:
+        for upload in uploads:
+            if isinstance(upload, SpooledUpload):
+                upload.close()
+        raise
+    
+    filenames = [file.filename or "" for file in files]
+    return StreamingResponse(iter_batch_records(filenames, uploads), media_type=NDJSON_MEDIA_TYPE)
+
+# Bump this whenever extract_text_from_pdf's output changes, so cached results are invalidated
+EXTRACTOR_VERSION = "3"
+
+async def extract_pdf_cached(upload: SpooledUpload, min_parallel_pages: Optional[int] = None, reuse: Optional[PageReuse] = None):
+    """
+    Extract text from an uploaded PDF, reusing the cached result for identical bytes.
+    
+    Concurrent uploads of the same file share a single extraction. Otherwise
+    only the pages the page cache hasn't seen are extracted (a revised
+    document reuses its unchanged pages), in parallel worker processes, and
+    the handler awaits the result, so the event loop stays free.
+    
+    Args:
+        upload: The uploaded bytes; their SHA-256 is the cache key
+        min_parallel_pages: Overrides the page extractor's pool threshold
+        reuse: Filled in with the pages reused and extracted; every page
+            counts as reused when the whole file was cached
         
-        import re
+    Returns:
+        Tuple of (text_content, page_count)
+    """
+    key = ExtractionCache.make_key(upload.sha256, EXTRACTOR_VERSION)
+    # Stays at zero unless this call runs the extraction itself (not cached, nor shared with another request)
+    computed = PageReuse()
+    
+    async def compute():
+        try:
+            # Extract the pages that changed across the process pool, off the event loop
+            page_texts = await extract_pages_incremental(upload, page_extractor, page_cache, min_parallel_pages, computed)
+        except Exception as e:
+            # Let extract_text_from_pdf retry serially and report the error in its usual format
+            print(f"Parallel page extraction failed, falling back to serial: {e}")
+            page_texts = None
+        result = await run_in_threadpool(extract_text_from_pdf, upload, page_texts)
+        if page_texts is None:
+            computed.extracted = result[1]
+        return result
+    
+    result = await extraction_cache.get_or_compute(
+        key,
+        compute,
+        # extract_text_from_pdf reports failures as page_count 0 - don't cache those
+        cacheable=lambda result: result[1] > 0,
+    )
+    if reuse is not None:
+        reuse.extracted = computed.extracted
+        reuse.reused = result[1] - computed.extracted
+    return result
+
+def extract_text_from_pdf(pdf, page_texts=None):
+    """
+    Extract text content from a PDF file with section detection.
+    
+    Args:
+        pdf: Path to the PDF file, or a SpooledUpload holding it
+        page_texts: Optional per-page texts already extracted (e.g. by the
+            parallel PageExtractor); when omitted, pages are extracted serially here
+    """
+    try:
+        if page_texts is None:
+            # Create a PDF reader object and extract every page in order
+            import PyPDF2
+            with open_pdf(pdf) as file:
+                with timed("pdf_parse"):
+                    pages = PyPDF2.PdfReader(file).pages
+                page_texts = []
+                for page in pages:
+                    with timed("page_extract"):
+                        page_texts.append(page.extract_text())
+                pages_processed.inc(len(page_texts))
+        page_count = len(page_texts)
         
-        # Regular expressions for common section/heading patterns
-        section_patterns = [
-            # Chapter/Section patterns (e.g., "Chapter 1: Introduction", "Section 2.1")
-            r'^(?:chapter|section)\s+(\d+(?:\.\d+)?)(?:\s*:\s*|\s+)(.+)$',
-            # Numbered headings (e.g., "1. Introduction", "2.1 Methods")
-            r'^(\d+(?:\.\d+)?)\s+(.+)$',
-            # All caps headings often used as section titles
-            r'^([A-Z][A-Z\s]{4,})$',
-            # Common heading keywords
-            r'^(introduction|background|methodology|methods|results|discussion|conclusion|references|appendix)$'
-        ]
+        # First pass: Combine the page texts with page markers
+        full_text = join_pages(page_texts)
+        
+        # If extraction is failing, try a different approach - just create a single section
+        if len(full_text.strip()) < 100 and page_count > 0:
+            return f"\n\n--- SECTION: Full Document ---\n\n{full_text}", page_count
+        
+        # Second pass: Split the full text into sections - at the outline's entries if the PDF
+        # has an outline, otherwise by matching heading patterns in a single scan
+        outline = read_outline(pdf) if DEFAULT_SEGMENTATION == "auto" else []
+        with timed("segmentation"):
+            text_content = segment_by_outline(page_texts, outline) if outline else segment_sections(full_text)
         
-        # Open the PDF file
-        with open(pdf_path, 'rb') as file:
-            # Create a PDF reader object
-            pdf_reader = PyPDF2.PdfReader(file)
-            page_count = len(pdf_reader.pages)
-            
-            # First pass: Extract all text from the document
-            for page_num in range(page_count):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text() or f"[No extractable text on page {page_num + 1}]"
-                full_text += f"\n\n----- PAGE {page_num + 1} -----\n\n"
-                full_text += page_text
-            
-            # If extraction is failing, try a different approach - just create a single section
-            if len(full_text.strip()) < 100 and page_count > 0:
-                return f"\n\n--- SECTION: Full Document ---\n\n{full_text}", page_count
-            
-            # Second pass: Split the full text into sections
-            current_section = "Document Start"
-            sections[current_section] = ""
-            
-            # Process text line by line to detect section headings
-            lines = full_text.split('\n')
-            line_idx = 0
-            
-            while line_idx < len(lines):
-                line = lines[line_idx].strip()
-                line_idx += 1
-                
-                if not line:  # Skip empty lines
-                    continue
-                    
-                # Check for section headings
-                is_heading = False
-                section_title = None
-                
-                for pattern in section_patterns:
-                    match = re.match(pattern, line, re.IGNORECASE)
-                    if match:
-                        if len(match.groups()) > 1:
-                            section_title = f"{match.group(1)}: {match.group(2)}"
-                        else:
-                            section_title = match.group(1)
-                        is_heading = True
-                        print(f"Detected section heading: {section_title}")
-                        break
-                
-                # Also check for short lines that might be headings (heuristic)
-                if not is_heading and len(line) < 50 and line.strip().istitle() and line_idx > 1 and line_idx < len(lines) - 1:
-                    # Line is short, title case, and has text before and after it - likely a heading
-                    section_title = line
-                    is_heading = True
-                
-                # Handle section change or add content to current section
-                if is_heading and section_title:
-                    current_section = section_title
-                    if current_section not in sections:
-                        sections[current_section] = ""
-                    sections[current_section] += f"\n\n## {current_section}\n\n"
-                else:
-                    # Add content to current section
-                    sections[current_section] += line + "\n"
-            
-            # Add a fallback section with the entire document if sections are too small
-            total_content_length = sum(len(content) for content in sections.values())
-            if total_content_length < 100 or len(sections) <= 1:
-                sections = {"Full Document": full_text}
-            
-            # Combine all sections with clear markers
-            for section_name, section_content in sections.items():
-                text_content += f"\n\n--- SECTION: {section_name} ---\n\n"
-                text_content += section_content.strip() + "\n\n"
-                
         return text_content, page_count
         
     except Exception as e:
@@ -235,224 +874,342 @@ def chunk_document_by_sections(text_content, max_chunk_size=8000, overlap=500):
     """
     Split the document into chunks based on sections.
     
+    Chunks are ChunkSpan objects: offsets into one shared buffer rather than
+    copies of the text, so overlapping chunks cost nothing extra. Use
+    `.content` / `.to_dict()` to get the text.
+    
     Args:
         text_content: The extracted text with section markers
         max_chunk_size: Maximum size of each chunk in characters
         overlap: Overlap between chunks in characters
         
     Returns:
-        List of chunks with section information
+        List of ChunkSpan chunks with section information
     """
-    # Split by section markers
-    import re
-    
     # Look for section markers like "--- SECTION: Introduction ---"
-    section_splits = re.split(r'\n\n---\s*SECTION:\s*([^-]+)\s*---\n\n', text_content)
+    # (iterated rather than split, so the sections are never all copied out at once)
+    markers = list(SECTION_MARKER_PATTERN.finditer(text_content))
     
-    # First item might be text before any section marker
-    chunks = []
-    current_chunk = {"title": "Document Start", "content": ""}
-    
-    if not section_splits or len(section_splits) <= 1:
+    if not markers:
         # If no sections found, create a single chunk with the entire content
-        chunks = [{"title": "Full Document", "content": text_content}]
-        return chunks
+        return [ChunkSpan(text_content, 0, len(text_content), "Full Document")]
+    
+    # The formatted sections are laid out back to back in one buffer; each chunk
+    # is a range of it, and its overlap is just the text right before that range
+    buffer_parts = []
+    position = 0
+    chunks = []
+    chunk_start = 0
+    chunk_title = "Document Start"
     
-    if section_splits[0].strip() and not section_splits[0].strip().startswith('---'):
-        current_chunk["content"] = section_splits[0]
+    # First item might be text before any section marker
+    leading_text = text_content[:markers[0].start()]
+    if leading_text.strip() and not leading_text.strip().startswith('---'):
+        buffer_parts.append(leading_text)
+        position += len(leading_text)
     
     # Process each section
-    for i in range(1, len(section_splits), 2):
-        if i < len(section_splits):
-            section_title = section_splits[i].strip()
-            section_content = section_splits[i+1] if i+1 < len(section_splits) else ""
-            
-            # Make sure the section has actual content
-            if not section_content.strip():
-                continue
-                
-            # Format section content for readability
-            formatted_section = f"\n\n## {section_title}\n\n{section_content.strip()}\n\n"
+    for i, marker in enumerate(markers):
+        section_title = marker.group(1).strip()
+        content_end = markers[i + 1].start() if i + 1 < len(markers) else len(text_content)
+        section_content = text_content[marker.end():content_end].strip()
+        
+        # Make sure the section has actual content
+        if not section_content:
+            continue
             
-            # If adding this section would exceed max_chunk_size, start a new chunk
-            if len(current_chunk["content"]) + len(formatted_section) > max_chunk_size and current_chunk["content"]:
-                chunks.append(current_chunk)
-                # Start new chunk with overlap from previous content if needed
-                overlap_content = ""
-                if overlap > 0 and current_chunk["content"]:
-                    overlap_content = current_chunk["content"][-overlap:]
-                current_chunk = {
-                    "title": section_title,
-                    "content": overlap_content + formatted_section
-                }
-            else:
-                # Add to current chunk
-                current_chunk["content"] += formatted_section
+        # Format section content for readability
+        formatted_section = f"\n\n## {section_title}\n\n{section_content}\n\n"
+        
+        # If adding this section would exceed max_chunk_size, start a new chunk
+        chunk_length = position - chunk_start
+        if chunk_length + len(formatted_section) > max_chunk_size and chunk_length > 0:
+            chunks.append(ChunkSpan(None, chunk_start, position, chunk_title))
+            # Start new chunk with overlap from previous content if needed
+            chunk_start = position - min(overlap, chunk_length) if overlap > 0 else position
+            chunk_title = section_title
+        
+        buffer_parts.append(formatted_section)
+        position += len(formatted_section)
     
     # Don't forget the last chunk
-    if current_chunk["content"]:
-        chunks.append(current_chunk)
+    if position > chunk_start:
+        chunks.append(ChunkSpan(None, chunk_start, position, chunk_title))
+    
+    buffer = "".join(buffer_parts)
+    del buffer_parts
+    for chunk in chunks:
+        chunk.buffer = buffer
     
     # If no chunks were created, or all chunks are too small, something went wrong with section detection
     # Create a single chunk with the entire document content
-    if not chunks or all(len(chunk["content"]) < 200 for chunk in chunks):
-        return [{"title": "Full Document", "content": text_content}]
+    if not chunks or all(len(chunk) < 200 for chunk in chunks):
+        return [ChunkSpan(text_content, 0, len(text_content), "Full Document")]
     
-    # For chunks that are still too large, split them further
+    # For chunks that are still too large, split them further by paragraphs
     final_chunks = []
     for chunk in chunks:
-        if len(chunk["content"]) > max_chunk_size:
-            # Split by paragraphs
-            paragraphs = re.split(r'\n\s*\n', chunk["content"])
-            sub_chunks = []
-            sub_chunk = {"title": chunk["title"], "content": ""}
-            
-            for para in paragraphs:
-                if len(sub_chunk["content"]) + len(para) > max_chunk_size and sub_chunk["content"]:
-                    sub_chunks.append(sub_chunk)
-                    overlap_content = ""
-                    if overlap > 0:
-                        overlap_content = sub_chunk["content"][-overlap:]
-                    sub_chunk = {
-                        "title": f"{chunk['title']} (continued)",
-                        "content": overlap_content + para + "\n\n"
-                    }
-                else:
-                    sub_chunk["content"] += para + "\n\n"
-            
-            if sub_chunk["content"]:
-                sub_chunks.append(sub_chunk)
-            
-            final_chunks.extend(sub_chunks)
+        if len(chunk) > max_chunk_size:
+            final_chunks.extend(pack_paragraphs(chunk.buffer, chunk.title, max_chunk_size, overlap, chunk.start, chunk.end))
         else:
             final_chunks.append(chunk)
             
     # Final check to ensure we have meaningful chunks
     if not final_chunks:
-        return [{"title": "Document Content", "content": text_content}]
+        return [ChunkSpan(text_content, 0, len(text_content), "Document Content")]
         
     return final_chunks
+
+def iter_records_until_error(records: Iterator[dict]) -> Iterator[dict]:
+    """
+    Pass records through, ending with an {"type": "error"} record if the pipeline fails.
     
-    return final_chunks
+    The status line has already gone out by the time a streamed pipeline runs,
+    so that record is how a client learns the stream is incomplete.
+    """
+    try:
+        yield from records
+    except Exception as e:
+        print(f"Error while streaming: {e}")
+        yield {"type": "error", "error": str(e)}
+
+def ndjson_response(records: Iterator[dict], on_close: Optional[Callable[[], None]] = None, encoding: Optional[ResponseEncoding] = None) -> StreamingResponse:
+    """
+    Stream records, pulling each one from the (blocking) pipeline in a worker thread.
+    
+    Records are NDJSON lines unless encoding (negotiated from the request)
+    says otherwise, and the error record goes through the same encoder and
+    compressor. on_close (e.g. releasing the upload) runs when the stream
+    ends, however it ends.
+    """
+    encoding = encoding or ResponseEncoding()
+    messages = encoding.iter_records(iter_records_until_error(records))
+    
+    async def body():
+        try:
+            async for message in iterate_in_threadpool(messages):
+                yield message
+        except Exception as e:
+            # Only the encoder itself fails here; nothing more can be written to a broken stream
+            print(f"Error while encoding a stream: {e}")
+        finally:
+            # Stops any page extraction still in flight if the client went away
+            messages.close()
+            if on_close is not None:
+                on_close()
+    
+    return StreamingResponse(body(), media_type=encoding.media_type(streaming=True), headers=encoding.headers())
+
+async def read_upload(file: UploadFile) -> SpooledUpload:
+    """Ingest an upload with ingest_upload(), answering 413 if it's over the size limit."""
+    try:
+        with timed("upload_read"):
+            upload = await ingest_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    extension = os.path.splitext(file.filename or "")[1].lower().lstrip(".")
+    documents_processed.inc(1, extension if extension in ("pdf", "txt") else "other")
+    bytes_processed.inc(upload.size, "upload_read")
+    return upload
+
+async def stream_pdf_chunks(filename, upload, max_chunk_size, overlap, chunk_unit, on_close=None, encoding=None, fields=None):
+    """
+    Streaming /api/chunk for a PDF.
+    
+    A cached extraction is chunked straight away; otherwise pages are
+    extracted, segmented and chunked as one generator pipeline, so chunks go
+    out while later pages are still being read. Records are written with
+    encoding, keeping only fields (None for all).
+    """
+    key = ExtractionCache.make_key(upload.sha256, EXTRACTOR_VERSION)
+    cached = await run_in_threadpool(extraction_cache.get, key)
+    if cached is not None:
+        text_content, page_count = cached
+        progress = None
+        pieces = [text_content]
+    else:
+        page_count = 0
+        progress = PageProgress()
+        outline = await run_in_threadpool(read_outline, upload) if DEFAULT_SEGMENTATION == "auto" else []
+        pieces = iter_pdf_sections(progress.track(page_extractor.iter_pages(upload)), outline)
+    
+    if chunk_unit == "tokens":
+        chunks = iter_token_chunks(pieces, max_chunk_size, overlap)
+    else:
+        chunks = iter_section_chunks(pieces, max_chunk_size, overlap)
+    records = iter_selected(iter_chunk_records(filename, chunks, progress, page_count), fields)
+    return ndjson_response(records, on_close, encoding)
+
+# Fields that fields= can select: the buffered responses' and those of their streamed records
+CHUNK_FIELDS = ("filename", "page_count", "chunk_count", "chunks", "page", "char_count", "index", "title", "content", "token_count")
+DEBUG_EXTRACTION_FIELDS = ("filename", "page_count", "section_count", "char_count", "word_count", "text_sample", "full_text", "page", "text")
+
+def negotiate_response(request: Request, fields: Optional[str], allowed_fields):
+    """The request's ResponseEncoding and selected fields, answering 400 for unknown fields."""
+    try:
+        selected = parse_fields(fields, allowed_fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ResponseEncoding.negotiate(request.headers.get("accept"), request.headers.get("accept-encoding")), selected
 
 @app.post("/api/chunk")
 async def chunk_document(
+    request: Request,
     file: UploadFile = File(...),
     api_key: str = Form(...),
     max_chunk_size: int = Form(5000),
-    overlap: int = Form(200)
+    overlap: int = Form(200),
+    chunk_unit: str = Form("chars"),
+    stream: bool = Form(False),
+    fields: Optional[str] = Form(None)
 ):
     """
     Process a document and return it chunked by sections.
     This endpoint demonstrates the section-based chunking capability.
+    
+    With chunk_unit="tokens", max_chunk_size and overlap are measured in
+    tokens instead of characters, and each chunk reports its token_count.
+    
+    With stream=true the response is NDJSON: page records as pages are
+    extracted, a record per chunk as soon as it's ready, then a "done"
+    record (see streaming.iter_chunk_records).
+    
+    The body is JSON or MessagePack (Accept), optionally gzip or zstd
+    compressed (Accept-Encoding); fields is a comma-separated list of the
+    fields to send (see response_encoding).
     """
+    if chunk_unit not in ("chars", "tokens"):
+        raise HTTPException(status_code=400, detail="chunk_unit must be 'chars' or 'tokens'")
+    if max_chunk_size < 1:
+        raise HTTPException(status_code=400, detail="max_chunk_size must be at least 1")
+    if overlap < 0 or overlap >= max_chunk_size:
+        raise HTTPException(status_code=400, detail="overlap must be at least 0 and less than max_chunk_size")
+    encoding, selected = negotiate_response(request, fields, CHUNK_FIELDS)
+    
     try:
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False) as temp:
-            content = await file.read()
-            temp.write(content)
-            temp_path = temp.name
-        
-        # Process based on file type
-        if file.filename.lower().endswith('.pdf'):
-            # Extract text with section detection
-            text_content, page_count = extract_text_from_pdf(temp_path)
-            
-            # Chunk the document by sections
-            chunks = chunk_document_by_sections(text_content, max_chunk_size, overlap)
+        # The upload is released when this block exits, unless a streamed response takes it over
+        with ExitStack() as cleanup:
+            upload = await read_upload(file)
+            cleanup.callback(upload.close)
             
-            # Clean up temp file
-            os.unlink(temp_path)
-            
-            return {
-                "filename": file.filename,
-                "page_count": page_count,
-                "chunk_count": len(chunks),
-                "chunks": chunks
-            }
-            
-        elif file.filename.lower().endswith('.txt'):
-            # For text files, read the content and apply simple chunking
-            with open(temp_path, 'r', errors='ignore') as f:
-                text_content = f.read()
-            
-            # Apply paragraph-based chunking for text files
-            chunks = []
-            import re
-            paragraphs = re.split(r'\n\s*\n', text_content)
-            
-            current_chunk = {"title": "Text Document", "content": ""}
-            for para in paragraphs:
-                if len(current_chunk["content"]) + len(para) > max_chunk_size and current_chunk["content"]:
-                    chunks.append(current_chunk)
-                    # Start new chunk with overlap
-                    overlap_content = ""
-                    if overlap > 0:
-                        overlap_content = current_chunk["content"][-overlap:]
-                    current_chunk = {
-                        "title": "Text Document (continued)",
-                        "content": overlap_content + para + "\n\n"
-                    }
-                else:
-                    current_chunk["content"] += para + "\n\n"
-            
-            if current_chunk["content"]:
-                chunks.append(current_chunk)
-            
-            # Clean up temp file
-            os.unlink(temp_path)
-            
-            return {
-                "filename": file.filename,
-                "page_count": 1,
-                "chunk_count": len(chunks),
-                "chunks": chunks
-            }
-        else:
-            # Unsupported file type
-            os.unlink(temp_path)
-            raise HTTPException(status_code=400, detail="Unsupported file type. Only PDF and TXT files are supported.")
+            # Process based on file type
+            if file.filename.lower().endswith('.pdf'):
+                if stream:
+                    response = await stream_pdf_chunks(file.filename, upload, max_chunk_size, overlap, chunk_unit, upload.close, encoding, selected)
+                    cleanup.pop_all()
+                    return response
+                
+                # Extract text with section detection
+                text_content, page_count = await extract_pdf_cached(upload)
+                
+                # Chunk the document by sections, off the event loop (the first token
+                # chunking also loads the tokenizer, which may download its encoding)
+                with timed("chunking"):
+                    if chunk_unit == "tokens":
+                        chunks = await run_in_threadpool(chunk_document_by_tokens, text_content, max_chunk_size, overlap)
+                    else:
+                        # Chunk text is only materialized here, as the response is built
+                        chunks = await run_in_threadpool(
+                            lambda: [chunk.to_dict() for chunk in chunk_document_by_sections(text_content, max_chunk_size, overlap)]
+                        )
+                
+                return encoding.response(select_fields({
+                    "filename": file.filename,
+                    "page_count": page_count,
+                    "chunk_count": len(chunks),
+                    "chunks": chunks
+                }, selected))
+                
+            elif file.filename.lower().endswith('.txt'):
+                # For text files, read the content and apply simple chunking
+                text_content = upload.text()
+                upload.close()
+                
+                if stream:
+                    chunks = iter_text_chunks(text_content, max_chunk_size, overlap, chunk_unit)
+                    return ndjson_response(iter_selected(iter_chunk_records(file.filename, chunks), selected), encoding=encoding)
+                
+                # Token budgets pack paragraphs the same way, measured in tokens
+                if chunk_unit == "tokens":
+                    with timed("chunking"):
+                        chunks = await run_in_threadpool(chunk_text_by_tokens, text_content, max_chunk_size, overlap)
+                    return encoding.response(select_fields({
+                        "filename": file.filename,
+                        "page_count": 1,
+                        "chunk_count": len(chunks),
+                        "chunks": chunks
+                    }, selected))
+                
+                # Apply paragraph-based chunking for text files
+                # (chunk text is only materialized here, as the response is built)
+                with timed("chunking"):
+                    chunks = [chunk.to_dict() for chunk in pack_paragraphs(text_content, "Text Document", max_chunk_size, overlap)]
+                
+                return encoding.response(select_fields({
+                    "filename": file.filename,
+                    "page_count": 1,
+                    "chunk_count": len(chunks),
+                    "chunks": chunks
+                }, selected))
+            else:
+                # Unsupported file type
+                raise HTTPException(status_code=400, detail="Unsupported file type. Only PDF and TXT files are supported.")
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in chunk_document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Debug endpoint to check PDF extraction
 @app.post("/api/debug-extraction")
-async def debug_extraction(file: UploadFile = File(...)):
+async def debug_extraction(request: Request, file: UploadFile = File(...), stream: bool = Form(False), fields: Optional[str] = Form(None)):
     """
     Debug endpoint that returns the raw extracted text from a PDF.
     Useful for troubleshooting PDF extraction issues.
+    
+    With stream=true the response is NDJSON: one record per page with its
+    text as soon as it's extracted, then a "done" record with the totals,
+    instead of one body holding the whole text.
+    
+    Encodings and fields work as for /api/chunk, e.g. fields without
+    full_text (and text, when streaming) to get just the counts.
     """
+    encoding, selected = negotiate_response(request, fields, DEBUG_EXTRACTION_FIELDS)
     try:
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False) as temp:
-            content = await file.read()
-            temp.write(content)
-            temp_path = temp.name
-        
-        if file.filename.lower().endswith('.pdf'):
-            text_content, page_count = extract_text_from_pdf(temp_path)
+        # The upload is released when this block exits, unless the streamed response takes it over
+        with ExitStack() as cleanup:
+            upload = await read_upload(file)
+            cleanup.callback(upload.close)
             
-            # Clean up temp file
-            os.unlink(temp_path)
-            
-            # Count sections
-            section_count = text_content.count("--- SECTION:")
-            
-            return {
-                "filename": file.filename,
-                "page_count": page_count,
-                "section_count": section_count,
-                "char_count": len(text_content),
-                "word_count": len(text_content.split()),
-                "text_sample": text_content[:1000] + "...(truncated)",
-                "full_text": text_content  # Return the full extracted text
-            }
-        else:
-            os.unlink(temp_path)
-            return {"error": "Only PDF files are supported by this debug endpoint"}
+            if file.filename.lower().endswith('.pdf'):
+                if stream:
+                    # The same outline-first segmentation as the buffered path
+                    outline = await run_in_threadpool(read_outline, upload) if DEFAULT_SEGMENTATION == "auto" else []
+                    records = iter_selected(iter_extraction_records(file.filename, page_extractor.iter_pages(upload), outline), selected)
+                    response = ndjson_response(records, upload.close, encoding)
+                    cleanup.pop_all()
+                    return response
+                
+                text_content, page_count = await extract_pdf_cached(upload)
+                
+                # Count sections
+                section_count = text_content.count("--- SECTION:")
+                
+                return encoding.response(select_fields({
+                    "filename": file.filename,
+                    "page_count": page_count,
+                    "section_count": section_count,
+                    "char_count": len(text_content),
+                    "word_count": len(text_content.split()),
+                    "text_sample": text_content[:1000] + "...(truncated)",
+                    "full_text": text_content  # Return the full extracted text
+                }, selected))
+            else:
+                return {"error": "Only PDF files are supported by this debug endpoint"}
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in debug extraction: {e}")
         return {"error": str(e)}
@@ -460,7 +1217,29 @@ async def debug_extraction(file: UploadFile = File(...)):
 # Define the health check endpoint to verify API status
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "extraction_cache": extraction_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "retrieval_indexes": index_cache.stats(),
+        "retrieval_chunk_entries": chunk_entries.stats(),
+        "response_cache": response_cache.stats(),
+        "context_compression": compression_stats.stats(),
+        "threads": thread_store.stats(),
+    }
+
+# Pre-loads the lazily imported dependencies, e.g. from a scheduled ping that keeps an instance warm
+@app.get("/api/warmup")
+async def warmup():
+    try:
+        return {"status": "ok", "seconds": await warm_up()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Warm-up failed: {str(e)}")
+
+# Prometheus scrape endpoint: stage latency histograms and document/page/byte counters
+@app.get("/api/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
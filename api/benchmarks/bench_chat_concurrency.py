@@ -0,0 +1,135 @@
+"""
+Concurrency check for the /api/chat streaming path.
+
+Runs N chats at once against a fake OpenAI upstream (no network, no API
+spend) and compares the wall-clock time to a single chat. With a
+non-blocking event loop, N concurrent chats should finish in about the time
+of one.
+
+Usage (from the api directory):
+    python benchmarks/bench_chat_concurrency.py --concurrency 20 --token-delay 0.02
+
+tests/test_chat_concurrency.py runs the same check under pytest.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+# Make the api modules importable when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from openai_pool import OpenAIClientPool
+
+
+class _FakeSSEStream(httpx.AsyncByteStream):
+    """Streams chat.completion.chunk events with a delay between tokens."""
+
+    def __init__(self, tokens, token_delay):
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    async def __aiter__(self):
+        for token in self.tokens:
+            await asyncio.sleep(self.token_delay)
+            event = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "fake-model",
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(event)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+
+def make_fake_client_factory(token_count, token_delay, requests=None):
+    """
+    Build a client factory whose clients talk to an in-process fake upstream.
+
+    Every upstream request is appended to requests, when it's given.
+    """
+    tokens = [f"tok{i} " for i in range(token_count)]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if requests is not None:
+            requests.append(request)
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            stream=_FakeSSEStream(tokens, token_delay),
+        )
+
+    def factory(api_key):
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url="http://fake-upstream/v1",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+
+    return factory
+
+
+async def run_chats(client, count):
+    """Fire `count` chats concurrently and return the elapsed wall-clock time."""
+    payload = {
+        "developer_message": "You are a helpful assistant.",
+        "user_message": "Summarize the document.",
+        "api_key": "sk-fake",
+        # Every chat has to reach the upstream; a replayed answer would hide a blocked event loop
+        "cache": False,
+    }
+
+    async def one_chat():
+        response = await client.post("/api/chat", json=payload)
+        response.raise_for_status()
+        return response.text
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one_chat() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    assert all(results), "every chat should stream back some text"
+    return elapsed
+
+
+async def main(args):
+    app_module.client_pool = OpenAIClientPool(
+        max_concurrency_per_key=args.concurrency,
+        client_factory=make_fake_client_factory(args.tokens, args.token_delay),
+    )
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        # Warm up once so client creation isn't counted
+        await run_chats(client, 1)
+        single = await run_chats(client, 1)
+        concurrent = await run_chats(client, args.concurrency)
+
+    await app_module.client_pool.aclose()
+
+    ratio = concurrent / single
+    print(f"1 chat:            {single:.3f}s")
+    print(f"{args.concurrency} concurrent chats: {concurrent:.3f}s")
+    print(f"ratio:             {ratio:.2f}x (ideal ~1.0x, fully blocking ~{args.concurrency}x)")
+
+    if ratio > args.max_ratio:
+        print(f"FAIL: concurrent chats took more than {args.max_ratio}x a single chat")
+        return 1
+    print("OK: concurrent chats did not serialize on the event loop")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20, help="number of simultaneous chats")
+    parser.add_argument("--tokens", type=int, default=20, help="tokens streamed per chat")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake upstream delay per token (s)")
+    parser.add_argument("--max-ratio", type=float, default=2.0, help="fail if concurrent/single exceeds this")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,218 @@
+"""
+Load test of /api/chat against the fake OpenAI upstream.
+
+Starts the fake upstream (fake_openai.py) and the app under uvicorn, each in
+its own process, with the app's OPENAI_BASE_URL pointing at the fake. Then it
+drives /api/chat over real HTTP with a fixed number of concurrent clients,
+each sending its next request as soon as the last one finishes. Reports p50,
+p95 and p99 time to first byte (TTFT) and total latency, plus throughput.
+Pass --target to load an app that is already running (pointed at any
+upstream) instead.
+
+Every request, warm-up included, asks a different question, so the response
+cache doesn't answer them; use --repeat to measure cache hits instead. All requests share
+one API key unless --api-keys says otherwise, so the pool's per-key limit
+(OPENAI_POOL_MAX_CONCURRENCY_PER_KEY) applies to the whole run.
+
+Usage (from the api directory):
+    python benchmarks/bench_chat_load.py --concurrency 32 --requests 500 --ttft 0.3 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from typing import List, Optional, Tuple
+
+import httpx
+
+from fake_openai import add_upstream_arguments
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linearly interpolated percentile of already sorted values."""
+    if not sorted_values:
+        return float("nan")
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def start_process(stack: ExitStack, command: List[str], env: Optional[dict] = None) -> subprocess.Popen:
+    process = subprocess.Popen(command, cwd=API_DIR, env=env)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    stack.callback(stop)
+    return process
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} wasn't ready after {timeout}s")
+
+
+class Sample:
+    __slots__ = ("ttft", "total", "bytes", "error")
+
+    def __init__(self, ttft: Optional[float], total: float, received: int, error: Optional[str]):
+        self.ttft = ttft
+        self.total = total
+        self.bytes = received
+        self.error = error
+
+
+async def one_chat(client: httpx.AsyncClient, target: str, index: int, repeat: bool, api_keys: int) -> Sample:
+    payload = {
+        "developer_message": "You are a helpful assistant.",
+        "user_message": "Summarize the document." if repeat else f"Summarize the document. (request {index})",
+        "api_key": f"sk-fake-{index % api_keys}",
+    }
+    start = time.perf_counter()
+    ttft = None
+    received = 0
+    try:
+        async with client.stream("POST", f"{target}/api/chat", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return Sample(None, time.perf_counter() - start, 0, f"HTTP {response.status_code}")
+            async for data in response.aiter_raw():
+                if ttft is None and data:
+                    ttft = time.perf_counter() - start
+                received += len(data)
+    except httpx.HTTPError as e:
+        # An upstream error after the 200 went out shows up as a cut-off stream
+        return Sample(ttft, time.perf_counter() - start, received, type(e).__name__)
+    if not received:
+        return Sample(None, time.perf_counter() - start, 0, "empty response")
+    return Sample(ttft, time.perf_counter() - start, received, None)
+
+
+async def run_load(target: str, concurrency: int, request_count: int, repeat: bool, api_keys: int = 1, first_index: int = 0) -> Tuple[List[Sample], float]:
+    """
+    Run request_count chats from concurrency clients; returns the samples and the wall-clock time.
+
+    Questions are numbered from first_index, so runs against the same app can
+    be kept from asking (and being answered from the cache) the same ones.
+    """
+    samples: List[Sample] = []
+    next_index = first_index
+    end_index = first_index + request_count
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0)) as client:
+        async def worker():
+            nonlocal next_index
+            while next_index < end_index:
+                index = next_index
+                next_index += 1
+                samples.append(await one_chat(client, target, index, repeat, api_keys))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.perf_counter() - start
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    ok = [sample for sample in samples if sample.error is None]
+    ttfts = sorted(sample.ttft for sample in ok)
+    totals = sorted(sample.total for sample in ok)
+    errors = {}
+    for sample in samples:
+        if sample.error is not None:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "bytes_per_second": sum(sample.bytes for sample in ok) / elapsed if elapsed else 0.0,
+        "ttft_seconds": {name: percentile(ttfts, fraction) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "total_seconds": {name: percentile(totals, fraction) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+    }
+
+
+async def main(args):
+    with ExitStack() as stack:
+        target = args.target
+        if target is None:
+            upstream_port = free_port()
+            upstream = start_process(stack, [
+                sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(upstream_port),
+                "--ttft", str(args.ttft), "--tokens-per-second", str(args.tokens_per_second), "--tokens", str(args.tokens),
+                "--error-rate", str(args.error_rate), "--error-status", str(args.error_status), "--seed", str(args.seed),
+            ])
+            await wait_until_ready(f"http://127.0.0.1:{upstream_port}/v1/models", upstream)
+
+            app_port = free_port()
+            env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{upstream_port}/v1")
+            app_process = start_process(stack, [
+                sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning",
+            ], env)
+            target = f"http://127.0.0.1:{app_port}"
+            await wait_until_ready(f"{target}/api/health", app_process)
+
+        # Warm up connections and clients so start-up isn't counted
+        await run_load(target, min(args.concurrency, args.warmup), args.warmup, args.repeat, args.api_keys)
+        # The measured questions follow the warm-up's, so none of them are already cached
+        samples, elapsed = await run_load(target, args.concurrency, args.requests, args.repeat, args.api_keys, first_index=args.warmup)
+
+    results = summarize(samples, elapsed)
+    results["concurrency"] = args.concurrency
+    print(f"{results['ok']}/{results['requests']} ok at concurrency {args.concurrency} in {elapsed:.2f}s "
+          f"({results['requests_per_second']:.1f} req/s, {results['bytes_per_second'] / 1024:.1f} KiB/s)")
+    if results["errors"]:
+        print("errors: " + ", ".join(f"{name} x{count}" for name, count in sorted(results["errors"].items())))
+    print(f"{'':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, key in (("TTFT", "ttft_seconds"), ("total", "total_seconds")):
+        values = results[key]
+        print(f"{label:>8} {values['p50']:>8.3f} {values['p95']:>8.3f} {values['p99']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous clients")
+    parser.add_argument("--requests", type=int, default=200, help="chats to send in total")
+    parser.add_argument("--warmup", type=int, default=4, help="chats sent (and not counted) before the run")
+    parser.add_argument("--repeat", action="store_true", help="send the same question every time (response cache hits)")
+    parser.add_argument("--api-keys", type=int, default=1, help="distinct (fake) API keys to spread requests over")
+    parser.add_argument("--target", help="base URL of an already running app; by default one is started")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    add_upstream_arguments(parser)
+    sys.exit(asyncio.run(main(parser.parse_args())))
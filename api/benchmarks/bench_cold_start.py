@@ -0,0 +1,162 @@
+"""
+Cold-start benchmark: app import time and first-request latency.
+
+Each run starts a fresh Python process, the way a serverless platform starts
+a new instance, and times in it:
+
+    import     import app (module-level set-up included)
+    warm_up    app.warm_up(), in the "warm" mode only
+    health     the first GET /api/health
+    upload     the first POST /api/upload, of a small generated PDF
+    chat       the first POST /api/chat, streamed from the fake upstream
+    chat_again a second chat, for comparison with a warm instance
+
+Requests go through httpx's ASGI transport, so no server start-up is counted,
+while chats really do go over HTTP to fake_openai.py (started for you), so
+the OpenAI client's first use is. Runs alternate between the "lazy" mode (a
+plain cold start) and the "warm" mode, and the medians are reported.
+
+--json saves the medians; --baseline compares them with an earlier run's and
+exits with 1 if any got more than --max-slowdown slower, so cold-start
+regressions can be caught in CI.
+
+Usage (from the api directory):
+    python benchmarks/bench_cold_start.py --runs 5 --json head.json --baseline base.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from typing import Dict, List
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+MODES = ("lazy", "warm")
+STEPS = ("import", "warm_up", "health", "upload", "chat", "chat_again")
+
+
+async def measure_instance(warm: bool) -> Dict[str, float]:
+    """Time the import and first requests in this (fresh) process."""
+    start = time.perf_counter()
+    import app as appmod
+    timings = {"import": time.perf_counter() - start}
+
+    # Imported after the app, so their import time isn't counted against it
+    import httpx
+    from synthetic import make_pdf, synthetic_pages
+
+    if warm:
+        start = time.perf_counter()
+        await appmod.warm_up()
+        timings["warm_up"] = time.perf_counter() - start
+
+    pdf = make_pdf(synthetic_pages(4, seed=0))
+    chat = {"developer_message": "You are a helpful assistant.", "user_message": "Hello", "api_key": "sk-fake"}
+    transport = httpx.ASGITransport(app=appmod.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60) as client:
+        start = time.perf_counter()
+        (await client.get("/api/health")).raise_for_status()
+        timings["health"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = await client.post("/api/upload", files={"file": ("cold.pdf", pdf, "application/pdf")}, data={"api_key": "sk-fake"})
+        response.raise_for_status()
+        timings["upload"] = time.perf_counter() - start
+
+        for step, message in (("chat", "Hello"), ("chat_again", "Hello again")):
+            start = time.perf_counter()
+            async with client.stream("POST", "/api/chat", json=dict(chat, user_message=message)) as response:
+                response.raise_for_status()
+                async for _ in response.aiter_raw():
+                    pass
+            timings[step] = time.perf_counter() - start
+    return timings
+
+
+def run_instance(mode: str, env: dict) -> Dict[str, float]:
+    """One cold start in a new process; returns its timings."""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--instance", mode],
+        cwd=API_DIR, env=env, check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    # The app may print to stdout too; the timings are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(medians: Dict[str, Dict[str, float]], baseline_path: str, max_slowdown: float, min_seconds: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = json.load(f)["medians"]
+    failures = []
+    print(f"\nvs {baseline_path}:")
+    for mode, steps in medians.items():
+        for step, seconds in steps.items():
+            base = baseline.get(mode, {}).get(step)
+            if base is None:
+                continue
+            change = (seconds - base) / base if base else 0.0
+            failed = change > max_slowdown and seconds >= min_seconds
+            print(f"{mode:>5} {step:>10} {base:>8.3f} -> {seconds:>8.3f} {change:>+8.1%}{'  FAIL' if failed else ''}")
+            if failed:
+                failures.append(f"{mode} {step}")
+    return failures
+
+
+def main(args) -> int:
+    # Only the parent needs these; an instance must not import httpx before the app
+    from bench_chat_load import BENCHMARKS_DIR, free_port, start_process, wait_until_ready
+
+    samples: Dict[str, List[Dict[str, float]]] = {mode: [] for mode in args.modes}
+    with ExitStack() as stack:
+        upstream_port = free_port()
+        upstream = start_process(stack, [
+            sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(upstream_port),
+            "--ttft", "0", "--tokens-per-second", "0", "--tokens", "8",
+        ])
+        asyncio.run(wait_until_ready(f"http://127.0.0.1:{upstream_port}/v1/models", upstream))
+        env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{upstream_port}/v1", WARM_UP="0")
+
+        for _ in range(args.runs):
+            for mode in args.modes:
+                samples[mode].append(run_instance(mode, env))
+
+    medians = {
+        mode: {step: statistics.median(run[step] for run in runs) for step in STEPS if step in runs[0]}
+        for mode, runs in samples.items()
+    }
+    print(f"median of {args.runs} cold starts, seconds")
+    print(f"{'mode':>5} " + " ".join(f"{step:>10}" for step in STEPS))
+    for mode, steps in medians.items():
+        print(f"{mode:>5} " + " ".join(f"{steps[step]:>10.3f}" if step in steps else f"{'-':>10}" for step in STEPS))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": args.runs, "medians": medians}, f, indent=2)
+    if args.baseline:
+        failures = compare(medians, args.baseline, args.max_slowdown, args.min_seconds)
+        if failures:
+            print(f"{len(failures)} regression(s): {', '.join(failures)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per mode (the median is kept)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="lazy: plain cold start; warm: app.warm_up() first")
+    parser.add_argument("--json", help="also write the medians to this JSON file")
+    parser.add_argument("--baseline", help="medians of an earlier run (--json) to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=0.15, help="allowed time increase vs the baseline (0.15 = 15%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="steps faster than this can't fail")
+    parser.add_argument("--instance", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.instance:
+        print(json.dumps(asyncio.run(measure_instance(args.instance == "warm"))))
+        sys.exit(0)
+    sys.exit(main(args))
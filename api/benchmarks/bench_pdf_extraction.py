@@ -0,0 +1,69 @@
+"""
+Throughput of parallel page extraction versus worker count.
+
+Generates a synthetic PDF, extracts it with PageExtractor at 1, 2, 4, ...
+workers (up to the CPU count) and reports pages/second and speed-up over the
+serial baseline. Output is checked against the serial extraction.
+
+Usage (from the api directory):
+    python benchmarks/bench_pdf_extraction.py --pages 500
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_extraction import PageExtractor, extract_page_range, count_pages
+from synthetic import make_pdf, synthetic_pages
+
+
+def worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main(args):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp:
+        temp.write(make_pdf(synthetic_pages(args.pages)))
+        pdf_path = temp.name
+
+    try:
+        expected = extract_page_range(pdf_path, 0, count_pages(pdf_path))
+        print(f"{args.pages} pages, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speed-up':>9}")
+
+        baseline = None
+        for workers in worker_counts(args.max_workers):
+            extractor = PageExtractor(max_workers=workers, min_parallel_pages=0)
+            # Warm the pool so process start-up isn't counted
+            extractor.extract_pages(pdf_path)
+
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                page_texts = extractor.extract_pages(pdf_path)
+                best = min(best, time.perf_counter() - start)
+            extractor.shutdown()
+
+            assert page_texts == expected, "parallel extraction must match serial output"
+            baseline = baseline or best
+            print(f"{workers:>8} {best:>9.3f} {args.pages / best:>9.1f} {baseline / best:>8.2f}x")
+    finally:
+        os.unlink(pdf_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500, help="pages in the synthetic PDF")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="largest worker count to try")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per worker count (best is reported)")
+    main(parser.parse_args())
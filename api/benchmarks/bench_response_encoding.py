@@ -0,0 +1,122 @@
+"""
+Benchmark: serialization time and bytes on the wire per response encoding.
+
+Builds the bodies /api/chunk and /api/debug-extraction send for each corpus
+document (corpus.py; page texts are taken straight from the generator, so no
+PDF parsing is timed) and encodes them every way response_encoding can,
+best of --repeat runs:
+
+    payloads  chunk         /api/chunk's buffered body (default chunk size)
+              chunk-stream  the same chunks as streamed records, encoded one by one
+              debug         /api/debug-extraction's body (full_text and text_sample)
+              debug-counts  the same with fields=page_count,section_count,char_count,word_count
+    formats   fastapi       FastAPI's default path: jsonable_encoder, then json.dumps
+                            (json.dumps per line for streams), always uncompressed
+              json          dumps_json (orjson when installed)
+              msgpack       MessagePack (when msgpack is installed)
+    codings   identity, gzip, zstd (when zstandard is installed)
+
+Times are encoding plus compression, in milliseconds. Bytes are what goes on
+the wire. The last column compares both with the FastAPI baseline.
+
+Usage (from the api directory):
+    python benchmarks/bench_response_encoding.py --sizes 10 100 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import response_encoding
+from app import chunk_document_by_sections
+from corpus import generate_document
+from response_encoding import ResponseEncoding, select_fields
+from section_segmenter import join_pages, segment_sections
+from streaming import iter_chunk_records
+
+# /api/chunk's defaults
+MAX_CHUNK_SIZE = 5000
+CHUNK_OVERLAP = 200
+DEBUG_COUNT_FIELDS = frozenset(("page_count", "section_count", "char_count", "word_count"))
+
+
+def build_payloads(page_count: int, seed: int) -> Dict[str, object]:
+    document = generate_document(page_count, seed=seed)
+    text_content = segment_sections(join_pages(["\n".join(lines) for lines in document.pages]))
+    chunks = [chunk.to_dict() for chunk in chunk_document_by_sections(text_content, MAX_CHUNK_SIZE, CHUNK_OVERLAP)]
+    debug = {
+        "filename": "doc.pdf",
+        "page_count": page_count,
+        "section_count": text_content.count("--- SECTION:"),
+        "char_count": len(text_content),
+        "word_count": len(text_content.split()),
+        "text_sample": text_content[:1000] + "...(truncated)",
+        "full_text": text_content,
+    }
+    return {
+        "chunk": {"filename": "doc.pdf", "page_count": page_count, "chunk_count": len(chunks), "chunks": chunks},
+        "chunk-stream": list(iter_chunk_records("doc.pdf", chunks, page_count=page_count)),
+        "debug": debug,
+        "debug-counts": select_fields(debug, DEBUG_COUNT_FIELDS),
+    }
+
+
+def fastapi_encoder(streaming: bool) -> Callable[[object], int]:
+    """The encoding these endpoints used before response_encoding; returns the bytes sent."""
+    if streaming:
+        return lambda records: sum(len((json.dumps(record) + "\n").encode()) for record in records)
+    return lambda payload: len(JSONResponse(jsonable_encoder(payload)).body)
+
+
+def negotiated_encoder(encoding: ResponseEncoding, streaming: bool) -> Callable[[object], int]:
+    if streaming:
+        return lambda records: sum(len(message) for message in encoding.iter_records(records))
+    return lambda payload: len(encoding.response(payload).body)
+
+
+def encodings() -> List[Tuple[str, str, ResponseEncoding]]:
+    formats = ["json"] + (["msgpack"] if response_encoding.msgpack is not None else [])
+    codings = [None, "gzip"] + (["zstd"] if response_encoding.zstandard is not None else [])
+    # min_compress_bytes=0 so the small bodies are compressed too, for comparison
+    return [(format, coding or "identity", ResponseEncoding(format, coding, min_compress_bytes=0)) for format in formats for coding in codings]
+
+
+def best_time(run: Callable[[], int], repeat: int) -> Tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sent = run()
+        best = min(best, time.perf_counter() - start)
+    return best, sent
+
+
+def main(args) -> int:
+    print(f"json encoder: {'orjson' if response_encoding.orjson is not None else 'json module'}")
+    print(f"{'payload':>13} {'pages':>6} {'format':>8} {'coding':>9} {'ms':>9} {'bytes':>11} {'vs fastapi':>17}")
+    for page_count in args.sizes:
+        for name, payload in build_payloads(page_count, args.seed).items():
+            streaming = name.endswith("-stream")
+            base_seconds, base_bytes = best_time(lambda: fastapi_encoder(streaming)(payload), args.repeat)
+            print(f"{name:>13} {page_count:>6} {'fastapi':>8} {'identity':>9} {base_seconds * 1000:>9.2f} {base_bytes:>11}")
+            for format, coding, encoding in encodings():
+                encode = negotiated_encoder(encoding, streaming)
+                seconds, sent = best_time(lambda: encode(payload), args.repeat)
+                print(f"{name:>13} {page_count:>6} {format:>8} {coding:>9} {seconds * 1000:>9.2f} {sent:>11} "
+                      f"{base_seconds / seconds:>6.1f}x {sent / base_bytes:>7.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="document page counts")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per encoding (the best is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""
+Micro-benchmark for the section segmenter.
+
+Times segment_sections() on synthetic page-marked text from 1k to 10k pages
+and reports the time per page, which should stay flat if the segmenter is
+linear. The previous per-line regex loop is kept below as a reference: its
+output must match exactly, and it is timed alongside for comparison.
+
+Usage (from the api directory):
+    python benchmarks/bench_section_segmenter.py --sizes 1000 2500 5000 10000
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from section_segmenter import segment_sections
+from synthetic import synthetic_text
+
+
+def legacy_segment_sections(full_text):
+    """The original second pass of extract_text_from_pdf (minus its per-heading print)."""
+    text_content = ""
+    sections = {}
+
+    section_patterns = [
+        r'^(?:chapter|section)\s+(\d+(?:\.\d+)?)(?:\s*:\s*|\s+)(.+)$',
+        r'^(\d+(?:\.\d+)?)\s+(.+)$',
+        r'^([A-Z][A-Z\s]{4,})$',
+        r'^(introduction|background|methodology|methods|results|discussion|conclusion|references|appendix)$'
+    ]
+
+    current_section = "Document Start"
+    sections[current_section] = ""
+
+    lines = full_text.split('\n')
+    line_idx = 0
+
+    while line_idx < len(lines):
+        line = lines[line_idx].strip()
+        line_idx += 1
+
+        if not line:
+            continue
+
+        is_heading = False
+        section_title = None
+
+        for pattern in section_patterns:
+            match = re.match(pattern, line, re.IGNORECASE)
+            if match:
+                if len(match.groups()) > 1:
+                    section_title = f"{match.group(1)}: {match.group(2)}"
+                else:
+                    section_title = match.group(1)
+                is_heading = True
+                break
+
+        if not is_heading and len(line) < 50 and line.strip().istitle() and line_idx > 1 and line_idx < len(lines) - 1:
+            section_title = line
+            is_heading = True
+
+        if is_heading and section_title:
+            current_section = section_title
+            if current_section not in sections:
+                sections[current_section] = ""
+            sections[current_section] += f"\n\n## {current_section}\n\n"
+        else:
+            sections[current_section] += line + "\n"
+
+    total_content_length = sum(len(content) for content in sections.values())
+    if total_content_length < 100 or len(sections) <= 1:
+        sections = {"Full Document": full_text}
+
+    for section_name, section_content in sections.items():
+        text_content += f"\n\n--- SECTION: {section_name} ---\n\n"
+        text_content += section_content.strip() + "\n\n"
+
+    return text_content
+
+
+def best_time(func, arg, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args):
+    print(f"{'pages':>7} {'MB':>6} {'segmenter s':>12} {'us/page':>8} {'legacy s':>9} {'us/page':>8} {'speed-up':>9}")
+    for pages in args.sizes:
+        text = synthetic_text(pages, lines_per_page=args.lines_per_page)
+
+        new_time, new_output = best_time(segment_sections, text, args.repeat)
+        legacy_time, legacy_output = best_time(legacy_segment_sections, text, 1 if args.skip_legacy_repeat else args.repeat)
+        assert new_output == legacy_output, f"segmenter output differs from the legacy loop at {pages} pages"
+
+        print(
+            f"{pages:>7} {len(text) / 1e6:>6.1f} {new_time:>12.3f} {new_time / pages * 1e6:>8.1f}"
+            f" {legacy_time:>9.3f} {legacy_time / pages * 1e6:>8.1f} {legacy_time / new_time:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2500, 5000, 10000], help="page counts to test")
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size (best is reported)")
+    parser.add_argument("--skip-legacy-repeat", action="store_true", help="time the legacy loop only once")
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""
+Benchmark: outline-driven vs regex section segmentation.
+
+Each corpus document (corpus.py) is written as a PDF with an outline entry
+per heading and its pages are extracted once. Then both paths are timed on
+the same page texts, best of --repeat runs:
+
+    regex    segment_sections(join_pages(...)), matching every line against the heading patterns
+    outline  read_outline() plus segment_by_outline(), which cuts sections at the outline's pages
+
+Pages can also be salted with --traps lines per page that look like headings
+to the regex path but aren't (table rows such as "2024 Annual Total" and
+short title-cased lines), to show the false sections it makes. Sections are
+reported against the number of real headings.
+
+Usage (from the api directory):
+    python benchmarks/bench_segmentation.py --sizes 10 100 1000 --traps 2
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import CorpusDocument, generate_document
+from outline_segmenter import read_outline, segment_by_outline
+from pdf_extraction import count_pages, extract_page_range
+from section_segmenter import SECTION_MARKER_PATTERN, join_pages, segment_sections
+
+TRAP_LINES = [
+    "2024 Annual Total",
+    "12 Months Ended",
+    "Total Operating Expenses",
+    "Net Revenue By Segment",
+    "Balance At End Of Year",
+]
+
+
+def add_traps(document: CorpusDocument, traps_per_page: int, seed: int) -> CorpusDocument:
+    """A copy of document with heading look-alikes inserted into the middle of every page."""
+    rng = random.Random(seed)
+    pages = []
+    for lines in document.pages:
+        lines = list(lines)
+        for _ in range(traps_per_page):
+            lines.insert(rng.randint(2, len(lines) - 3), rng.choice(TRAP_LINES))
+        pages.append(lines)
+    return CorpusDocument(pages, document.headings, document.outline)
+
+
+def best_time(run: Callable[[], str], repeat: int) -> (float, str):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run()
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def section_count(text: str) -> int:
+    # "Document Start" isn't a heading
+    return sum(1 for match in SECTION_MARKER_PATTERN.finditer(text) if match.group(1).strip() != "Document Start")
+
+
+def main(args) -> int:
+    print(f"{'pages':>6} {'headings':>8} {'regex s':>9} {'outline s':>10} {'speedup':>8} {'regex sections':>15} {'outline sections':>17}")
+    with tempfile.TemporaryDirectory(prefix="bench-outline-") as directory:
+        for page_count in args.sizes:
+            document = generate_document(page_count, seed=args.seed)
+            if args.traps:
+                document = add_traps(document, args.traps, args.seed)
+            path = os.path.join(directory, f"doc-{page_count}p.pdf")
+            with open(path, "wb") as f:
+                f.write(document.pdf_bytes(with_outline=True))
+            page_texts: List[str] = extract_page_range(path, 0, count_pages(path))
+
+            regex_seconds, regex_text = best_time(lambda: segment_sections(join_pages(page_texts)), args.repeat)
+            outline_seconds, outline_text = best_time(lambda: segment_by_outline(page_texts, read_outline(path)), args.repeat)
+
+            print(f"{page_count:>6} {len(document.outline):>8} {regex_seconds:>9.4f} {outline_seconds:>10.4f} "
+                  f"{regex_seconds / outline_seconds:>7.1f}x {section_count(regex_text):>15} {section_count(outline_text):>17}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 2000], help="document page counts")
+    parser.add_argument("--traps", type=int, default=0, help="heading look-alikes inserted per page")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per path (the best is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,222 @@
+"""
+Extraction and chunking benchmark suite, with JSON results to compare across commits.
+
+`run` writes the deterministic corpus (corpus.py) to a temp directory and
+times each stage on every document, best of --repeat runs. A separate
+run under tracemalloc records the stage's peak Python memory. Stages:
+
+    PDF  extract_text_from_pdf       PyPDF2 parsing plus section detection, end to end
+         segment_sections            section detection alone, on the extracted page texts
+         chunk_document_by_sections  /api/chunk's default chunking of the sectioned text
+         chunk_document_by_tokens    /api/chunk?chunk_unit=tokens (cold tokenizer cache)
+    TXT  txt_chunk_chars             /api/chunk's TXT branch (paragraph packing)
+         txt_chunk_tokens            the TXT branch with chunk_unit=tokens
+
+Each result also records what the stage produced (sections, chunks, and
+any headings the segmenter missed), so `compare` can flag behaviour
+changes as well as slowdowns. `compare` exits with status 1 on a regression,
+so it can gate a deploy.
+
+Usage (from the api directory):
+    python benchmarks/bench_suite.py run --output base.json
+    ... change something ...
+    python benchmarks/bench_suite.py run --output head.json
+    python benchmarks/bench_suite.py compare base.json head.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import chunk_document_by_sections, extract_text_from_pdf
+from chunk_spans import pack_paragraphs
+from corpus import DEFAULT_SIZES, generate_document, write_corpus
+from pdf_extraction import count_pages, extract_page_range
+from section_segmenter import SECTION_MARKER_PATTERN, join_pages, segment_sections
+from token_chunking import CachedTokenizer, chunk_document_by_tokens, chunk_text_by_tokens, get_tokenizer
+
+# /api/chunk's defaults
+MAX_CHUNK_SIZE = 8000
+CHUNK_OVERLAP = 500
+MAX_CHUNK_TOKENS = 2000
+CHUNK_OVERLAP_TOKENS = 100
+
+
+def measure(stage: Callable[[], object], repeat: int) -> (float, int, object):
+    """(best seconds, peak traced bytes, output) of a stage."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = stage()
+        best = min(best, time.perf_counter() - start)
+        del output
+
+    # Peak memory comes from its own run, since tracing slows the stage down
+    tracemalloc.start()
+    try:
+        output = stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, output
+
+
+def fresh_tokenizer() -> CachedTokenizer:
+    # A new cache per run, so repeats aren't served from the previous run's blocks
+    return CachedTokenizer(get_tokenizer().tokenizer)
+
+
+def pdf_stages(path: str, expected_titles: set) -> Dict[str, Callable[[], dict]]:
+    page_texts = extract_page_range(path, 0, count_pages(path))
+    text_content, _ = extract_text_from_pdf(path, page_texts)
+
+    def sections_summary(text: str) -> dict:
+        titles = {match.group(1).strip() for match in SECTION_MARKER_PATTERN.finditer(text)}
+        return {"sections": len(titles), "missed_headings": len(expected_titles - titles), "chars": len(text)}
+
+    return {
+        "extract_text_from_pdf": lambda: sections_summary(extract_text_from_pdf(path)[0]),
+        "segment_sections": lambda: sections_summary(segment_sections(join_pages(page_texts))),
+        "chunk_document_by_sections": lambda: {"chunks": len(chunk_document_by_sections(text_content, MAX_CHUNK_SIZE, CHUNK_OVERLAP))},
+        "chunk_document_by_tokens": lambda: {"chunks": len(chunk_document_by_tokens(text_content, MAX_CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, fresh_tokenizer()))},
+    }
+
+
+def txt_stages(path: str) -> Dict[str, Callable[[], dict]]:
+    with open(path, "r", errors="ignore") as f:
+        text_content = f.read()
+    return {
+        "txt_chunk_chars": lambda: {"chunks": len(pack_paragraphs(text_content, "Text Document", MAX_CHUNK_SIZE, CHUNK_OVERLAP))},
+        "txt_chunk_tokens": lambda: {"chunks": len(chunk_text_by_tokens(text_content, MAX_CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, fresh_tokenizer()))},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> int:
+    results: List[dict] = []
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as directory:
+        manifest = write_corpus(directory, args.sizes, args.seed)
+        print(f"{'stage':<28} {'document':>14} {'seconds':>9} {'pages/s':>10} {'peak MiB':>9}  output")
+        for entry in manifest:
+            if entry["format"] == "pdf":
+                expected_titles = generate_document(entry["pages"], seed=args.seed).expected_titles()
+                stages = pdf_stages(entry["path"], expected_titles)
+            else:
+                stages = txt_stages(entry["path"])
+
+            for stage_name, stage in stages.items():
+                if args.stages and stage_name not in args.stages:
+                    continue
+                seconds, peak, output = measure(stage, args.repeat)
+                results.append({
+                    "stage": stage_name,
+                    "document": entry["name"],
+                    "pages": entry["pages"],
+                    "bytes": entry["bytes"],
+                    "seconds": seconds,
+                    "peak_bytes": peak,
+                    "output": output,
+                })
+                print(f"{stage_name:<28} {entry['name']:>14} {seconds:>9.4f} {entry['pages'] / seconds:>10.0f} "
+                      f"{peak / 2 ** 20:>9.1f}  {output}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tokenizer": get_tokenizer().name,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+
+def compare(args) -> int:
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    base_results = {(result["stage"], result["document"]): result for result in base["results"]}
+    print(f"base {base['meta']['commit']} vs head {head['meta']['commit']}")
+    print(f"{'stage':<28} {'document':>14} {'base s':>9} {'head s':>9} {'time':>8} {'base MiB':>9} {'head MiB':>9} {'memory':>8}")
+
+    failures = 0
+    for result in head["results"]:
+        key = (result["stage"], result["document"])
+        previous = base_results.get(key)
+        if previous is None:
+            continue
+        time_change = result["seconds"] / previous["seconds"] - 1 if previous["seconds"] else 0.0
+        memory_change = result["peak_bytes"] / previous["peak_bytes"] - 1 if previous["peak_bytes"] else 0.0
+
+        flags = []
+        # Stages this short are mostly noise, so they can't fail on time
+        if time_change > args.max_slowdown and result["seconds"] >= args.min_seconds:
+            flags.append("SLOWER")
+        if memory_change > args.max_memory_growth and result["peak_bytes"] >= args.min_bytes:
+            flags.append("MORE MEMORY")
+        if result["output"] != previous["output"] and not args.allow_output_changes:
+            flags.append(f"OUTPUT {previous['output']} -> {result['output']}")
+        failures += bool(flags)
+
+        print(f"{result['stage']:<28} {result['document']:>14} {previous['seconds']:>9.4f} {result['seconds']:>9.4f} "
+              f"{time_change:>+8.1%} {previous['peak_bytes'] / 2 ** 20:>9.1f} {result['peak_bytes'] / 2 ** 20:>9.1f} "
+              f"{memory_change:>+8.1%}  {' '.join(flags)}")
+
+    if base["meta"].get("cpu_count") != head["meta"].get("cpu_count") or base["meta"].get("tokenizer") != head["meta"].get("tokenizer"):
+        print("Note: the two runs were on different machines or tokenizers; timings may not be comparable")
+    if failures:
+        print(f"FAIL: {failures} regression(s)")
+        return 1
+    print("OK: no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subcommands.add_parser("run", help="run the suite and write JSON results")
+    run_parser.add_argument("--output", default="benchmark-results.json", help="JSON results file")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="corpus page counts")
+    run_parser.add_argument("--stages", nargs="+", help="only run these stages")
+    run_parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (the best is kept)")
+    run_parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subcommands.add_parser("compare", help="compare two result files; exit 1 on regressions")
+    compare_parser.add_argument("base", help="results of the baseline commit")
+    compare_parser.add_argument("head", help="results of the commit under test")
+    compare_parser.add_argument("--max-slowdown", type=float, default=0.15, help="allowed time increase (0.15 = 15%%)")
+    compare_parser.add_argument("--max-memory-growth", type=float, default=0.15, help="allowed peak memory increase")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.01, help="stages faster than this can't fail on time")
+    compare_parser.add_argument("--min-bytes", type=int, default=1024 * 1024, help="stages using less than this can't fail on memory")
+    compare_parser.add_argument("--allow-output-changes", action="store_true", help="don't fail when a stage's output changed")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
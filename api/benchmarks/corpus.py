@@ -0,0 +1,179 @@
+"""
+Deterministic benchmark corpus: PDFs and TXT files from 1 to 2,000 pages.
+
+Pages read like a contract or report. Sections start under headings that
+rotate through every heading pattern the segmenter knows (see
+HEADING_PATTERN in section_segmenter.py): "Chapter n: ...", "Section n ...",
+numbered and sub-numbered headings, ALL CAPS headings, bare keywords and
+short Title Case lines. Every page ends with a "Page n of N" footer. The
+same seed always gives byte-identical files, so results from different
+commits are comparable.
+
+Usage (from the api directory):
+    python benchmarks/corpus.py --output /tmp/corpus --sizes 1 10 100 2000
+"""
+
+import argparse
+import os
+import random
+from typing import Callable, Dict, List, Tuple
+
+from synthetic import WORDS, make_pdf
+
+# Page counts of the default corpus
+DEFAULT_SIZES = (1, 10, 100, 500, 2000)
+
+TOPICS = [
+    "Payment Terms", "Scope of Work", "Risk Factors", "Data Collection", "Market Analysis",
+    "Warranties", "Termination", "Confidentiality", "Revenue Recognition", "Study Design",
+]
+KEYWORDS = ["Introduction", "Background", "Methodology", "Methods", "Results", "Discussion", "Conclusion", "References", "Appendix"]
+
+# Each style makes (heading line, title the segmenter should give it) for a section number
+HeadingStyle = Callable[[random.Random, int], Tuple[str, str]]
+
+
+def _chapter(rng: random.Random, number: int) -> Tuple[str, str]:
+    topic = rng.choice(TOPICS)
+    return f"Chapter {number}: {topic}", f"{number}: {topic}"
+
+
+def _section(rng: random.Random, number: int) -> Tuple[str, str]:
+    topic = rng.choice(TOPICS)
+    sub = rng.randint(1, 9)
+    return f"Section {number}.{sub} {topic}", f"{number}.{sub}: {topic}"
+
+
+def _numbered(rng: random.Random, number: int) -> Tuple[str, str]:
+    topic = rng.choice(TOPICS)
+    return f"{number} {topic}", f"{number}: {topic}"
+
+
+def _sub_numbered(rng: random.Random, number: int) -> Tuple[str, str]:
+    topic = rng.choice(TOPICS)
+    sub = rng.randint(1, 9)
+    return f"{number}.{sub} {topic}", f"{number}.{sub}: {topic}"
+
+
+def _caps(rng: random.Random, number: int) -> Tuple[str, str]:
+    heading = f"{rng.choice(TOPICS).upper()} SCHEDULE"
+    return heading, heading
+
+
+def _keyword(rng: random.Random, number: int) -> Tuple[str, str]:
+    keyword = rng.choice(KEYWORDS)
+    return keyword, keyword
+
+
+def _title_case(rng: random.Random, number: int) -> Tuple[str, str]:
+    heading = f"Notes On {rng.choice(TOPICS).title()}"
+    return heading, heading
+
+
+HEADING_STYLES: Dict[str, HeadingStyle] = {
+    "chapter": _chapter,
+    "section": _section,
+    "numbered": _numbered,
+    "sub_numbered": _sub_numbered,
+    "caps": _caps,
+    "keyword": _keyword,
+    "title_case": _title_case,
+}
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+class CorpusDocument:
+    """
+    One generated document.
+
+    headings maps each heading style to the section titles it produced, and
+    outline lists every heading line with the index of its page.
+    """
+
+    __slots__ = ("pages", "headings", "outline")
+
+    def __init__(self, pages: List[List[str]], headings: Dict[str, List[str]], outline: List[Tuple[str, int]]):
+        self.pages = pages
+        self.headings = headings
+        self.outline = outline
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def expected_titles(self) -> set:
+        return {title for titles in self.headings.values() for title in titles}
+
+    def pdf_bytes(self, with_outline: bool = False) -> bytes:
+        """The PDF, optionally with an outline (bookmarks) entry per heading."""
+        return make_pdf(self.pages, self.outline if with_outline else None)
+
+    def txt(self) -> str:
+        """The text as a .txt upload would have it: paragraphs of a few lines, separated by blank lines."""
+        paragraphs = []
+        for lines in self.pages:
+            body = [line for line in lines if not line.startswith("Page ")]
+            for start in range(0, len(body), 5):
+                paragraphs.append("\n".join(body[start:start + 5]))
+        return "\n\n".join(paragraphs) + "\n"
+
+
+def generate_document(page_count: int, lines_per_page: int = 40, seed: int = 0) -> CorpusDocument:
+    """A document of page_count pages, with a new section every one or two pages."""
+    rng = random.Random(seed * 1_000_003 + page_count)
+    styles = list(HEADING_STYLES.items())
+    headings: Dict[str, List[str]] = {name: [] for name in HEADING_STYLES}
+    outline: List[Tuple[str, int]] = []
+    pages = []
+    section = 0
+    for page_num in range(page_count):
+        lines = []
+        # Section starts at the top of the page or part-way down, so headings aren't always first
+        heading_at = rng.choice((0, lines_per_page // 2)) if page_num % 2 == 0 or page_count == 1 else None
+        for line_num in range(lines_per_page - 1):
+            if line_num == heading_at:
+                section += 1
+                name, style = styles[(section - 1) % len(styles)]
+                line, title = style(rng, section)
+                lines.append(line)
+                headings[name].append(title)
+                outline.append((line, page_num))
+            else:
+                lines.append(_sentence(rng))
+        lines.append(f"Page {page_num + 1} of {page_count}")
+        pages.append(lines)
+    return CorpusDocument(pages, headings, outline)
+
+
+def write_corpus(directory: str, sizes=DEFAULT_SIZES, seed: int = 0) -> List[dict]:
+    """
+    Write doc-<pages>p.pdf and doc-<pages>p.txt for each size into directory.
+
+    Returns:
+        One {"name", "format", "pages", "path", "bytes"} entry per file
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    for page_count in sizes:
+        document = generate_document(page_count, seed=seed)
+        for extension, content in (("pdf", document.pdf_bytes()), ("txt", document.txt().encode("utf-8"))):
+            name = f"doc-{page_count}p.{extension}"
+            path = os.path.join(directory, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            manifest.append({"name": name, "format": extension, "pages": page_count, "path": path, "bytes": len(content)})
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="directory to write the corpus to")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="page counts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for entry in write_corpus(args.output, args.sizes, args.seed):
+        print(f"{entry['name']:>16} {entry['bytes']:>12,} bytes")
@@ -0,0 +1,139 @@
+"""
+Fake OpenAI-compatible chat completions server for load tests.
+
+Serves POST /v1/chat/completions, streamed (server-sent events) or not, with
+a configurable time to first token, token rate and error rate, so /api/chat
+can be load-tested without the network or an API bill. Point the app at it
+with OPENAI_BASE_URL:
+
+    python benchmarks/fake_openai.py --port 9100 --ttft 0.3 --tokens-per-second 50
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn app:app --port 8000
+
+Any API key is accepted. bench_chat_load.py starts both for you.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeUpstreamConfig:
+    """
+    How the fake upstream behaves.
+
+    Args:
+        ttft: Seconds before the first token
+        tokens_per_second: Rate tokens are streamed at after the first
+        tokens: Tokens in each answer
+        error_rate: Fraction of requests answered with an error instead
+        error_status: HTTP status of those errors (429 or a 5xx)
+        seed: Seed for the error draws, so runs are repeatable
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        tokens_per_second: float = 50.0,
+        tokens: int = 100,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        seed: int = 0,
+    ):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+
+def _chunk_event(model: str, created: int, delta: dict, finish_reason=None) -> bytes:
+    event = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+def create_app(config: FakeUpstreamConfig) -> FastAPI:
+    """The fake upstream as an ASGI app."""
+    app = FastAPI(title="Fake OpenAI upstream")
+    token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    async def stream_tokens(model: str, tokens):
+        created = int(time.time())
+        yield _chunk_event(model, created, {"role": "assistant", "content": ""})
+        await asyncio.sleep(config.ttft)
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(token_interval)
+            yield _chunk_event(model, created, {"content": token})
+        yield _chunk_event(model, created, {}, "stop")
+        yield b"data: [DONE]\n\n"
+
+    @app.get("/v1/models")
+    async def list_models():
+        # Also serves as the readiness check for bench_chat_load.py
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model", "created": 0, "owned_by": "fake"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+
+        if config.error_rate and config.rng.random() < config.error_rate:
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "Injected fake upstream error", "type": "server_error", "code": None}},
+            )
+
+        token_count = min(config.tokens, body.get("max_tokens") or config.tokens)
+        tokens = [f"tok{i} " for i in range(token_count)]
+        if body.get("stream"):
+            return StreamingResponse(stream_tokens(model, tokens), media_type="text/event-stream")
+
+        await asyncio.sleep(config.ttft + token_interval * max(0, token_count - 1))
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": token_count, "total_tokens": prompt_tokens + token_count},
+        }
+
+    return app
+
+
+def add_upstream_arguments(parser: argparse.ArgumentParser):
+    """The fake upstream's command-line options (shared with bench_chat_load.py)."""
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="token rate after the first")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of the injected errors")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the error draws")
+
+
+def config_from_args(args) -> FakeUpstreamConfig:
+    return FakeUpstreamConfig(args.ttft, args.tokens_per_second, args.tokens, args.error_rate, args.error_status, args.seed)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,134 @@
+"""
+Deterministic synthetic documents for benchmarks.
+
+Builds plain-text pages (with headings that look like real reports) and
+writes them out as minimal, valid PDF files without any extra dependencies.
+"""
+
+import random
+from typing import List, Optional, Sequence, Tuple
+
+WORDS = (
+    "the agreement party shall provide notice within thirty days of any material change "
+    "to the terms including payment schedules obligations warranties and indemnities "
+    "revenue increased during the quarter driven by strong demand across segments "
+    "management believes results reflect disciplined execution and prudent risk controls "
+    "data were collected from participants and analyzed using standard statistical methods"
+).split()
+
+HEADING_KEYWORDS = ["Introduction", "Background", "Methodology", "Results", "Discussion", "Conclusion"]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_pages(page_count: int, lines_per_page: int = 40, seed: int = 0) -> List[List[str]]:
+    """
+    Generate page_count pages of text lines with periodic section headings.
+
+    Returns:
+        List of pages, each a list of lines
+    """
+    rng = random.Random(seed)
+    pages = []
+    section = 0
+    for page_num in range(page_count):
+        lines = []
+        for line_num in range(lines_per_page):
+            # Start a new section every few pages, cycling through heading styles
+            if line_num == 0 and page_num % 3 == 0:
+                section += 1
+                style = section % 4
+                if style == 0:
+                    lines.append(f"Chapter {section}: {rng.choice(HEADING_KEYWORDS)} Overview")
+                elif style == 1:
+                    lines.append(f"{section}.1 {rng.choice(HEADING_KEYWORDS)}")
+                elif style == 2:
+                    lines.append(rng.choice(HEADING_KEYWORDS).upper() + " AND SCOPE")
+                else:
+                    lines.append(rng.choice(HEADING_KEYWORDS).lower())
+            else:
+                lines.append(_sentence(rng))
+        pages.append(lines)
+    return pages
+
+
+def synthetic_text(page_count: int, lines_per_page: int = 40, seed: int = 0) -> str:
+    """Synthetic document as one string, pages separated by the extractor's page markers."""
+    parts = []
+    for page_num, lines in enumerate(synthetic_pages(page_count, lines_per_page, seed)):
+        parts.append(f"\n\n----- PAGE {page_num + 1} -----\n\n")
+        parts.append("\n".join(lines))
+    return "".join(parts)
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[List[str]], outline: Optional[Sequence[Tuple[str, int]]] = None) -> bytes:
+    """
+    Write pages of text lines as a minimal PDF (Helvetica, one text object per page).
+
+    Args:
+        pages: Pages, each a list of lines
+        outline: Optional flat outline (bookmarks) of (title, page index) entries
+
+    Returns:
+        The PDF file contents
+    """
+    page_count = len(pages)
+    font_obj = 3 + 2 * page_count
+    outline_obj = font_obj + 1
+    catalog = "<< /Type /Catalog /Pages 2 0 R >>"
+    if outline:
+        catalog = f"<< /Type /Catalog /Pages 2 0 R /Outlines {outline_obj} 0 R /PageMode /UseOutlines >>"
+    objects = [
+        catalog,
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * i} 0 R" for i in range(page_count)), page_count
+        ),
+    ]
+
+    for i, lines in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_obj} 0 R >> >> /Contents {4 + 2 * i} 0 R >>"
+        )
+        ops = ["BT /F1 10 Tf 40 760 Td 12 TL"]
+        ops.extend(f"({_escape(line)}) Tj T*" for line in lines)
+        ops.append("ET")
+        stream = "\n".join(ops)
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    if outline:
+        first_item = outline_obj + 1
+        last_item = outline_obj + len(outline)
+        objects.append(f"<< /Type /Outlines /First {first_item} 0 R /Last {last_item} 0 R /Count {len(outline)} >>")
+        for i, (title, page_index) in enumerate(outline):
+            item = first_item + i
+            links = "".join((
+                f" /Prev {item - 1} 0 R" if item > first_item else "",
+                f" /Next {item + 1} 0 R" if item < last_item else "",
+            ))
+            objects.append(
+                f"<< /Title ({_escape(title)}) /Parent {outline_obj} 0 R{links} "
+                f"/Dest [{3 + 2 * page_index} 0 R /XYZ null null null] >>"
+            )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(out)
@@ -0,0 +1,294 @@
+"""
+BM25 inverted index for picking the chunks of a document relevant to a question.
+
+The index is built once per document and kept compact: terms are mapped to
+integer IDs and postings live in flat `array` buffers (CSR layout) instead of
+per-term Python lists or dicts. A query only touches the postings of its own
+terms, so lookups stay fast even for very large documents.
+
+ChunkEntryCache keeps per-chunk index entries (term counts here, vectors in
+vector_index) by chunk content. A revised document mostly re-chunks into the
+chunks its previous version had, so re-indexing it only computes the entries
+of the chunks that changed.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+# Maximum number of document indexes kept in memory
+DEFAULT_MAX_INDEXES = int(os.environ.get("RETRIEVAL_MAX_INDEXES", "64"))
+# Maximum number of per-chunk term counts kept for re-indexing revised documents
+DEFAULT_MAX_CHUNK_ENTRIES = int(os.environ.get("RETRIEVAL_CHUNK_CACHE_ENTRIES", "50000"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Common words that carry no signal for ranking
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "what when where which who why how do does did can could should would i you we they me my our your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case alphanumeric tokens with stopwords removed."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def count_terms(text: str) -> Counter:
+    """Term frequencies of a text, in order of first appearance."""
+    return Counter(tokenize(text))
+
+
+class ChunkEntryCache:
+    """
+    LRU of per-chunk index entries, keyed by a digest of the chunk text.
+
+    Args:
+        max_entries: Maximum number of entries kept
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_CHUNK_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, bytes], object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Indexes are built in worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def map(self, namespace: str, texts: Sequence[str], compute: Callable[[List[str]], Sequence]) -> list:
+        """
+        The entry of every text, computing the missing ones with a single compute(missing texts) call.
+
+        namespace separates kinds of entry (and e.g. embedders) for the same text.
+        """
+        keys = [(namespace, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()) for text in texts]
+        entries = []
+        missing = []
+        with self._lock:
+            for index, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    missing.append(index)
+                entries.append(entry)
+            self.misses += len(missing)
+
+        if missing:
+            # Computed outside the lock so other documents aren't held up
+            computed = compute([texts[index] for index in missing])
+            with self._lock:
+                for index, entry in zip(missing, computed):
+                    entries[index] = self._entries[keys[index]] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entries
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of texts.
+
+    Args:
+        texts: The texts (chunks) to index; results refer to them by position
+        k1: Term frequency saturation parameter
+        b: Length normalization parameter
+        entry_cache: Optional ChunkEntryCache to reuse the term counts of
+            chunks indexed before
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75, entry_cache: Optional[ChunkEntryCache] = None):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(texts)
+        self.term_ids: Dict[str, int] = {}
+
+        # Count terms per text, then assign integer IDs as new terms appear
+        if entry_cache is not None:
+            text_term_counts = entry_cache.map("bm25", texts, lambda missing: [count_terms(text) for text in missing])
+        else:
+            text_term_counts = [count_terms(text) for text in texts]
+        doc_term_counts = []
+        self.doc_lengths = array("I")
+        for term_counts in text_term_counts:
+            self.doc_lengths.append(sum(term_counts.values()))
+            doc_term_counts.append({self.term_ids.setdefault(token, len(self.term_ids)): freq for token, freq in term_counts.items()})
+
+        self.avg_doc_length = (sum(self.doc_lengths) / self.doc_count) if self.doc_count else 0.0
+
+        # The length-dependent part of the BM25 denominator, fixed per text
+        self.length_norms = array("d", (
+            k1 * (1 - b + b * length / self.avg_doc_length) if self.avg_doc_length else k1
+            for length in self.doc_lengths
+        ))
+
+        # Document frequency per term, then prefix sums give each term's slice of the postings
+        term_count = len(self.term_ids)
+        doc_freqs = array("I", bytes(4 * term_count))
+        for counts in doc_term_counts:
+            for term_id in counts:
+                doc_freqs[term_id] += 1
+
+        self.offsets = array("I", [0]) * (term_count + 1)
+        for term_id in range(term_count):
+            self.offsets[term_id + 1] = self.offsets[term_id] + doc_freqs[term_id]
+
+        # Fill the flat postings arrays; docs are visited in order, so each slice is sorted
+        total_postings = self.offsets[term_count]
+        self.posting_docs = array("I", bytes(4 * total_postings))
+        self.posting_freqs = array("I", bytes(4 * total_postings))
+        cursor = array("I", self.offsets[:term_count])
+        for doc_id, counts in enumerate(doc_term_counts):
+            for term_id, freq in counts.items():
+                position = cursor[term_id]
+                self.posting_docs[position] = doc_id
+                self.posting_freqs[position] = freq
+                cursor[term_id] = position + 1
+
+        # Precompute IDF (Lucene's variant, which never goes negative for very common terms)
+        self.idf = array("d", (
+            math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5)) for df in doc_freqs
+        ))
+
+    def __len__(self):
+        return self.doc_count
+
+    def score(self, query: str) -> Dict[int, float]:
+        """Return BM25 scores for every text that shares a term with the query."""
+        scores: Dict[int, float] = {}
+        if not self.doc_count:
+            return scores
+
+        k1_plus_1 = self.k1 + 1
+        length_norms = self.length_norms
+        posting_docs = self.posting_docs
+        posting_freqs = self.posting_freqs
+
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            idf = self.idf[term_id]
+            for position in range(self.offsets[term_id], self.offsets[term_id + 1]):
+                doc_id = posting_docs[position]
+                freq = posting_freqs[position]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * k1_plus_1 / (freq + length_norms[doc_id])
+        return scores
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return up to top_k (text index, score) pairs, best first."""
+        scores = self.score(query)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def select_within_budget(self, query: str, lengths: Sequence[int], budget: int) -> List[int]:
+        """
+        Pick the highest-scoring texts whose combined length fits the budget.
+
+        Texts are added best-first, skipping any that would overflow. If the
+        query matches nothing (e.g. "summarize this"), texts are taken from
+        the start of the document instead.
+
+        Args:
+            query: The user's question
+            lengths: Length of each indexed text, in the budget's units
+            budget: Maximum combined length
+
+        Returns:
+            Indexes of the chosen texts, in document order
+        """
+        scores = self.score(query)
+        ranked = sorted(scores, key=scores.get, reverse=True) if scores else range(self.doc_count)
+
+        chosen = []
+        used = 0
+        for index in ranked:
+            if used + lengths[index] <= budget:
+                chosen.append(index)
+                used += lengths[index]
+        return sorted(chosen)
+
+
+class IndexCache:
+    """
+    LRU of per-document retrieval indexes, so each document is indexed once.
+
+    Args:
+        max_indexes: Maximum number of indexes kept in memory
+    """
+
+    def __init__(self, max_indexes: int = DEFAULT_MAX_INDEXES):
+        self.max_indexes = max_indexes
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # Builds in progress, by key
+        self._building: Dict[Hashable, Future] = {}
+        # Chat handlers build indexes in worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], object]):
+        """
+        Return the cached index for key, building it with build() on a miss.
+
+        Concurrent misses for the same key share one build: the first caller
+        builds, the others wait for its result (or its exception).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            building = self._building.get(key)
+            if building is None:
+                self.misses += 1
+                building = self._building[key] = Future()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            return building.result()
+
+        # Build outside the lock so other documents aren't held up
+        try:
+            entry = build()
+        except BaseException as e:
+            with self._lock:
+                self._building.pop(key, None)
+            building.set_exception(e)
+            raise
+        with self._lock:
+            self._building.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_indexes:
+                self._entries.popitem(last=False)
+        building.set_result(entry)
+        return entry
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
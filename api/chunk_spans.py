@@ -0,0 +1,133 @@
+"""
+Lightweight, offset-based document chunks.
+
+A ChunkSpan is just (buffer, start, end, title): every chunk of a document
+points into one shared text buffer instead of holding its own copy, and
+overlapping chunks simply have overlapping offsets. The chunk text is only
+materialized when something reads `.content` (e.g. when serializing).
+"""
+
+import re
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+PARAGRAPH_SPLIT_PATTERN = re.compile(r'\n\s*\n')
+
+
+class ChunkSpan:
+    """
+    A chunk of text identified by its offsets into a shared buffer.
+
+    `prefix` is an optional short string placed before the buffer range, for
+    chunks whose first few characters don't appear verbatim in the buffer.
+    """
+
+    __slots__ = ("buffer", "start", "end", "title", "prefix")
+
+    def __init__(self, buffer: str, start: int, end: int, title: str, prefix: str = ""):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.title = title
+        self.prefix = prefix
+
+    def __len__(self):
+        return len(self.prefix) + self.end - self.start
+
+    def __repr__(self):
+        return f"ChunkSpan(title={self.title!r}, start={self.start}, end={self.end})"
+
+    @property
+    def content(self) -> str:
+        """The chunk text (sliced from the buffer on each access)."""
+        if self.prefix:
+            return self.prefix + self.buffer[self.start:self.end]
+        return self.buffer[self.start:self.end]
+
+    def to_dict(self) -> Dict[str, str]:
+        """The {"title", "content"} dict returned by the API."""
+        return {"title": self.title, "content": self.content}
+
+
+def pack_paragraphs(buffer: str, title: str, max_chunk_size: int, overlap: int, start: int = 0, end: Optional[int] = None) -> List[ChunkSpan]:
+    """
+    Split buffer[start:end] on blank lines and pack paragraphs into chunks of about max_chunk_size chars.
+
+    Chunk text is the paragraphs re-joined with a blank line after each; a
+    chunk after the first starts with the last `overlap` characters of the
+    previous one and is titled "<title> (continued)".
+
+    Wherever that text is identical to the source (paragraphs already
+    separated by exactly "\n\n"), chunks are spans of `buffer` itself. Text
+    up to the last separator that had to be normalized goes in the span's
+    prefix, which is usually just the overlap.
+
+    Returns:
+        List of ChunkSpan
+    """
+    end = len(buffer) if end is None else end
+
+    # Paragraph boundaries in the source, found without slicing it
+    para_starts = []
+    para_ends = []
+    # Whether the separator after each paragraph is exactly "\n\n" (so the joined text matches the source)
+    exact_separator = []
+    position = start
+    for match in PARAGRAPH_SPLIT_PATTERN.finditer(buffer, start, end):
+        para_starts.append(position)
+        para_ends.append(match.start())
+        exact_separator.append(match.end() - match.start() == 2)
+        position = match.end()
+    para_starts.append(position)
+    para_ends.append(end)
+
+    # Pack in the coordinates of the joined text (paragraph + "\n\n" each), without building it
+    ranges = []  # (joined start, first paragraph, last paragraph, title)
+    joined_starts = []
+    joined_position = 0
+    chunk_start = 0
+    first_para = 0
+    chunk_title = title
+    for index in range(len(para_starts)):
+        para_length = para_ends[index] - para_starts[index]
+        chunk_length = joined_position - chunk_start
+        if chunk_length + para_length > max_chunk_size and chunk_length > 0:
+            ranges.append((chunk_start, first_para, index - 1, chunk_title))
+            # The overlap is the tail of the previous chunk, which sits right before this paragraph
+            chunk_start = joined_position - min(overlap, chunk_length) if overlap > 0 else joined_position
+            first_para = bisect_right(joined_starts, chunk_start) - 1 if chunk_start < joined_position else index
+            chunk_title = f"{title} (continued)"
+        joined_starts.append(joined_position)
+        joined_position += para_length + 2
+    if joined_position > chunk_start:
+        ranges.append((chunk_start, first_para, len(para_starts) - 1, chunk_title))
+
+    # Index of the last inexact separator at or before each one (-1 if none)
+    last_inexact = []
+    latest = -1
+    for index, exact in enumerate(exact_separator):
+        if not exact:
+            latest = index
+        last_inexact.append(latest)
+
+    spans = []
+    for chunk_start, first, last, chunk_title in ranges:
+        offset = chunk_start - joined_starts[first]
+        # Separators inside the chunk must match exactly; the one it ends on only has to start with "\n\n"
+        if not buffer.startswith("\n\n", para_ends[last]):
+            boundary = last
+        else:
+            boundary = last_inexact[last - 1] if last > first else -1
+        if boundary < first:
+            # Identical to the source - just point at it
+            spans.append(ChunkSpan(buffer, para_starts[first] + offset, para_ends[last] + 2, chunk_title))
+            continue
+        # Build the text up to and including the last normalized separator; the rest is in the source
+        prefix = "".join(
+            buffer[para_starts[i]:para_ends[i]] + "\n\n" for i in range(first, boundary + 1)
+        )[offset:]
+        if boundary == last:
+            spans.append(ChunkSpan(prefix, 0, len(prefix), chunk_title))
+        else:
+            spans.append(ChunkSpan(buffer, para_starts[boundary + 1], para_ends[last] + 2, chunk_title, prefix))
+    return spans
@@ -0,0 +1,191 @@
+"""
+Compression of document text before it goes into a chat prompt.
+
+Extracted PDFs carry a lot that costs tokens without telling the model
+anything: "----- PAGE n -----" markers, page numbers, and running headers and
+footers repeated on every page. Chunk overlap then repeats text again when
+neighbouring chunks are both selected. This module strips all of that:
+
+- compress_document() drops page markers, page numbers, and header/footer
+  lines found by hashing the first and last lines of every page into a
+  frequency table, then normalizes whitespace
+- dedupe_overlap() removes the text a chunk repeats from the chunk before it
+
+Only the prompt sees the compressed text; the stored document is unchanged.
+"""
+
+import math
+import os
+import re
+import threading
+from typing import Dict, List, Set, Tuple
+
+# A line is boilerplate if it's at the top or bottom of at least this fraction of pages...
+DEFAULT_MIN_PAGE_FRACTION = float(os.environ.get("CONTEXT_BOILERPLATE_MIN_FRACTION", "0.5"))
+# ...and of at least this many pages
+DEFAULT_MIN_PAGES = int(os.environ.get("CONTEXT_BOILERPLATE_MIN_PAGES", "3"))
+
+# Lines at each end of a page that can be headers or footers
+EDGE_LINES = 3
+
+PAGE_MARKER_PATTERN = re.compile(r'^-----\s*PAGE\s+\d+\s*-----$')
+# "7", "- 7 -", "Page 7", "7 of 40", "Page 7/40"
+PAGE_NUMBER_PATTERN = re.compile(r'^(?:page\s*)?[-–—\s]*\d+(?:\s*(?:of|/)\s*\d+)?[-–—\s]*$', re.IGNORECASE)
+DIGITS_PATTERN = re.compile(r'\d+')
+SPACE_PATTERN = re.compile(r'[ \t\f\v\xa0]+')
+BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n\s*\n')
+
+
+def _is_structural(line: str) -> bool:
+    """Section markers and headings, which are never boilerplate."""
+    return line.startswith("--- SECTION:") or line.startswith("## ")
+
+
+def _line_hash(line: str) -> int:
+    # Digits vary from page to page ("Page 3", "March 2024 | 17"), so they're masked out
+    return hash(DIGITS_PATTERN.sub("#", line.lower()))
+
+
+def find_boilerplate_lines(lines: List[str], min_page_fraction: float = DEFAULT_MIN_PAGE_FRACTION, min_pages: int = DEFAULT_MIN_PAGES) -> set:
+    """
+    Indexes of the lines to drop: page markers, page numbers and repeated headers/footers.
+
+    Pages are delimited by the "----- PAGE n -----" markers; text without any
+    markers has no pages, and nothing is dropped. Section markers split pages
+    too, since the segmenter can move a page's tail into a later section.
+    """
+    drop = set()
+    segments: List[List[int]] = []
+    current: List[int] = []
+    for index, raw_line in enumerate(lines):
+        line = raw_line.strip()
+        if PAGE_MARKER_PATTERN.match(line):
+            drop.add(index)
+            segments.append(current)
+            current = []
+        elif line.startswith("--- SECTION:"):
+            segments.append(current)
+            current = []
+        elif line and not line.startswith("## "):
+            current.append(index)
+    if not drop:
+        return drop
+    segments.append(current)
+    page_count = len(drop) + 1
+
+    # How many page tops and bottoms each line (by hash) appears at
+    segment_edges = []
+    frequency: Dict[int, int] = {}
+    for content in segments:
+        edges = content[:EDGE_LINES] + content[-EDGE_LINES:] if len(content) > 2 * EDGE_LINES else content
+        hashes = {index: _line_hash(lines[index].strip()) for index in edges}
+        segment_edges.append(hashes)
+        for line_hash in set(hashes.values()):
+            frequency[line_hash] = frequency.get(line_hash, 0) + 1
+
+    threshold = max(min_pages, math.ceil(min_page_fraction * page_count))
+    for hashes in segment_edges:
+        for index, line_hash in hashes.items():
+            if frequency[line_hash] >= threshold or PAGE_NUMBER_PATTERN.match(lines[index].strip()):
+                drop.add(index)
+    return drop
+
+
+def compress_document(text: str, min_page_fraction: float = DEFAULT_MIN_PAGE_FRACTION, min_pages: int = DEFAULT_MIN_PAGES) -> str:
+    """
+    Section-marked document text without page boilerplate, with whitespace normalized.
+
+    Section markers and headings are kept as they are, so the result can be
+    chunked like the original.
+    """
+    lines = text.split("\n")
+    drop = find_boilerplate_lines(lines, min_page_fraction, min_pages)
+
+    kept = []
+    for index, line in enumerate(lines):
+        if index in drop:
+            continue
+        if not _is_structural(line):
+            line = SPACE_PATTERN.sub(" ", line).strip()
+        kept.append(line)
+    # Dropped lines leave gaps behind; the chunker only needs blank-line separators
+    return BLANK_LINES_PATTERN.sub("\n\n", "\n".join(kept))
+
+
+def dedupe_overlap(previous: str, current: str, max_overlap: int) -> str:
+    """
+    current without the text it repeats from the end of previous.
+
+    Neighbouring chunks share up to max_overlap characters, so only that much
+    is compared.
+    """
+    for size in range(min(max_overlap, len(previous), len(current)), 0, -1):
+        if current.startswith(previous[-size:]):
+            return current[size:]
+    return current
+
+
+class CompressionStats:
+    """
+    Running totals of what compression saved, for /api/health.
+
+    Each document (by its content hash) is counted once, however often its
+    index is rebuilt, and each chunk's removed overlap once, however many
+    prompts it goes into.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents_seen: Set[str] = set()
+        self._overlaps_seen: Set[Tuple[str, int]] = set()
+        self.documents = 0
+        self.chars_removed = 0
+        self.tokens_saved = 0
+        self.overlap_chars_removed = 0
+
+    def add_document(self, document_id: str, chars_removed: int, tokens_saved: int):
+        with self._lock:
+            if document_id in self._documents_seen:
+                return
+            self._documents_seen.add(document_id)
+            self.documents += 1
+            self.chars_removed += chars_removed
+            self.tokens_saved += tokens_saved
+
+    def add_overlap(self, document_id: str, chunk_index: int, chars_removed: int):
+        with self._lock:
+            if (document_id, chunk_index) in self._overlaps_seen:
+                return
+            self._overlaps_seen.add((document_id, chunk_index))
+            self.overlap_chars_removed += chars_removed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": self.documents,
+            "chars_removed": self.chars_removed,
+            "tokens_saved": self.tokens_saved,
+            "overlap_chars_removed": self.overlap_chars_removed,
+        }
+
+
+def count_tokens(text: str, tokenizer, entry_cache=None) -> int:
+    """
+    Tokens in text, counted with tokenizer (not its block cache).
+
+    With an entry_cache (a bm25_index.ChunkEntryCache), paragraphs are
+    counted separately and their counts kept, so a revised document only
+    tokenizes the paragraphs that changed. Each paragraph break then counts
+    as one token, which can differ from a whole-text count by a token or so
+    per break.
+    """
+    if entry_cache is None:
+        return len(tokenizer.offsets(text))
+    paragraphs = PARAGRAPH_BREAK_PATTERN.split(text)
+    counts = entry_cache.map(f"tokens-{tokenizer.name}", paragraphs, lambda missing: [len(tokenizer.offsets(paragraph)) for paragraph in missing])
+    return sum(counts) + len(paragraphs) - 1
+
+
+def measure_savings(original: str, compressed: str, tokenizer, entry_cache=None) -> Tuple[int, int]:
+    """(chars removed, tokens saved) by compressing original, counted with count_tokens()."""
+    return len(original) - len(compressed), count_tokens(original, tokenizer, entry_cache) - count_tokens(compressed, tokenizer, entry_cache)
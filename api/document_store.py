@@ -0,0 +1,191 @@
+"""
+Server-side store for extracted documents.
+
+Uploads register their extracted text here under a content-hash document ID,
+so chat requests only need to send the ID instead of the whole document.
+Documents live in an in-memory LRU, optionally backed by a SQLite file so
+they survive restarts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Store limits - can be overridden with environment variables
+DEFAULT_MAX_DOCUMENTS = int(os.environ.get("DOCUMENT_STORE_MAX_DOCUMENTS", "256"))
+DEFAULT_MAX_BYTES = int(os.environ.get("DOCUMENT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Path to a SQLite file for persistence; leave unset to keep documents in memory only
+DEFAULT_DB_PATH = os.environ.get("DOCUMENT_STORE_PATH")
+
+
+def compute_document_id(content: bytes) -> str:
+    """Return the content-hash ID for the raw bytes of an uploaded file."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class StoredDocument:
+    """An extracted document held by the store."""
+
+    __slots__ = ("document_id", "filename", "text", "page_count", "created_at")
+
+    def __init__(self, document_id: str, filename: str, text: str, page_count: Optional[int], created_at: Optional[float] = None):
+        self.document_id = document_id
+        self.filename = filename
+        self.text = text
+        self.page_count = page_count
+        self.created_at = created_at if created_at is not None else time.time()
+
+    @property
+    def size(self) -> int:
+        # Approximate memory footprint; good enough for eviction decisions
+        return len(self.text)
+
+
+class DocumentStore:
+    """
+    In-memory LRU of documents with optional SQLite persistence.
+
+    Args:
+        max_documents: Maximum number of documents kept in memory
+        max_bytes: Maximum total text size kept in memory
+        db_path: Optional SQLite file path; evicted documents are reloaded from it
+        on_evict: Called with the ID of a document that's gone for good: evicted
+            from memory with no SQLite file to reload it from, or deleted
+    """
+
+    def __init__(
+        self,
+        max_documents: int = DEFAULT_MAX_DOCUMENTS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        db_path: Optional[str] = DEFAULT_DB_PATH,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._documents: "OrderedDict[str, StoredDocument]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    document_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    page_count INTEGER,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, document_id: str):
+        return self.get(document_id) is not None
+
+    def put(self, document_id: str, filename: str, text: str, page_count: Optional[int] = None) -> StoredDocument:
+        """Register a document (re-registering the same ID just refreshes it)."""
+        document = StoredDocument(document_id, filename, text, page_count)
+        with self._lock:
+            evicted = self._remember(document)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO documents (document_id, filename, text, page_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (document.document_id, document.filename, document.text, document.page_count, document.created_at),
+                )
+                self._db.commit()
+        self._notify_evicted(evicted)
+        return document
+
+    def get(self, document_id: str) -> Optional[StoredDocument]:
+        """Look up a document, falling back to SQLite when it was evicted from memory."""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document is not None:
+                self._documents.move_to_end(document_id)
+                return document
+
+            if self._db is None:
+                return None
+
+            row = self._db.execute(
+                "SELECT document_id, filename, text, page_count, created_at FROM documents WHERE document_id = ?",
+                (document_id,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            document = StoredDocument(*row)
+            # With a database, evicted documents can always be reloaded, so nothing is gone for good
+            self._remember(document)
+            return document
+
+    def get_many(self, document_ids: Iterable[str]) -> Dict[str, Optional[StoredDocument]]:
+        """Look up several documents; missing IDs map to None."""
+        return {document_id: self.get(document_id) for document_id in document_ids}
+
+    def delete(self, document_id: str) -> bool:
+        """Remove a document from memory and disk. Returns True if it existed."""
+        with self._lock:
+            document = self._documents.pop(document_id, None)
+            if document is not None:
+                self._total_bytes -= document.size
+            existed = document is not None
+            if self._db is not None:
+                cursor = self._db.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+                self._db.commit()
+                existed = existed or cursor.rowcount > 0
+        if existed:
+            self._notify_evicted([document_id])
+        return existed
+
+    def ids(self) -> List[str]:
+        """IDs of the documents currently held in memory."""
+        with self._lock:
+            return list(self._documents.keys())
+
+    def _remember(self, document: StoredDocument) -> List[str]:
+        """
+        Insert into the in-memory LRU and evict down to the limits. Caller holds the lock.
+
+        Returns the IDs of the evicted documents that can't be reloaded (none with a database).
+        """
+        previous = self._documents.pop(document.document_id, None)
+        if previous is not None:
+            self._total_bytes -= previous.size
+
+        self._documents[document.document_id] = document
+        self._total_bytes += document.size
+
+        # Evict least recently used documents, but always keep the newest one
+        evicted_ids = []
+        while len(self._documents) > 1 and (len(self._documents) > self.max_documents or self._total_bytes > self.max_bytes):
+            _, evicted = self._documents.popitem(last=False)
+            self._total_bytes -= evicted.size
+            evicted_ids.append(evicted.document_id)
+        return evicted_ids if self._db is None else []
+
+    def _notify_evicted(self, document_ids: List[str]):
+        """Run on_evict for each document, outside the lock."""
+        if self.on_evict is None:
+            return
+        for document_id in document_ids:
+            try:
+                self.on_evict(document_id)
+            except Exception as e:
+                print(f"Error cleaning up evicted document {document_id}: {e}")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,234 @@
+"""
+Content-addressed cache for PDF text extraction.
+
+Extraction results are keyed by the SHA-256 of the uploaded bytes plus the
+extractor version, so the same file is only parsed once no matter which
+endpoint receives it. There is a bounded in-memory LRU tier, an optional
+on-disk tier, and single-flight coalescing: concurrent requests for the same
+key share one extraction instead of each running their own.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Cache limits - can be overridden with environment variables
+DEFAULT_MAX_ENTRIES = int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", "128"))
+DEFAULT_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Directory for the on-disk tier; leave unset to keep the cache in memory only
+DEFAULT_CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR")
+
+# (text_content, page_count), as returned by extract_text_from_pdf
+ExtractionResult = Tuple[str, int]
+
+
+class ExtractionCache:
+    """
+    Two-tier (memory + optional disk) cache of extraction results.
+
+    Args:
+        max_entries: Maximum number of results kept in memory
+        max_bytes: Maximum total text size kept in memory
+        cache_dir: Optional directory for persisting results to disk
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES, cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, ExtractionResult]" = OrderedDict()
+        self._total_bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # get()/put() are also called from worker threads (e.g. background jobs); in-flight
+        # extractions are only ever touched on the event loop, so they don't need it
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, extractor_version: str) -> str:
+        """Combine the content hash with the extractor version so upgrades invalidate old results."""
+        return f"{extractor_version}-{content_hash}"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[ExtractionResult]:
+        """Return a cached result from memory or disk, or None on a miss."""
+        result = self._get_memory(key)
+        if result is None:
+            result = self._get_disk(key)
+        return result
+
+    def put(self, key: str, result: ExtractionResult):
+        """Store a result in memory and, if configured, on disk."""
+        with self._lock:
+            self._remember(key, result)
+        self._write_disk(key, result)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[ExtractionResult]],
+        cacheable: Callable[[ExtractionResult], bool] = lambda result: True,
+    ) -> ExtractionResult:
+        """
+        Return the cached result for key, computing it at most once.
+
+        Args:
+            key: Cache key from make_key()
+            compute: Async callable that performs the extraction
+            cacheable: Predicate deciding whether a computed result is stored
+                (e.g. to avoid caching error placeholders)
+
+        Returns:
+            The (text_content, page_count) tuple
+        """
+        while True:
+            result = self._get_memory(key)
+            if result is not None:
+                return result
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+
+            # Someone is already looking this file up (or extracting it) - wait for their result
+            with self._lock:
+                self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # If the leading request was cancelled, retry (and maybe lead) ourselves;
+                # if we were cancelled, propagate
+                if inflight.cancelled():
+                    continue
+                raise
+
+        # Claimed before anything is awaited, so requests that come in meanwhile wait for this one
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            # Disk entries are whole documents' text, so they're read and written off the event loop
+            result = await asyncio.to_thread(self._get_disk, key)
+            if result is None:
+                with self._lock:
+                    self.misses += 1
+                result = await compute()
+                if cacheable(result):
+                    with self._lock:
+                        self._remember(key, result)
+                    future.set_result(result)
+                    await asyncio.to_thread(self._write_disk, key, result)
+            if not future.done():
+                future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # Mark the exception as retrieved in case nobody else was waiting
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size of the memory tier."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _remember(self, key: str, result: ExtractionResult):
+        """Insert into the memory tier and evict down to the limits. Caller holds the lock."""
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._total_bytes -= len(previous[0])
+
+        self._entries[key] = result
+        self._total_bytes += len(result[0])
+
+        # Evict least recently used results, but always keep the newest one
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted[0])
+            self.evictions += 1
+
+    def _get_memory(self, key: str) -> Optional[ExtractionResult]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def _get_disk(self, key: str) -> Optional[ExtractionResult]:
+        # Read outside the lock so a slow disk doesn't hold up memory hits
+        result = self._read_disk(key)
+        if result is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, result)
+        return result
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[ExtractionResult]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["text_content"], data["page_count"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading extraction cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, result: ExtractionResult):
+        if not self.cache_dir:
+            return
+        temp_path = None
+        try:
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"text_content": result[0], "page_count": result[1]}, f)
+            os.replace(temp_path, self._disk_path(key))
+        except Exception as e:
+            print(f"Error writing extraction cache entry {key}: {e}")
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
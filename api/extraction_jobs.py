@@ -0,0 +1,395 @@
+"""
+Background PDF extraction jobs.
+
+A job holds its own copy of the uploaded PDF and is tracked in a SQLite
+queue, so a big extraction doesn't need a live request: an in-process worker
+extracts the pages, checkpointing page texts as it goes, and a status lookup
+reports progress. Jobs left running when the server stopped are picked up
+again on start, from the last checkpointed page. Cancelled and finished jobs
+drop their PDF copy and checkpoints.
+
+What happens to a finished job's pages (segmenting, storing the document) is
+up to the `complete` callback supplied by the app. The text it returns is
+kept with the job for as long as the job is, so the document can be restored
+after a restart (see document()).
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pdf_extraction import count_pages
+
+# Where job PDFs and the queue database are kept; defaults to a folder in the system temp directory
+DEFAULT_JOBS_DIR = os.environ.get("EXTRACTION_JOBS_DIR") or os.path.join(tempfile.gettempdir(), "doc-guy-jobs")
+# Number of jobs extracted at the same time (each one still uses the page process pool)
+DEFAULT_JOB_WORKERS = int(os.environ.get("EXTRACTION_JOB_WORKERS", "2"))
+# Page texts are committed to the database every this many pages
+DEFAULT_CHECKPOINT_PAGES = int(os.environ.get("EXTRACTION_JOB_CHECKPOINT_PAGES", "8"))
+# Finished jobs are forgotten after this many seconds
+DEFAULT_RETENTION_SECONDS = int(os.environ.get("EXTRACTION_JOB_RETENTION_SECONDS", str(24 * 60 * 60)))
+# How often expired jobs are looked for while the server runs
+DEFAULT_PRUNE_INTERVAL_SECONDS = float(os.environ.get("EXTRACTION_JOB_PRUNE_INTERVAL_SECONDS", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_JOB_COLUMNS = "job_id, filename, document_id, source_path, status, page_count, pages_done, error, created_at, finished_at"
+
+
+class ExtractionJob:
+    """One row of the job queue."""
+
+    __slots__ = ("job_id", "filename", "document_id", "source_path", "status", "page_count", "pages_done", "error", "created_at", "finished_at")
+
+    def __init__(self, job_id, filename, document_id, source_path, status, page_count, pages_done, error, created_at, finished_at):
+        self.job_id = job_id
+        self.filename = filename
+        self.document_id = document_id
+        self.source_path = source_path
+        self.status = status
+        self.page_count = page_count
+        self.pages_done = pages_done
+        self.error = error
+        self.created_at = created_at
+        self.finished_at = finished_at
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of PDF extraction jobs, worked by asyncio tasks.
+
+    Args:
+        page_extractor: PageExtractor used to pull page texts
+        complete: Called in a worker thread with (job, page texts) once every
+            page is extracted; returns the document's (text, page count),
+            or raises to fail the job
+        jobs_dir: Directory for job PDFs and the queue database
+        workers: Jobs extracted at the same time
+        checkpoint_pages: Pages between checkpoint commits
+        retention_seconds: How long finished jobs stay queryable
+        prune_interval_seconds: Time between sweeps for expired jobs (there's
+            one on start() too)
+    """
+
+    def __init__(
+        self,
+        page_extractor,
+        complete: Callable[[ExtractionJob, List[Optional[str]]], Tuple[str, int]],
+        jobs_dir: str = DEFAULT_JOBS_DIR,
+        workers: int = DEFAULT_JOB_WORKERS,
+        checkpoint_pages: int = DEFAULT_CHECKPOINT_PAGES,
+        retention_seconds: int = DEFAULT_RETENTION_SECONDS,
+        prune_interval_seconds: float = DEFAULT_PRUNE_INTERVAL_SECONDS,
+    ):
+        self.page_extractor = page_extractor
+        self.complete = complete
+        self.jobs_dir = jobs_dir
+        self.workers = max(1, workers)
+        self.checkpoint_pages = max(1, checkpoint_pages)
+        self.retention_seconds = retention_seconds
+        self.prune_interval_seconds = prune_interval_seconds
+        self._db = None
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Threads that run the jobs (and pruning sweeps); their own pool, so stop() can wait for them
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+        # job_id -> (time this run started, pages done when it started), for the ETA
+        self._runs: Dict[str, tuple] = {}
+
+    def _connect(self):
+        """Open the database on first use, so importing the app never touches the disk."""
+        if self._db is None:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.jobs_dir, "jobs.sqlite"), check_same_thread=False)
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    source_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    page_count INTEGER,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS job_pages (
+                    job_id TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    text TEXT,
+                    PRIMARY KEY (job_id, page)
+                );
+                CREATE TABLE IF NOT EXISTS job_documents (
+                    job_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    page_count INTEGER
+                );
+                """
+            )
+            self._db.commit()
+        return self._db
+
+    async def start(self):
+        """Start the workers, requeueing jobs that were running when the server last stopped."""
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        with self._lock:
+            db = self._connect()
+            db.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            db.commit()
+            pending = [row[0] for row in db.execute("SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+        self._prune()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        # One thread more than there are workers, for the pruning sweeps
+        self._executor = ThreadPoolExecutor(max_workers=self.workers + 1, thread_name_prefix="extraction-job")
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._prune_periodically()))
+
+    async def stop(self):
+        """
+        Stop the workers. Running jobs stay checkpointed and resume on the next start().
+
+        Cancelling a worker task doesn't stop its thread, so this waits for
+        running jobs to reach their next checkpoint (or finish) before the
+        database is closed; nothing is left writing to it.
+        """
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def submit(self, upload, filename: str) -> ExtractionJob:
+        """
+        Queue a PDF for extraction and return its job.
+
+        The upload's bytes are copied into the jobs directory, so the caller
+        can close it straight away.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+        source_path = os.path.join(self.jobs_dir, f"{job_id}.pdf")
+        with upload.open() as source, open(source_path, "wb") as target:
+            shutil.copyfileobj(source, target)
+
+        job = ExtractionJob(job_id, filename, upload.sha256, source_path, QUEUED, None, 0, None, time.time(), None)
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                f"INSERT INTO jobs ({_JOB_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                tuple(getattr(job, column) for column in ExtractionJob.__slots__),
+            )
+            db.commit()
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[ExtractionJob]:
+        with self._lock:
+            row = self._connect().execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return ExtractionJob(*row) if row else None
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """A job's progress as a dict (None if unknown), with an ETA while it runs."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        eta_seconds = None
+        run = self._runs.get(job_id)
+        if job.status == RUNNING and run is not None and job.page_count:
+            started_at, start_page = run
+            pages_this_run = job.pages_done - start_page
+            if pages_this_run > 0:
+                seconds_per_page = (time.time() - started_at) / pages_this_run
+                eta_seconds = round(seconds_per_page * (job.page_count - job.pages_done), 1)
+
+        return {
+            "job_id": job.job_id,
+            "filename": job.filename,
+            "status": job.status,
+            "page_count": job.page_count,
+            "pages_done": job.pages_done,
+            "eta_seconds": eta_seconds,
+            # The document can be referenced in chat requests once the job is done
+            "document_id": job.document_id if job.status == DONE else None,
+            "error": job.error,
+        }
+
+    def document(self, document_id: str) -> Optional[Tuple[str, str, int]]:
+        """
+        (filename, text, page count) of the latest done job for document_id, or None.
+
+        Lets the app put a finished job's document back in its store when a
+        restart (or eviction) has dropped it, while the job is still retained.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT jobs.filename, job_documents.text, job_documents.page_count FROM jobs"
+                " JOIN job_documents ON job_documents.job_id = jobs.job_id"
+                " WHERE jobs.document_id = ? AND jobs.status = ? ORDER BY jobs.finished_at DESC LIMIT 1",
+                (document_id, DONE),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it had already finished (or doesn't exist)."""
+        with self._lock:
+            db = self._connect()
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+            )
+            db.commit()
+        # A running job notices at its next page and cleans up after itself
+        return cursor.rowcount > 0
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, self._run, job_id)
+            except Exception as e:
+                print(f"Extraction job {job_id} failed: {e}")
+                self._finish(job_id, FAILED, str(e))
+
+    async def _prune_periodically(self):
+        """Forget expired jobs every prune_interval_seconds, so they don't pile up between restarts."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.prune_interval_seconds)
+            try:
+                await loop.run_in_executor(self._executor, self._prune)
+            except Exception as e:
+                print(f"Pruning extraction jobs failed: {e}")
+
+    def _claim(self, job_id: str) -> Optional[ExtractionJob]:
+        """Mark a queued job as running; None if it was cancelled (or already taken)."""
+        with self._lock:
+            db = self._connect()
+            cursor = db.execute("UPDATE jobs SET status = ? WHERE job_id = ? AND status = ?", (RUNNING, job_id, QUEUED))
+            db.commit()
+        if cursor.rowcount == 0:
+            self._discard(job_id)
+            return None
+        return self.get(job_id)
+
+    def _run(self, job_id: str):
+        """Extract a job's remaining pages, then hand them to complete(). Runs in a worker thread."""
+        job = self._claim(job_id)
+        if job is None:
+            return
+
+        if job.page_count is None:
+            job.page_count = count_pages(job.source_path)
+            with self._lock:
+                db = self._connect()
+                db.execute("UPDATE jobs SET page_count = ? WHERE job_id = ?", (job.page_count, job_id))
+                db.commit()
+
+        self._runs[job_id] = (time.time(), job.pages_done)
+        pages = self.page_extractor.iter_pages(job.source_path, start_page=job.pages_done)
+        unsaved = []
+        try:
+            for page_text in pages:
+                unsaved.append((job_id, job.pages_done + len(unsaved), page_text))
+                if len(unsaved) >= self.checkpoint_pages:
+                    job.pages_done = self._checkpoint(job_id, unsaved)
+                    unsaved = []
+                    if self._stopping or self._is_cancelled(job_id):
+                        break
+            else:
+                job.pages_done = self._checkpoint(job_id, unsaved)
+        finally:
+            pages.close()
+            self._runs.pop(job_id, None)
+
+        if self._is_cancelled(job_id):
+            self._discard(job_id)
+            return
+        if job.pages_done < job.page_count:
+            # Stopped for shutdown; the checkpoint is picked up on restart
+            return
+
+        text, page_count = self.complete(job, self._load_pages(job_id))
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO job_documents (job_id, text, page_count) VALUES (?, ?, ?)", (job_id, text, page_count))
+            db.commit()
+        self._finish(job_id, DONE)
+
+    def _checkpoint(self, job_id: str, pages: list) -> int:
+        """Save page texts and bump pages_done. Returns the new pages_done."""
+        with self._lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO job_pages (job_id, page, text) VALUES (?, ?, ?)", pages)
+            db.execute("UPDATE jobs SET pages_done = pages_done + ? WHERE job_id = ?", (len(pages), job_id))
+            db.commit()
+            return db.execute("SELECT pages_done FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def _load_pages(self, job_id: str) -> List[Optional[str]]:
+        with self._lock:
+            return [row[0] for row in self._connect().execute("SELECT text FROM job_pages WHERE job_id = ? ORDER BY page", (job_id,))]
+
+    def _is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._connect().execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or row[0] == CANCELLED
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (status, error, time.time(), job_id, RUNNING),
+            )
+            db.commit()
+        self._discard(job_id)
+
+    def _discard(self, job_id: str):
+        """Drop a finished job's PDF copy and page checkpoints (its status row stays)."""
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+            db.commit()
+        try:
+            os.unlink(os.path.join(self.jobs_dir, f"{job_id}.pdf"))
+        except FileNotFoundError:
+            pass
+
+    def _prune(self):
+        """Forget jobs that finished more than retention_seconds ago."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            db = self._connect()
+            finished = [row[0] for row in db.execute("SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))]
+            db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            db.execute("DELETE FROM job_documents WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+            db.commit()
+        for job_id in finished:
+            self._discard(job_id)
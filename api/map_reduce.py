@@ -0,0 +1,177 @@
+"""
+Map-reduce answering over every chunk of a document.
+
+Retrieval only shows the model the chunks that best match the question, which
+misses answers spread over a whole document ("list every obligation in this
+contract"). In map-reduce mode the question is put to each chunk separately
+(the map step), as concurrent completions bounded by a semaphore and retried
+with exponential backoff, and the partial answers are then merged by one
+streamed completion (the reduce step). With enough concurrency the map step
+takes about as long as its slowest completion, not the sum of them.
+"""
+
+import asyncio
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+# Map-reduce limits - can be overridden with environment variables
+DEFAULT_MAP_CHUNK_SIZE = int(os.environ.get("MAP_REDUCE_CHUNK_SIZE", "24000"))
+DEFAULT_MAP_CHUNK_OVERLAP = int(os.environ.get("MAP_REDUCE_CHUNK_OVERLAP", "500"))
+# Most map completions in flight for one request (the pool's per-key limit applies too)
+DEFAULT_CONCURRENCY = int(os.environ.get("MAP_REDUCE_CONCURRENCY", "8"))
+# Refuse documents that would take more map completions than this
+DEFAULT_MAX_MAP_CHUNKS = int(os.environ.get("MAP_REDUCE_MAX_CHUNKS", "200"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("MAP_REDUCE_MAX_RETRIES", "3"))
+# Delay before the first retry; doubled for each one after it
+DEFAULT_BACKOFF_SECONDS = float(os.environ.get("MAP_REDUCE_BACKOFF_SECONDS", "0.5"))
+# Upper bound on each partial answer
+DEFAULT_MAP_MAX_TOKENS = int(os.environ.get("MAP_REDUCE_MAP_MAX_TOKENS", "600"))
+
+# What a map completion replies when its chunk has nothing on the question
+NOTHING_RELEVANT = "NONE"
+
+MAP_INSTRUCTIONS = (
+    "You are reading one part of a longer document to help answer a question about the whole "
+    "document. Extract everything in this part that is relevant to the question, as concise notes "
+    "that name the section each item comes from. Don't answer from outside knowledge and don't "
+    f"guess about other parts. If this part has nothing relevant, reply with exactly {NOTHING_RELEVANT}."
+)
+
+REDUCE_INSTRUCTIONS = (
+    "The documents were too long to read at once, so each part was read separately and the notes "
+    "below are what each part had on the question. Merge them into one complete answer: keep every "
+    "distinct item, drop duplicates, and keep the section references."
+)
+
+# HTTP statuses that are worth retrying; other client errors (bad key, bad request) aren't
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+# (label, text) of one chunk, e.g. ("report.pdf, part 3 of 12: Methods", "...")
+MapChunk = Tuple[str, str]
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed completion is worth retrying: rate limits, timeouts, server and connection errors.
+
+    Anything else - including bugs on this side, which have no status code -
+    fails straight away rather than being retried.
+    """
+    import openai
+
+    # APITimeoutError is a kind of APIConnectionError
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+async def complete_with_retries(
+    client_pool,
+    api_key: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int = DEFAULT_MAP_MAX_TOKENS,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+) -> str:
+    """
+    Text of one non-streamed completion, retried with jittered exponential backoff.
+
+    Each attempt leases its own pooled client, so the wait between attempts
+    doesn't hold a slot of the key's concurrency limit. The client's own
+    retries are turned off for these calls, so max_retries is the only limit.
+    """
+    attempt = 0
+    while True:
+        try:
+            async with client_pool.lease(api_key) as client:
+                client = client.with_options(max_retries=0)
+                response = await client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens)
+            return response.choices[0].message.content or ""
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_seconds * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+
+
+class MapResult:
+    """The partial answers of a map step, and how many chunks failed."""
+
+    __slots__ = ("notes", "chunk_count", "errors")
+
+    def __init__(self, notes: List[MapChunk], chunk_count: int, errors: List[str]):
+        self.notes = notes
+        self.chunk_count = chunk_count
+        self.errors = errors
+
+
+async def map_chunks(
+    client_pool,
+    api_key: str,
+    model: str,
+    question: str,
+    chunks: Sequence[MapChunk],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **retry_options,
+) -> MapResult:
+    """
+    Put question to every chunk concurrently, at most concurrency at a time.
+
+    Chunks with nothing relevant are left out of the notes. A chunk that still
+    fails after its retries is recorded in errors rather than failing the
+    others; only if every chunk fails is the first error raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def map_one(label: str, text: str) -> str:
+        messages = [
+            {"role": "system", "content": MAP_INSTRUCTIONS},
+            {"role": "user", "content": f"Question: {question}\n\n{label}\n\n{text}"},
+        ]
+        async with semaphore:
+            return await complete_with_retries(client_pool, api_key, model, messages, **retry_options)
+
+    results = await asyncio.gather(*(map_one(label, text) for label, text in chunks), return_exceptions=True)
+
+    notes = []
+    errors = []
+    for (label, _), result in zip(chunks, results):
+        if isinstance(result, BaseException):
+            errors.append(f"{label}: {result}")
+            continue
+        result = result.strip()
+        if result and result.rstrip(".").upper() != NOTHING_RELEVANT:
+            notes.append((label, result))
+
+    if chunks and len(errors) == len(chunks):
+        raise next(result for result in results if isinstance(result, BaseException))
+    return MapResult(notes, len(chunks), errors)
+
+
+def build_reduce_context(result: MapResult) -> str:
+    """The part of the reduce step's system message that carries the partial answers."""
+    parts = [REDUCE_INSTRUCTIONS]
+    if result.notes:
+        parts.extend(f"[{label}]\n{notes}" for label, notes in result.notes)
+    else:
+        parts.append(f"None of the {result.chunk_count} parts had anything relevant to the question.")
+    if result.errors:
+        parts.append(
+            f"({len(result.errors)} of {result.chunk_count} parts could not be read, so the answer may be "
+            "incomplete; say so.)"
+        )
+    return "\n\n".join(parts)
+
+
+def label_chunks(filename: str, chunks) -> List[MapChunk]:
+    """(label, text) pairs for a document's ChunkSpans, numbered so partial answers can be traced back."""
+    total = len(chunks)
+    return [
+        (f"{filename}, part {index + 1} of {total}: {chunk.title}", chunk.content)
+        for index, chunk in enumerate(chunks)
+    ]
@@ -0,0 +1,222 @@
+"""
+In-process metrics for the document and chat pipeline.
+
+Each stage of the pipeline (upload read, PDF parse, per-page extraction,
+segmentation, chunking, serialization, compression, chat TTFT and stream
+duration) is timed into a latency histogram. Counters track documents, pages
+and bytes processed. render() gives the Prometheus text format for /api/metrics.
+
+Stages timed while a request is being handled are also reported to the client
+in a Server-Timing header (see ServerTimingMiddleware). Only the stages
+finished before the response starts can go in it, so for streamed
+responses (chat, NDJSON) later stages are in the histograms only.
+
+Recording costs a perf_counter() call, a bisect and a short lock, so it's
+cheap enough for per-page and per-record use. There's no dependency on
+prometheus_client.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Set to 0 to skip the Server-Timing header (the histograms are always kept)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") != "0"
+
+# Histogram buckets in seconds, from sub-millisecond regex passes to minute-long extractions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "docguy_"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Bucketed observations (with their sum and count) per label set."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series is not None else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(series[0]), series[1], series[2])) for labels, series in self._series.items())
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_number(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics an app exposes, rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(PREFIX + name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(PREFIX + name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram("stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+documents_processed = registry.counter("documents_processed_total", "Uploaded documents read, by format.", ("format",))
+pages_processed = registry.counter("pages_processed_total", "PDF pages extracted.")
+pages_reused = registry.counter("pages_reused_total", "PDF pages whose text was reused from the page cache instead of extracted.")
+bytes_processed = registry.counter("bytes_processed_total", "Bytes read or written, by stage.", ("stage",))
+chat_requests = registry.counter("chat_requests_total", "Chat requests, by response cache outcome (hit, miss or bypass).", ("cache",))
+
+
+class ServerTiming:
+    """The stage timings of one request, for its Server-Timing header."""
+
+    __slots__ = ("started", "entries")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # (stage, seconds); appends are atomic, so worker threads can record too
+        self.entries: List[Tuple[str, float]] = []
+
+    def header(self) -> str:
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.entries:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_timing: ContextVar[Optional[ServerTiming]] = ContextVar("server_timing", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage's duration in its histogram and in the current request's Server-Timing."""
+    stage_seconds.observe(seconds, stage)
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.entries.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the block as stage (also when it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that adds a Server-Timing header with the request's stage timings.
+
+    A plain ASGI wrapper rather than BaseHTTPMiddleware, so streamed
+    responses pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SERVER_TIMING:
+            await self.app(scope, receive, send)
+            return
+
+        timing = ServerTiming()
+        token = _current_timing.set(timing)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timing.reset(token)
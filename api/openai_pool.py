@@ -0,0 +1,162 @@
+"""
+Pool of reusable AsyncOpenAI clients, keyed by API key.
+
+Creating a new OpenAI client for every chat request throws away its HTTP
+connection pool (and TLS handshakes) each time. This module keeps one
+AsyncOpenAI client per API key, caps how many streams a single key may run at
+once, and closes clients that have been idle for a while.
+
+The openai package is only imported when the first client is created: it
+takes longer to import than the rest of the app put together, which matters
+for serverless cold starts. warm_up() pays that cost ahead of the first chat.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+
+# Pool limits - can be overridden with environment variables
+DEFAULT_MAX_CLIENTS = int(os.environ.get("OPENAI_POOL_MAX_CLIENTS", "32"))
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get("OPENAI_POOL_IDLE_TIMEOUT", "300"))
+DEFAULT_MAX_CONCURRENCY_PER_KEY = int(os.environ.get("OPENAI_POOL_MAX_CONCURRENCY_PER_KEY", "8"))
+# OpenAI-compatible endpoint to send requests to, e.g. the fake upstream in
+# benchmarks/fake_openai.py; leave unset for the real API
+DEFAULT_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+
+def _create_openai_client(api_key: str, base_url: Optional[str]):
+    """The default client factory."""
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+class _PooledClient:
+    """A client plus the bookkeeping the pool needs for it."""
+
+    __slots__ = ("client", "semaphore", "leases", "last_used")
+
+    def __init__(self, client, max_concurrency: int):
+        self.client = client
+        # Limits how many requests this key can have in flight at once
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+
+class OpenAIClientPool:
+    """
+    Bounded LRU pool of AsyncOpenAI clients.
+
+    Args:
+        max_clients: Maximum number of clients (API keys) kept alive at once
+        idle_timeout: Seconds a client may sit unused before it is closed
+        max_concurrency_per_key: Maximum concurrent leases for one API key
+        client_factory: Callable taking an API key and returning an async
+            OpenAI-compatible client (defaults to AsyncOpenAI)
+        base_url: API base URL for the default client factory
+    """
+
+    def __init__(
+        self,
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        max_concurrency_per_key: int = DEFAULT_MAX_CONCURRENCY_PER_KEY,
+        client_factory: Optional[Callable[[str], object]] = None,
+        base_url: Optional[str] = DEFAULT_BASE_URL,
+    ):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.max_concurrency_per_key = max_concurrency_per_key
+        self.base_url = base_url
+        self.client_factory = client_factory or (lambda api_key: _create_openai_client(api_key, base_url))
+        self._entries: "OrderedDict[str, _PooledClient]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _checkout(self, api_key: str):
+        """
+        Find or create the pool entry for an API key.
+
+        Runs without awaiting, so it is atomic with respect to the event loop.
+
+        Returns:
+            Tuple of (entry, list of evicted clients that still need closing)
+        """
+        entry = self._entries.get(api_key)
+        if entry is None:
+            entry = _PooledClient(self.client_factory(api_key), self.max_concurrency_per_key)
+            self._entries[api_key] = entry
+        else:
+            # Mark as most recently used
+            self._entries.move_to_end(api_key)
+
+        entry.leases += 1
+        return entry, self._collect_evictions()
+
+    def _collect_evictions(self) -> List[object]:
+        """Remove idle and over-capacity entries that have no active leases."""
+        now = time.monotonic()
+        evicted = []
+
+        # Drop anything that has been idle for too long
+        for key, entry in list(self._entries.items()):
+            if entry.leases == 0 and now - entry.last_used > self.idle_timeout:
+                evicted.append(self._entries.pop(key).client)
+
+        # Then trim least recently used entries until we are within capacity
+        if len(self._entries) > self.max_clients:
+            for key, entry in list(self._entries.items()):
+                if len(self._entries) <= self.max_clients:
+                    break
+                if entry.leases == 0:
+                    evicted.append(self._entries.pop(key).client)
+
+        return evicted
+
+    @asynccontextmanager
+    async def lease(self, api_key: str):
+        """
+        Borrow the client for an API key for the duration of a request.
+
+        Waits if the key already has max_concurrency_per_key requests in flight.
+        """
+        entry, evicted = self._checkout(api_key)
+        try:
+            await self._close_clients(evicted)
+            async with entry.semaphore:
+                yield entry.client
+        finally:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+
+    async def warm_up(self):
+        """
+        Create and close a throwaway client, so the first real one doesn't
+        wait for the client library to import and set itself up.
+        """
+        # That takes most of a second of CPU, so it's kept off the event loop
+        client = await asyncio.get_running_loop().run_in_executor(None, self.client_factory, "warm-up")
+        await self._close_clients([client])
+
+    async def evict_idle(self):
+        """Close every client that has been idle longer than idle_timeout."""
+        await self._close_clients(self._collect_evictions())
+
+    async def aclose(self):
+        """Close all pooled clients (used on application shutdown)."""
+        clients = [entry.client for entry in self._entries.values()]
+        self._entries.clear()
+        await self._close_clients(clients)
+
+    @staticmethod
+    async def _close_clients(clients):
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing pooled OpenAI client: {e}")
@@ -0,0 +1,244 @@
+"""
+Section segmentation from a PDF's outline (bookmarks).
+
+When a PDF has an outline, its entries already say where each section
+starts, so sections are cut there instead of by matching every line against
+the heading patterns (section_segmenter.py). Each page's text goes to the
+section open at that point; only a page where a section starts is searched
+for the section's title, to cut it there (or at the top of the page, if the
+title isn't in its text). No lines are scanned, so large documents are
+sectioned several times faster, and table rows or title-cased sentences
+can't be taken for headings.
+
+The output has the same "--- SECTION: <title> ---" format as
+segment_sections(), with "----- PAGE n -----" markers kept in the text and
+a "## <title>" line where the heading was. Titles are kept as the outline
+has them, hyphens included (SECTION_MARKER_PATTERN reads up to the " ---"
+that ends the marker line). A title used twice starts a new section each
+time rather than merging them. PDFs without a usable outline (none, or
+fewer than two entries that point at pages) go through the regex path
+instead.
+"""
+
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from metrics import timed
+from pdf_extraction import open_pdf
+from section_segmenter import format_section, join_pages
+
+# "auto" segments by the outline when a PDF has one; "regex" always uses the heading patterns
+DEFAULT_SEGMENTATION = os.environ.get("SECTION_SEGMENTATION", "auto")
+# Outline levels that start sections (1 = top-level entries only)
+DEFAULT_OUTLINE_MAX_DEPTH = int(os.environ.get("OUTLINE_MAX_DEPTH", "2"))
+
+# Guards against malformed page trees that loop back on themselves
+MAX_PAGE_TREE_DEPTH = 32
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+PAGE_MARKER_PATTERN = re.compile(r'----- PAGE \d+ -----')
+
+
+class OutlineEntry:
+    """
+    A section start taken from the outline.
+
+    title is the entry's title as it goes in the section marker; heading is
+    the text searched for on the page (the same text, whitespace normalized).
+    """
+
+    __slots__ = ("title", "heading", "page")
+
+    def __init__(self, title: str, heading: str, page: int):
+        self.title = title
+        self.heading = heading
+        self.page = page
+
+
+def _page_indexes(reader) -> Dict[int, int]:
+    """
+    Page index by page object number, from the /Kids arrays of the page tree.
+
+    PyPDF2's get_destination_page_number() loads every page object to build
+    the same map. Here a node whose /Count equals its number of kids has only
+    pages below it, so its kids are numbered without being loaded; only the
+    other nodes' kids are read, to find the subtrees.
+    """
+    from PyPDF2.generic import IndirectObject
+
+    indexes: Dict[int, int] = {}
+
+    def walk(node, start: int, depth: int) -> int:
+        kids = node.get("/Kids") or []
+        if node.get("/Count") == len(kids):
+            for offset, kid in enumerate(kids):
+                if isinstance(kid, IndirectObject):
+                    indexes[kid.idnum] = start + offset
+            return len(kids)
+        position = start
+        for kid in kids:
+            kid_node = kid.get_object()
+            if "/Kids" in kid_node and depth < MAX_PAGE_TREE_DEPTH:
+                position += walk(kid_node, position, depth + 1)
+            else:
+                if isinstance(kid, IndirectObject):
+                    indexes[kid.idnum] = position
+                position += 1
+        return position - start
+
+    walk(reader.trailer["/Root"]["/Pages"], 0, 0)
+    return indexes
+
+
+def read_outline(pdf, max_depth: int = DEFAULT_OUTLINE_MAX_DEPTH) -> List[OutlineEntry]:
+    """
+    The outline entries of a PDF that point at a page, in page order (timed as "outline_read").
+
+    Returns an empty list when the outline is missing, unreadable, or has
+    fewer than two usable entries - i.e. when the regex path should be used.
+    """
+    import PyPDF2
+    from PyPDF2.generic import IndirectObject
+
+    with timed("outline_read"), open_pdf(pdf) as file:
+        reader = PyPDF2.PdfReader(file)
+        try:
+            outline = reader.outline
+        except Exception as e:
+            print(f"Error reading PDF outline: {e}")
+            return []
+
+        entries: List[OutlineEntry] = []
+        page_indexes = None
+
+        def walk(items, level):
+            for item in items:
+                # A nested list holds the children of the entry before it
+                if isinstance(item, list):
+                    if level + 1 < max_depth:
+                        walk(item, level + 1)
+                    continue
+                target = item.get("/Page")
+                # Destinations in other files, or given by page number, don't point at a page object here
+                page = page_indexes.get(target.idnum) if isinstance(target, IndirectObject) else None
+                heading = WHITESPACE_PATTERN.sub(" ", str(item.title or "")).strip()
+                if page is not None and heading:
+                    entries.append(OutlineEntry(heading, heading, page))
+
+        if outline:
+            try:
+                page_indexes = _page_indexes(reader)
+            except Exception as e:
+                print(f"Error reading PDF page tree: {e}")
+                return []
+            walk(outline, 0)
+
+    # Outlines are nearly always in page order already; the sort is stable, so ties keep theirs
+    entries.sort(key=lambda entry: entry.page)
+    return entries if len(entries) >= 2 else []
+
+
+class OutlineSegmenter:
+    """
+    Incremental outline segmentation: feed() page texts as they arrive.
+
+    feed() returns the sections completed so far, already formatted;
+    finish() returns the rest. Only the current section is kept in memory.
+
+    The text before the first entry becomes a "Document Start" section, unless
+    there's nothing in it but page markers (the outline starts at the top of
+    page 1); those markers then go at the start of the first entry's section.
+
+    Args:
+        outline: Entries from read_outline()
+        short_text_fallback: Apply extract_text_from_pdf's shortcut, where a
+            document under 100 chars (stripped, page markers included) becomes
+            one unstripped "Full Document" section without being segmented
+    """
+
+    def __init__(self, outline: List[OutlineEntry], short_text_fallback: bool = False):
+        self.starts: Dict[int, List[OutlineEntry]] = {}
+        for entry in outline:
+            self.starts.setdefault(entry.page, []).append(entry)
+        self.short_text_fallback = short_text_fallback
+        self.title = "Document Start"
+        self.parts: List[str] = []
+        self.page_count = 0
+        # Page texts held until the "Full Document" fallback is ruled out
+        self._deciding = short_text_fallback
+        self._held: List[Optional[str]] = []
+
+    def feed(self, page_text: Optional[str]) -> List[str]:
+        """Add the next page's text; returns any sections completed by it."""
+        if not self._deciding:
+            return self._add_page(page_text)
+        self._held.append(page_text)
+        if len(join_pages(self._held).strip()) < 100:
+            return []
+        self._deciding = False
+        held, self._held = self._held, []
+        return [section for held_text in held for section in self._add_page(held_text)]
+
+    def finish(self) -> List[str]:
+        """Flush the last section (or the "Full Document" fallback)."""
+        if self._deciding and self._held:
+            return [f"\n\n--- SECTION: Full Document ---\n\n{join_pages(self._held)}"]
+        return [format_section(self.title, "".join(self.parts).strip())]
+
+    def _add_page(self, page_text: Optional[str]) -> List[str]:
+        page_num = self.page_count
+        self.page_count += 1
+        # As in segment_sections(), a page marker belongs to the section open before the page's first heading
+        self.parts.append(f"\n\n----- PAGE {page_num + 1} -----\n\n")
+        text = page_text or f"[No extractable text on page {page_num + 1}]"
+        entries = self.starts.get(page_num)
+        if entries is None:
+            self.parts.append(text)
+            return []
+
+        completed = []
+        position = 0
+        for entry in entries:
+            found = text.find(entry.heading, position)
+            cut = found if found >= 0 else position
+            self.parts.append(text[position:cut])
+            content = "".join(self.parts).strip()
+            carried = ""
+            if self.title != "Document Start":
+                # Only sections from the outline are kept when empty
+                completed.append(format_section(self.title, content))
+            elif PAGE_MARKER_PATTERN.sub("", content).strip():
+                completed.append(format_section(self.title, content))
+            else:
+                carried = f"{content}\n\n" if content else ""
+            self.title = entry.title
+            self.parts = [f"{carried}## {entry.title}\n\n"]
+            # The heading line itself is replaced by the "## <title>" line
+            position = cut
+            if found >= 0:
+                position = found + len(entry.heading)
+                if text.startswith("\n", position):
+                    position += 1
+        self.parts.append(text[position:])
+        return completed
+
+
+def iter_outline_sections(page_texts: Iterable[Optional[str]], outline: List[OutlineEntry], short_text_fallback: bool = False) -> Iterator[str]:
+    """
+    Yield formatted sections as the pages arrive, cut where the outline's entries start.
+
+    Args:
+        page_texts: Page texts in order (None for pages without text)
+        outline: Entries from read_outline()
+        short_text_fallback: See OutlineSegmenter
+    """
+    segmenter = OutlineSegmenter(outline, short_text_fallback)
+    for page_text in page_texts:
+        yield from segmenter.feed(page_text)
+    yield from segmenter.finish()
+
+
+def segment_by_outline(page_texts: List[Optional[str]], outline: List[OutlineEntry]) -> str:
+    """Buffered iter_outline_sections(): the whole section-marked text."""
+    return "".join(iter_outline_sections(page_texts, outline))
@@ -0,0 +1,227 @@
+"""
+Incremental re-ingestion: extracted page texts cached by page content.
+
+A revised document (a new draft of a contract, say) usually changes only a
+few pages, but its bytes - and so its document ID and extraction cache key -
+change completely. Pages are fingerprinted instead: a hash of the page's
+content stream and everything else extract_text() reads (rotation, fonts
+with their encodings and ToUnicode maps, and form XObjects). Fingerprinting
+only decompresses streams, so it costs a small fraction of extracting the
+text. Pages whose fingerprint is cached reuse their text, and only the rest
+are extracted.
+
+Texts live in an in-memory LRU, optionally backed by a SQLite file so they
+survive restarts.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import pages_reused, timed
+from pdf_extraction import open_pdf
+
+# Cache limits - can be overridden with environment variables
+DEFAULT_MAX_PAGES = int(os.environ.get("PAGE_CACHE_MAX_PAGES", "100000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Path to a SQLite file for persistence; leave unset to keep page texts in memory only
+DEFAULT_DB_PATH = os.environ.get("PAGE_CACHE_PATH")
+
+# Form XObjects can nest; deeper ones are hashed by reference only
+MAX_XOBJECT_DEPTH = 4
+
+
+def _hash_object(hasher, obj, memo: Dict[int, bytes], depth: int = 0):
+    """Feed a PDF object into hasher: streams by their decoded data, containers recursively."""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(obj, IndirectObject):
+        # Fonts and XObjects are shared between pages, so each is only decoded once per file
+        digest = memo.get(obj.idnum)
+        if digest is None:
+            object_hasher = hashlib.sha256()
+            memo[obj.idnum] = b""  # guards against reference cycles
+            _hash_object(object_hasher, obj.get_object(), memo, depth + 1)
+            digest = memo[obj.idnum] = object_hasher.digest()
+        hasher.update(digest)
+    elif isinstance(obj, StreamObject):
+        hasher.update(obj.get_data())
+        if depth <= MAX_XOBJECT_DEPTH:
+            for key in ("/ToUnicode", "/Resources", "/Encoding"):
+                if key in obj:
+                    hasher.update(key.encode())
+                    _hash_object(hasher, obj.raw_get(key), memo, depth)
+    elif isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            if key in ("/Parent", "/Length", "/Filter", "/DecodeParms"):
+                continue
+            hasher.update(key.encode())
+            _hash_object(hasher, obj.raw_get(key), memo, depth)
+    elif isinstance(obj, ArrayObject):
+        hasher.update(b"[")
+        for item in obj:
+            _hash_object(hasher, item, memo, depth)
+        hasher.update(b"]")
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def page_fingerprint(page, memo: Optional[Dict[int, bytes]] = None) -> str:
+    """
+    Hash of what a page's extracted text depends on.
+
+    memo holds the digests of shared objects; pass the same dict for every
+    page of a file.
+    """
+    import PyPDF2
+
+    if memo is None:
+        memo = {}
+    # Extraction output depends on the extractor too, so an upgrade re-extracts everything
+    hasher = hashlib.sha256(PyPDF2.__version__.encode())
+    contents = page.get_contents()
+    if contents is not None:
+        hasher.update(contents.get_data())
+    for key in ("/Rotate", "/Resources"):
+        hasher.update(key.encode())
+        # PyPDF2 copies values inherited from the page tree onto each page
+        _hash_object(hasher, page.get(key), memo)
+    return hasher.hexdigest()
+
+
+def fingerprint_pages(pdf) -> List[str]:
+    """Fingerprints of every page of a PDF, in order (timed as "page_hash")."""
+    import PyPDF2
+
+    with timed("page_hash"), open_pdf(pdf) as file:
+        memo: Dict[int, bytes] = {}
+        return [page_fingerprint(page, memo) for page in PyPDF2.PdfReader(file).pages]
+
+
+class PageReuse:
+    """How one extraction's pages were obtained: reused from the cache, or extracted."""
+
+    __slots__ = ("reused", "extracted")
+
+    def __init__(self):
+        self.reused = 0
+        self.extracted = 0
+
+
+class PageTextCache:
+    """
+    In-memory LRU of page texts by fingerprint, with optional SQLite persistence.
+
+    Args:
+        max_pages: Maximum number of page texts kept in memory
+        max_bytes: Maximum total text size kept in memory
+        db_path: Optional SQLite file path; evicted pages are reloaded from it
+    """
+
+    def __init__(self, max_pages: int = DEFAULT_MAX_PAGES, max_bytes: int = DEFAULT_MAX_BYTES, db_path: Optional[str] = DEFAULT_DB_PATH):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        # Pages with no text are kept as "", so a hit is never None
+        self._pages: "OrderedDict[str, str]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS page_texts (fingerprint TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get_many(self, fingerprints: Iterable[str]) -> List[Optional[str]]:
+        """Cached texts in the same order; None where a page isn't cached."""
+        texts = []
+        with self._lock:
+            for fingerprint in fingerprints:
+                text = self._pages.get(fingerprint)
+                if text is not None:
+                    self._pages.move_to_end(fingerprint)
+                elif self._db is not None:
+                    row = self._db.execute("SELECT text FROM page_texts WHERE fingerprint = ?", (fingerprint,)).fetchone()
+                    if row is not None:
+                        text = row[0]
+                        self._remember(fingerprint, text)
+                if text is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                texts.append(text)
+        return texts
+
+    def put_many(self, pages: Iterable[Tuple[str, Optional[str]]]):
+        """Store (fingerprint, text) pairs."""
+        rows = [(fingerprint, text or "") for fingerprint, text in pages]
+        with self._lock:
+            for fingerprint, text in rows:
+                self._remember(fingerprint, text)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO page_texts (fingerprint, text) VALUES (?, ?)", rows)
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._pages), "bytes": self._total_bytes, "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, fingerprint: str, text: str):
+        """Insert into the in-memory LRU and evict down to the limits. Caller holds the lock."""
+        previous = self._pages.pop(fingerprint, None)
+        if previous is not None:
+            self._total_bytes -= len(previous)
+
+        self._pages[fingerprint] = text
+        self._total_bytes += len(text)
+
+        # Evict least recently used pages, but always keep the newest one
+        while len(self._pages) > 1 and (len(self._pages) > self.max_pages or self._total_bytes > self.max_bytes):
+            _, evicted = self._pages.popitem(last=False)
+            self._total_bytes -= len(evicted)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+async def extract_pages_incremental(pdf, extractor, cache: PageTextCache, min_parallel_pages: Optional[int] = None, reuse: Optional[PageReuse] = None) -> List[Optional[str]]:
+    """
+    Page texts of a PDF, extracting only the pages the cache hasn't seen.
+
+    Args:
+        pdf: Path or upload-like object, as for PageExtractor
+        extractor: The PageExtractor that extracts the uncached pages
+        cache: Where page texts are looked up and stored
+        min_parallel_pages: Passed on to the extractor
+        reuse: Filled in with the number of pages reused and extracted
+    """
+    loop = asyncio.get_running_loop()
+    # Fingerprinting parses the whole file, so it stays off the event loop
+    # (in the request's context, so it shows up in its Server-Timing)
+    fingerprints = await loop.run_in_executor(None, contextvars.copy_context().run, fingerprint_pages, pdf)
+    page_texts = await loop.run_in_executor(None, cache.get_many, fingerprints)
+
+    missing = [page_num for page_num, text in enumerate(page_texts) if text is None]
+    if missing:
+        extracted = await extractor.extract_pages_async(pdf, min_parallel_pages, missing)
+        for page_num, text in zip(missing, extracted):
+            page_texts[page_num] = text
+        await loop.run_in_executor(None, cache.put_many, [(fingerprints[page_num], page_texts[page_num]) for page_num in missing])
+
+    pages_reused.inc(len(page_texts) - len(missing))
+    if reuse is not None:
+        reuse.reused = len(page_texts) - len(missing)
+        reuse.extracted = len(missing)
+    # Match the extractor's output, where pages without text are None
+    return [text or None for text in page_texts]
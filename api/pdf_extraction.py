@@ -0,0 +1,282 @@
+"""
+Parallel page-level text extraction for PDFs.
+
+PyPDF2's page.extract_text() is pure Python and CPU bound, so threads don't
+help. This module splits a PDF's pages into contiguous ranges and extracts
+each range in a separate process, then returns the page texts in order.
+Small documents skip the process pool, where start-up and pickling costs
+would outweigh the gain.
+
+A PDF can be given as a path or as an upload-like object with open() (a
+seekable stream) and path() (a file, for the worker processes) - see
+upload_ingest.SpooledUpload. In-process reads then never touch the disk.
+
+Page timings are measured where the pages are extracted, but recorded into
+the metrics by the parent process, since a worker's metrics would be lost.
+
+PyPDF2 and multiprocessing are imported where they're first needed, so
+importing this module (and cold-starting the app) doesn't pay for them.
+PageExtractor.warm_up() loads them ahead of the first PDF instead.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from metrics import observe_stage, pages_processed, timed
+
+# Number of worker processes; 0 means one per CPU core
+DEFAULT_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", "0")) or (os.cpu_count() or 1)
+# Documents with fewer pages than this are extracted in-process
+DEFAULT_MIN_PARALLEL_PAGES = int(os.environ.get("PDF_EXTRACTION_MIN_PARALLEL_PAGES", "16"))
+# Smallest range handed to a worker, so each task does enough work to be worth shipping
+DEFAULT_MIN_PAGES_PER_RANGE = int(os.environ.get("PDF_EXTRACTION_MIN_PAGES_PER_RANGE", "4"))
+# Pages per task when streaming, so the first pages come back quickly
+DEFAULT_STREAM_PAGES_PER_RANGE = int(os.environ.get("PDF_STREAM_PAGES_PER_RANGE", "8"))
+
+
+def open_pdf(pdf):
+    """A binary stream over a PDF given as a path or an upload-like object."""
+    return open(pdf, 'rb') if isinstance(pdf, (str, os.PathLike)) else pdf.open()
+
+
+def _pdf_path(pdf) -> str:
+    """A path worker processes can open, for a PDF given as a path or an upload-like object."""
+    return pdf if isinstance(pdf, (str, os.PathLike)) else pdf.path()
+
+
+def count_pages(pdf) -> int:
+    """Return the number of pages in a PDF (timed as the "pdf_parse" stage)."""
+    import PyPDF2
+
+    with timed("pdf_parse"), open_pdf(pdf) as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_page_range(pdf, start: int, end: int) -> List[Optional[str]]:
+    """
+    Extract text from pages [start, end) of a PDF.
+
+    Runs inside worker processes (given a path), so it opens its own reader.
+    Pages with no extractable text come back as None.
+    """
+    return extract_page_range_timed(pdf, start, end)[0]
+
+
+def extract_page_range_timed(pdf, start: int, end: int) -> Tuple[List[Optional[str]], List[float]]:
+    """extract_page_range(), plus the seconds each page took (see record_pages)."""
+    return extract_pages_timed(pdf, range(start, end))
+
+
+def extract_pages_timed(pdf, page_numbers: Sequence[int]) -> Tuple[List[Optional[str]], List[float]]:
+    """Extract the given pages (in that order), with the seconds each took."""
+    import PyPDF2
+
+    page_texts = []
+    durations = []
+    with open_pdf(pdf) as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in page_numbers:
+            page_start = time.perf_counter()
+            page_texts.append(pdf_reader.pages[page_num].extract_text() or None)
+            durations.append(time.perf_counter() - page_start)
+    return page_texts, durations
+
+
+def _load_pdf_library():
+    """Runs in each worker process at warm-up, so the first real task doesn't import PyPDF2."""
+    import PyPDF2  # noqa: F401
+
+
+def record_pages(durations: List[float]):
+    """Record extracted pages in the metrics, as "page_extract" timings."""
+    for seconds in durations:
+        observe_stage("page_extract", seconds)
+    pages_processed.inc(len(durations))
+
+
+def split_page_ranges(page_count: int, parts: int, min_pages_per_range: int = DEFAULT_MIN_PAGES_PER_RANGE) -> List[Tuple[int, int]]:
+    """
+    Split page_count pages into at most `parts` contiguous, near-equal ranges.
+
+    Returns:
+        List of (start, end) tuples covering every page in order
+    """
+    if page_count <= 0:
+        return []
+
+    parts = max(1, min(parts, page_count // max(1, min_pages_per_range)))
+    base, extra = divmod(page_count, parts)
+
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+class PageExtractor:
+    """
+    Extracts page texts across a process pool.
+
+    Args:
+        max_workers: Number of worker processes (1 disables the pool)
+        min_parallel_pages: Page count below which extraction stays in-process
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, min_parallel_pages: int = DEFAULT_MIN_PARALLEL_PAGES):
+        self.max_workers = max(1, max_workers)
+        self.min_parallel_pages = min_parallel_pages
+        self._executor = None
+        self._pool_unavailable = False
+
+    def _get_executor(self) -> Optional[Executor]:
+        """Create the process pool on first use; returns None if processes aren't available."""
+        if self.max_workers <= 1 or self._pool_unavailable:
+            return None
+        if self._executor is None:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            except (OSError, NotImplementedError, ImportError) as e:
+                # Some serverless sandboxes lack the shared memory multiprocessing needs
+                print(f"Process pool unavailable, extracting PDFs serially: {e}")
+                self._pool_unavailable = True
+                return None
+        return self._executor
+
+    def warm_up(self):
+        """Import PyPDF2 and start the worker processes now rather than on the first PDF."""
+        _load_pdf_library()
+        executor = self._get_executor()
+        if executor is not None:
+            # Workers are started as tasks are submitted; the task loads PyPDF2 in
+            # case they were spawned rather than forked from this process
+            for future in [executor.submit(_load_pdf_library) for _ in range(self.max_workers)]:
+                future.result()
+
+    def extract_pages(self, pdf) -> List[Optional[str]]:
+        """Extract every page's text, blocking until done. Returns texts in page order."""
+        page_count = count_pages(pdf)
+        executor = self._get_executor() if page_count >= self.min_parallel_pages else None
+        if executor is None:
+            page_texts, durations = extract_page_range_timed(pdf, 0, page_count)
+            record_pages(durations)
+            return page_texts
+
+        pdf_path = _pdf_path(pdf)
+        futures = [
+            executor.submit(extract_page_range_timed, pdf_path, start, end)
+            for start, end in split_page_ranges(page_count, self.max_workers)
+        ]
+        page_texts = []
+        for future in futures:
+            texts, durations = future.result()
+            page_texts.extend(texts)
+            record_pages(durations)
+        return page_texts
+
+    async def extract_pages_async(
+        self,
+        pdf,
+        min_parallel_pages: Optional[int] = None,
+        page_numbers: Optional[Sequence[int]] = None,
+    ) -> List[Optional[str]]:
+        """
+        Like extract_pages, but awaits the work without blocking the event loop.
+
+        min_parallel_pages overrides the instance's threshold, e.g. 1 to send
+        even small documents to the pool when several are extracted at once
+        (in-process threads would just contend for the GIL). page_numbers
+        limits extraction to those pages (e.g. the ones page_cache hasn't
+        seen), returned in the order given.
+        """
+        loop = asyncio.get_running_loop()
+        if min_parallel_pages is None:
+            min_parallel_pages = self.min_parallel_pages
+
+        if page_numbers is None:
+            # Opening the PDF parses its cross-reference table, so keep that off the loop too
+            # (in the request's context, so the parse shows up in its Server-Timing)
+            page_count = await loop.run_in_executor(None, contextvars.copy_context().run, count_pages, pdf)
+            page_numbers = range(page_count)
+        if not page_numbers:
+            return []
+        executor = self._get_executor() if len(page_numbers) >= min_parallel_pages else None
+        if executor is None:
+            page_texts, durations = await loop.run_in_executor(None, extract_pages_timed, pdf, page_numbers)
+            record_pages(durations)
+            return page_texts
+
+        # Workers need a file; an in-memory upload is written out once here
+        pdf_path = await loop.run_in_executor(None, _pdf_path, pdf)
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, extract_pages_timed, pdf_path, page_numbers[start:end])
+            for start, end in split_page_ranges(len(page_numbers), self.max_workers)
+        ))
+
+        # gather preserves submission order, so the ranges come back in page order
+        page_texts = []
+        for texts, durations in results:
+            page_texts.extend(texts)
+            record_pages(durations)
+        return page_texts
+
+    def iter_pages(self, pdf, pages_per_range: int = DEFAULT_STREAM_PAGES_PER_RANGE, start_page: int = 0) -> Iterator[Optional[str]]:
+        """
+        Yield page texts in page order as they are extracted, from start_page on.
+
+        Small ranges are submitted to the pool a few at a time, so only a
+        bounded number of pages are ever in flight or waiting to be consumed.
+        Blocks while waiting, so run it in a worker thread from async code.
+        """
+        page_count = count_pages(pdf)
+        executor = self._get_executor() if page_count - start_page >= self.min_parallel_pages else None
+        if executor is None:
+            import PyPDF2
+
+            with open_pdf(pdf) as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                for index in range(start_page, page_count):
+                    page_start = time.perf_counter()
+                    page_text = pdf_reader.pages[index].extract_text() or None
+                    record_pages([time.perf_counter() - page_start])
+                    yield page_text
+            return
+
+        pdf_path = _pdf_path(pdf)
+        pages_per_range = max(1, pages_per_range)
+        ranges = ((start, min(start + pages_per_range, page_count)) for start in range(start_page, page_count, pages_per_range))
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(extract_page_range_timed, pdf_path, start, end))
+                # Keep every worker busy, plus one range queued behind each
+                if len(pending) >= self.max_workers * 2:
+                    yield from self._take(pending)
+            while pending:
+                yield from self._take(pending)
+        finally:
+            # The consumer stopped early (e.g. the client disconnected)
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _take(pending: deque) -> List[Optional[str]]:
+        """Wait for the oldest pending range; returns its page texts."""
+        page_texts, durations = pending.popleft().result()
+        record_pages(durations)
+        return page_texts
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,198 @@
+"""
+Exact-match cache of chat responses.
+
+Users ask the same questions about the same documents over and over, so a
+completed answer is kept under a hash of the model and the exact messages
+sent upstream. A repeat is replayed from the cache as a chunked stream,
+without an upstream call. Entries expire after a TTL; the memory tier is a
+size-bounded LRU, and there is an optional on-disk tier.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+# Cache limits - can be overridden with environment variables
+DEFAULT_TTL_SECONDS = float(os.environ.get("CHAT_CACHE_TTL_SECONDS", "3600"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("CHAT_CACHE_MAX_ENTRIES", "1024"))
+DEFAULT_MAX_BYTES = int(os.environ.get("CHAT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Directory for the on-disk tier; leave unset to keep the cache in memory only
+DEFAULT_CACHE_DIR = os.environ.get("CHAT_CACHE_DIR")
+
+# Size of the pieces a cached response is replayed in
+REPLAY_CHUNK_CHARS = 64
+
+# (response text, time it was stored)
+CachedResponse = Tuple[str, float]
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of complete chat responses, with an optional disk tier.
+
+    Args:
+        ttl_seconds: How long a response stays valid (0 disables the cache)
+        max_entries: Maximum number of responses kept in memory
+        max_bytes: Maximum total response text kept in memory
+        cache_dir: Optional directory for persisting responses to disk
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._total_bytes = 0
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        # Response bytes served from the cache instead of the API
+        self.bytes_saved = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    @staticmethod
+    def make_key(model: str, system_message: str, user_message: str) -> str:
+        """Hash of everything that determines the response."""
+        hasher = hashlib.sha256()
+        for part in (model or "", system_message or "", user_message or ""):
+            encoded = part.encode("utf-8")
+            # Length-prefix each part so ("ab", "c") and ("a", "bc") can't collide
+            hasher.update(len(encoded).to_bytes(8, "big"))
+            hasher.update(encoded)
+        return hasher.hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh cached response from memory or disk, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._is_fresh(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._forget(key)
+            self.expired += 1
+        else:
+            entry = self._read_disk(key)
+            if entry is not None:
+                if self._is_fresh(entry):
+                    self.disk_hits += 1
+                    self._remember(key, entry)
+                    return entry[0]
+                self._delete_disk(key)
+                self.expired += 1
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, text: str):
+        """Store a complete response in memory and, if configured, on disk."""
+        if not self.enabled:
+            return
+        entry = (text, time.time())
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def replay(self, text: str) -> Iterator[str]:
+        """Yield a cached response in small pieces, the way it originally streamed, counting the bytes saved."""
+        for start in range(0, len(text), REPLAY_CHUNK_CHARS):
+            piece = text[start:start + REPLAY_CHUNK_CHARS]
+            self.bytes_saved += len(piece.encode("utf-8"))
+            yield piece
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters, bytes saved and current size of the memory tier."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left alone)."""
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def _is_fresh(self, entry: CachedResponse) -> bool:
+        return time.time() - entry[1] < self.ttl_seconds
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry[0])
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self._forget(key)
+        self._entries[key] = entry
+        self._total_bytes += len(entry[0])
+
+        # Evict least recently used responses, but always keep the newest one
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted[0])
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[CachedResponse]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["text"], data["created_at"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading response cache entry {key}: {e}")
+            return None
+
+    def _delete_disk(self, key: str):
+        try:
+            os.unlink(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _write_disk(self, key: str, entry: CachedResponse):
+        if not self.cache_dir:
+            return
+        try:
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"text": entry[0], "created_at": entry[1]}, f)
+            os.replace(temp_path, self._disk_path(key))
+        except Exception as e:
+            print(f"Error writing response cache entry {key}: {e}")
@@ -0,0 +1,227 @@
+"""
+Negotiated encodings for the large document payloads.
+
+/api/chunk and /api/debug-extraction can return megabytes of text. Their
+bodies are encoded here rather than by FastAPI's default JSONResponse, which
+also skips FastAPI's jsonable_encoder pass over every chunk:
+
+- Format, from Accept: JSON (with orjson when it's installed, which is
+  several times faster than the json module) or MessagePack (when msgpack
+  is installed). Streamed responses are NDJSON, or concatenated MessagePack
+  objects.
+- Compression, from Accept-Encoding: zstd (when zstandard is installed) or
+  gzip. Streams are compressed incrementally and flushed after every record,
+  so each record still reaches the client as soon as it's ready.
+- Field selection: only the named top-level fields (of every record, when
+  streaming) are sent, e.g. to leave out the full text.
+
+A format or coding that isn't installed is never chosen, so clients asking
+for one get JSON or an uncompressed body instead, as HTTP allows.
+"""
+
+import json
+import os
+import zlib
+from typing import Dict, FrozenSet, Iterable, Iterator, Optional, Sequence
+
+from fastapi import Response
+
+from metrics import bytes_processed, timed
+from streaming import NDJSON_MEDIA_TYPE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this aren't worth compressing (streams always are, once negotiated)
+DEFAULT_MIN_COMPRESS_BYTES = int(os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+# Compression levels: gzip 1-9, zstd 1-22; the defaults favour speed, since most bodies are sent once
+DEFAULT_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL", "1"))
+DEFAULT_ZSTD_LEVEL = int(os.environ.get("RESPONSE_ZSTD_LEVEL", "3"))
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def dumps_json(obj) -> bytes:
+    """Compact UTF-8 JSON, as FastAPI's JSONResponse writes it, with orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Integers beyond 64 bits, non-string keys and the like; the json module copes with these
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_msgpack(obj) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _parse_quality(header: Optional[str]) -> Dict[str, float]:
+    """The q-value of each item of an Accept or Accept-Encoding header, by lowercased name."""
+    qualities = {}
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        # A repeated item keeps its first quality
+        qualities.setdefault(name, quality)
+    return qualities
+
+
+class ResponseEncoding:
+    """
+    A negotiated format and content coding, and the means to encode with them.
+
+    Args:
+        format: "json" or "msgpack"
+        content_encoding: "zstd", "gzip" or None for an uncompressed body
+        min_compress_bytes: Buffered bodies smaller than this go uncompressed
+    """
+
+    def __init__(self, format: str = "json", content_encoding: Optional[str] = None, min_compress_bytes: int = DEFAULT_MIN_COMPRESS_BYTES):
+        self.format = format
+        self.content_encoding = content_encoding
+        self.min_compress_bytes = min_compress_bytes
+        self._dumps = _dumps_msgpack if format == "msgpack" else dumps_json
+
+    @classmethod
+    def negotiate(cls, accept: Optional[str], accept_encoding: Optional[str]) -> "ResponseEncoding":
+        """The best encoding for a request's Accept and Accept-Encoding headers that's available here."""
+        accepted = _parse_quality(accept)
+        format = "json"
+        if msgpack is not None:
+            msgpack_quality = max(accepted.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+            # MessagePack has to be asked for by name; wildcards count for JSON
+            json_quality = max(accepted.get(media_type, 0.0) for media_type in (JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE, "application/*", "*/*"))
+            if msgpack_quality > 0 and msgpack_quality >= json_quality:
+                format = "msgpack"
+
+        codings = _parse_quality(accept_encoding)
+        wildcard = codings.get("*", 0.0)
+        content_encoding = None
+        best = 0.0
+        # In order of preference, for equal q-values
+        for coding, available in (("zstd", zstandard is not None), ("gzip", True)):
+            quality = codings.get(coding, wildcard)
+            if available and quality > best:
+                content_encoding, best = coding, quality
+        return cls(format, content_encoding)
+
+    def media_type(self, streaming: bool = False) -> str:
+        if self.format == "msgpack":
+            return MSGPACK_MEDIA_TYPES[0]
+        return NDJSON_MEDIA_TYPE if streaming else JSON_MEDIA_TYPE
+
+    def headers(self) -> Dict[str, str]:
+        # Caches must not hand one client's encoding to another
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if self.content_encoding is not None:
+            headers["Content-Encoding"] = self.content_encoding
+        return headers
+
+    def dumps(self, obj) -> bytes:
+        """Serialize obj in the negotiated format (timed as "serialization")."""
+        with timed("serialization"):
+            body = self._dumps(obj)
+        bytes_processed.inc(len(body), "serialization")
+        return body
+
+    def _compressor(self):
+        """A streaming compressor: (compress(data) -> bytes, flush() -> bytes, finish() -> bytes)."""
+        if self.content_encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=DEFAULT_ZSTD_LEVEL).compressobj()
+            return compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+        # wbits=31 writes the gzip header and trailer
+        compressor = zlib.compressobj(DEFAULT_GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def response(self, payload, status_code: int = 200) -> Response:
+        """A buffered response holding payload, compressed if negotiated and large enough."""
+        body = self.dumps(payload)
+        headers = self.headers()
+        if self.content_encoding is None or len(body) < self.min_compress_bytes:
+            headers.pop("Content-Encoding", None)
+        else:
+            with timed("compression"):
+                compress, _, finish = self._compressor()
+                body = compress(body) + finish()
+            bytes_processed.inc(len(body), "compression")
+        return Response(body, status_code=status_code, media_type=self.media_type(), headers=headers)
+
+    def iter_records(self, records: Iterable[dict]) -> Iterator[bytes]:
+        """
+        Serialize records for a streamed response, one message each.
+
+        JSON records become NDJSON lines; MessagePack ones are simply
+        concatenated (msgpack.Unpacker reads them back one by one). With a
+        content coding, each record's bytes are flushed out of the compressor
+        before the next record is pulled.
+        """
+        newline = b"\n" if self.format == "json" else b""
+        if self.content_encoding is None:
+            for record in records:
+                yield self.dumps(record) + newline
+            return
+
+        compress, flush, finish = self._compressor()
+        for record in records:
+            data = self.dumps(record) + newline
+            with timed("compression"):
+                data = compress(data) + flush()
+            bytes_processed.inc(len(data), "compression")
+            yield data
+        data = finish()
+        bytes_processed.inc(len(data), "compression")
+        yield data
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Optional[FrozenSet[str]]:
+    """
+    The field names in a comma-separated fields parameter, or None for all of them.
+
+    Raises:
+        ValueError: If a name isn't one of allowed
+    """
+    if fields is None or not fields.strip():
+        return None
+    names = frozenset(name.strip() for name in fields.split(",") if name.strip())
+    unknown = sorted(names.difference(allowed))
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return names
+
+
+def select_fields(record: dict, fields: Optional[FrozenSet[str]]) -> dict:
+    """record with only the selected fields (a streamed record's "type" is always kept)."""
+    if fields is None:
+        return record
+    return {key: value for key, value in record.items() if key in fields or key == "type"}
+
+
+def iter_selected(records: Iterable[dict], fields: Optional[FrozenSet[str]]) -> Iterator[dict]:
+    """select_fields() over a stream of records."""
+    if fields is None:
+        return iter(records)
+    return (select_fields(record, fields) for record in records)
@@ -0,0 +1,280 @@
+"""
+Single-pass section segmenter for extracted document text.
+
+Turns the page-marked text produced by PDF extraction into the
+"--- SECTION: <title> ---" format the rest of the app understands. All
+heading patterns are folded into one precompiled regex, and section bodies
+are accumulated in lists and joined once at the end, so the work is linear
+in the size of the document.
+
+SectionSegmenter does the same work incrementally, for streaming: text is
+fed in as it is extracted and each section is returned as soon as the next
+heading closes it.
+"""
+
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# The heading patterns, in priority order (the first alternative that matches wins):
+#   1. Chapter/Section patterns (e.g., "Chapter 1: Introduction", "Section 2.1")
+#   2. Numbered headings (e.g., "1. Introduction", "2.1 Methods")
+#   3. All caps headings often used as section titles
+#   4. Common heading keywords
+HEADING_PATTERN = re.compile(
+    r'^(?:'
+    r'(?:chapter|section)\s+(?P<chapter_num>\d+(?:\.\d+)?)(?:\s*:\s*|\s+)(?P<chapter_title>.+)'
+    r'|(?P<number>\d+(?:\.\d+)?)\s+(?P<number_title>.+)'
+    r'|(?P<caps>[A-Z][A-Z\s]{4,})'
+    r'|(?P<keyword>introduction|background|methodology|methods|results|discussion|conclusion|references|appendix)'
+    r')$',
+    re.IGNORECASE,
+)
+
+# Lines shorter than this that are in Title Case are also treated as headings
+TITLE_CASE_HEADING_MAX_LENGTH = 50
+
+# Section markers in the output, e.g. "--- SECTION: Introduction ---"
+SECTION_MARKER_PATTERN = re.compile(r'\n\n---\s*SECTION:\s*(.+?)\s*---\n\n')
+
+
+def _title_from_match(match) -> str:
+    """Build the section title for a HEADING_PATTERN match."""
+    chapter_num, chapter_title, number, number_title, caps, keyword = match.groups()
+    # Numbered and chapter headings are titled "<number>: <title>"
+    if chapter_num is not None:
+        return f"{chapter_num}: {chapter_title}"
+    if number is not None:
+        return f"{number}: {number_title}"
+    if caps is not None:
+        return caps
+    return keyword
+
+
+def match_heading(line: str) -> Optional[str]:
+    """Return the section title if a (stripped) line matches a heading pattern."""
+    match = HEADING_PATTERN.match(line)
+    return _title_from_match(match) if match is not None else None
+
+
+def iter_page_pieces(page_texts: Iterable[Optional[str]]) -> Iterator[str]:
+    """Yield the text of join_pages() piece by piece, as the pages arrive."""
+    for page_num, page_text in enumerate(page_texts):
+        yield f"\n\n----- PAGE {page_num + 1} -----\n\n"
+        yield page_text or f"[No extractable text on page {page_num + 1}]"
+
+
+def join_pages(page_texts: List[Optional[str]]) -> str:
+    """Combine per-page texts with "----- PAGE n -----" markers."""
+    return "".join(iter_page_pieces(page_texts))
+
+
+def segment_sections(full_text: str) -> str:
+    """
+    Split page-marked text into sections.
+
+    Args:
+        full_text: Text from join_pages()
+
+    Returns:
+        The text with each section under a "--- SECTION: <title> ---" marker
+    """
+    current_section = "Document Start"
+    sections: Dict[str, List[str]] = {current_section: []}
+    current_parts = sections[current_section]
+
+    # Local aliases keep attribute lookups out of the loop
+    match_line = HEADING_PATTERN.match
+    max_title_length = TITLE_CASE_HEADING_MAX_LENGTH
+
+    lines = full_text.split('\n')
+    last_candidate = len(lines) - 2
+
+    for index, raw_line in enumerate(lines):
+        line = raw_line.strip()
+        if not line:  # Skip empty lines
+            continue
+
+        section_title = None
+        match = match_line(line)
+        if match is not None:
+            section_title = _title_from_match(match)
+        elif len(line) < max_title_length and 0 < index < last_candidate and line.istitle():
+            # Short, title case, with text before and after it - likely a heading
+            section_title = line
+
+        if section_title:
+            current_section = section_title
+            current_parts = sections.get(current_section)
+            if current_parts is None:
+                current_parts = sections[current_section] = []
+            current_parts.append(f"\n\n## {current_section}\n\n")
+        else:
+            current_parts.append(line)
+            current_parts.append("\n")
+
+    # Fall back to a single section with the entire document if sections are too small
+    total_content_length = sum(len(part) for parts in sections.values() for part in parts)
+    if total_content_length < 100 or len(sections) <= 1:
+        return f"\n\n--- SECTION: Full Document ---\n\n{full_text.strip()}\n\n"
+
+    # Combine all sections with clear markers
+    output = []
+    for section_name, parts in sections.items():
+        output.append(f"\n\n--- SECTION: {section_name} ---\n\n")
+        output.append("".join(parts).strip())
+        output.append("\n\n")
+    return "".join(output)
+
+
+def format_section(title: str, content: str) -> str:
+    """One section in the "--- SECTION: <title> ---" format."""
+    return f"\n\n--- SECTION: {title} ---\n\n{content}\n\n"
+
+
+class SectionSegmenter:
+    """
+    Incremental segment_sections().
+
+    feed() text in any pieces (e.g. from iter_page_pieces) and it returns the
+    sections completed so far, already formatted; finish() returns the rest.
+    Only the current section and a two-line lookahead are kept in memory.
+
+    The output is the same as segment_sections() on the joined text, except
+    that a heading seen again later starts a new section instead of being
+    merged into the earlier one (merging would need the whole document).
+    Until the document is known to have real sections (two distinct titles
+    and 100+ chars of content), the text is held back in case it falls back
+    to a single "Full Document" section.
+
+    Args:
+        short_text_fallback: Also apply extract_text_from_pdf's shortcut, where
+            text under 100 chars (stripped) becomes one unstripped "Full
+            Document" section without being segmented
+    """
+
+    def __init__(self, short_text_fallback: bool = False):
+        self.short_text_fallback = short_text_fallback
+        self.current_section = "Document Start"
+        self.current_parts: List[str] = []
+        self.line_index = 0
+        self._carry = ""  # partial line from the end of the last piece
+        self._lookahead: List[str] = []
+        self._completed: List[str] = []
+        # Held until the "Full Document" fallback is ruled out
+        self._deciding = True
+        self._held_text: List[str] = []
+        self._content_length = 0
+        self._seen_other_section = False
+
+    def feed(self, text: str) -> List[str]:
+        """Add text; returns any sections completed by it."""
+        if self._deciding:
+            self._held_text.append(text)
+        lines = (self._carry + text).split('\n')
+        self._carry = lines.pop()
+        lookahead = self._lookahead
+        for line in lines:
+            lookahead.append(line)
+            # A line only counts as a title-case heading if two more lines follow it
+            if len(lookahead) == 3:
+                self._process_line(lookahead.pop(0), True)
+        return self._drain()
+
+    def finish(self) -> List[str]:
+        """Flush the last section (or the "Full Document" fallback)."""
+        lookahead = self._lookahead
+        lookahead.append(self._carry)
+        self._carry = ""
+        while lookahead:
+            self._process_line(lookahead.pop(0), len(lookahead) >= 2)
+
+        if self._deciding and not self._has_structure():
+            full_text = "".join(self._held_text)
+            self._held_text = []
+            self._completed = []
+            if self.short_text_fallback and full_text and len(full_text.strip()) < 100:
+                return [f"\n\n--- SECTION: Full Document ---\n\n{full_text}"]
+            # Never saw enough structure - same fallback as segment_sections()
+            return [format_section("Full Document", full_text.strip())]
+
+        self._close_section()
+        return self._drain()
+
+    def _process_line(self, raw_line: str, has_two_more_lines: bool):
+        index = self.line_index
+        self.line_index += 1
+        line = raw_line.strip()
+        if not line:  # Skip empty lines
+            return
+
+        section_title = None
+        match = HEADING_PATTERN.match(line)
+        if match is not None:
+            section_title = _title_from_match(match)
+        elif len(line) < TITLE_CASE_HEADING_MAX_LENGTH and index > 0 and has_two_more_lines and line.istitle():
+            section_title = line
+
+        if section_title:
+            if section_title != self.current_section:
+                self._close_section()
+                self.current_section = section_title
+                self.current_parts = []
+                if section_title != "Document Start":
+                    self._seen_other_section = True
+            part = f"\n\n## {section_title}\n\n"
+            self.current_parts.append(part)
+            self._content_length += len(part)
+        else:
+            self.current_parts.append(line)
+            self.current_parts.append("\n")
+            self._content_length += len(line) + 1
+
+    def _close_section(self):
+        self._completed.append(format_section(self.current_section, "".join(self.current_parts).strip()))
+
+    def _has_structure(self) -> bool:
+        """Whether neither fallback can apply any more."""
+        if self._content_length < 100 or not self._seen_other_section:
+            return False
+        return not self.short_text_fallback or len("".join(self._held_text).strip()) >= 100
+
+    def _drain(self) -> List[str]:
+        if self._deciding:
+            if not self._has_structure():
+                return []
+            self._deciding = False
+            self._held_text = []
+        completed, self._completed = self._completed, []
+        return completed
+
+
+def iter_segment_sections(pieces: Iterable[str], short_text_fallback: bool = False) -> Iterator[str]:
+    """Generator form of SectionSegmenter: yields formatted sections as they complete."""
+    segmenter = SectionSegmenter(short_text_fallback)
+    for piece in pieces:
+        yield from segmenter.feed(piece)
+    yield from segmenter.finish()
+
+
+def iter_marked_sections(pieces: Iterable[str]) -> Iterator[tuple]:
+    """
+    Parse section-marked text back into sections, as it arrives.
+
+    Yields (title, marker, content) for each section, where marker is the
+    marker text as it appeared and content is the raw text up to the next
+    marker. Text before the first marker comes first, with title and marker
+    None. A marker must not be split across two pieces (sections from
+    SectionSegmenter never are).
+    """
+    title = None
+    marker = None
+    parts: List[str] = []
+    for piece in pieces:
+        position = 0
+        for match in SECTION_MARKER_PATTERN.finditer(piece):
+            parts.append(piece[position:match.start()])
+            yield title, marker, "".join(parts)
+            title, marker, parts = match.group(1).strip(), match.group(0), []
+            position = match.end()
+        parts.append(piece[position:])
+    yield title, marker, "".join(parts)
@@ -0,0 +1,247 @@
+"""
+Streaming (NDJSON) versions of the chunking and extraction-debug pipelines.
+
+Each stage is a generator - page texts -> section-marked text -> chunks -
+so a record can be sent as soon as its page or chunk is ready, and only the
+current section and chunk are held in memory rather than the whole document
+(and its JSON) several times over.
+
+The chunks match chunk_document_by_sections / chunk_document_by_tokens on
+the buffered extraction, except where a heading repeats later in the
+document: the buffered segmenter merges those sections, while streaming
+keeps them in document order (see SectionSegmenter).
+
+The records are serialized, in whichever format the client asked for, by
+response_encoding.
+"""
+
+from collections import deque
+from typing import Iterable, Iterator, List, Optional
+
+from chunk_spans import ChunkSpan, pack_paragraphs
+from outline_segmenter import OutlineEntry, OutlineSegmenter, iter_outline_sections
+from section_segmenter import SectionSegmenter, iter_marked_sections, iter_page_pieces, iter_segment_sections
+from token_chunking import CachedTokenizer, chunk_text_by_tokens, get_tokenizer, iter_pack_blocks, iter_section_blocks
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _spans_for_chunk(title: str, text: str, max_chunk_size: int, overlap: int) -> List[ChunkSpan]:
+    """A finished chunk, re-split by paragraphs if it's still too large."""
+    if len(text) <= max_chunk_size:
+        return [ChunkSpan(text, 0, len(text), title)]
+    # In the buffered chunker the next section ("\n\n## ...") follows the chunk, which lets
+    # the last paragraph stay a plain span; the trailing "\n\n" stands in for it
+    return pack_paragraphs(text + "\n\n", title, max_chunk_size, overlap, 0, len(text))
+
+
+def iter_section_chunks(pieces: Iterable[str], max_chunk_size: int = 8000, overlap: int = 500) -> Iterator[ChunkSpan]:
+    """
+    Streaming chunk_document_by_sections(): yields chunks as they fill up.
+
+    Args:
+        pieces: Section-marked text, e.g. from SectionSegmenter, or a whole
+            extracted document as a single piece
+        max_chunk_size: Maximum size of each chunk in characters
+        overlap: Overlap between chunks in characters
+
+    Chunks are only held back until one reaches 200 chars, since until then
+    the document might still fall back to a single "Full Document" chunk.
+    """
+    held_text: List[str] = []  # the input, kept until the fallbacks are ruled out
+    held_chunks = []
+    deciding = True
+
+    def recorded():
+        for piece in pieces:
+            if deciding:
+                held_text.append(piece)
+            yield piece
+
+    sections = iter_marked_sections(recorded())
+    _, _, leading_text = next(sections)
+
+    parts: List[str] = []
+    length = 0
+    new_length = 0  # chars added since the last chunk (i.e. not overlap)
+    title = "Document Start"
+
+    # First item might be text before any section marker
+    if leading_text.strip() and not leading_text.strip().startswith('---'):
+        parts.append(leading_text)
+        length = new_length = len(leading_text)
+    del leading_text
+
+    def finish_chunk(text):
+        """Split a full chunk, or hold it while a fallback is still possible."""
+        nonlocal deciding, held_chunks
+        if not deciding:
+            return _spans_for_chunk(title, text, max_chunk_size, overlap)
+        held_chunks.append((title, text))
+        if len(text) < 200:
+            return []
+        deciding = False
+        held_text.clear()
+        released = [span for held_title, held in held_chunks for span in _spans_for_chunk(held_title, held, max_chunk_size, overlap)]
+        held_chunks = []
+        return released
+
+    for section_title, _, content in sections:
+        content = content.strip()
+        # Make sure the section has actual content
+        if not content:
+            continue
+        formatted_section = f"\n\n## {section_title}\n\n{content}\n\n"
+
+        # If adding this section would exceed max_chunk_size, start a new chunk
+        if length + len(formatted_section) > max_chunk_size and length > 0:
+            text = "".join(parts)
+            yield from finish_chunk(text)
+            # Start new chunk with overlap from previous content if needed
+            tail = text[-min(overlap, length):] if overlap > 0 else ""
+            parts = [tail] if tail else []
+            length = len(tail)
+            new_length = 0
+            title = section_title
+
+        parts.append(formatted_section)
+        length += len(formatted_section)
+        new_length += len(formatted_section)
+
+    # Don't forget the last chunk
+    if new_length > 0:
+        yield from finish_chunk("".join(parts))
+
+    # No section markers, or only tiny chunks: one chunk with the entire document
+    if deciding:
+        text_content = "".join(held_text)
+        yield ChunkSpan(text_content, 0, len(text_content), "Full Document")
+
+
+def iter_token_chunks(pieces: Iterable[str], max_tokens: int = 2000, overlap_tokens: int = 100, tokenizer: Optional[CachedTokenizer] = None) -> Iterator[dict]:
+    """Streaming chunk_document_by_tokens(): yields {"title", "content", "token_count"} chunks as they fill up."""
+    tokenizer = tokenizer or get_tokenizer()
+    held_text: List[str] = []  # the input, until a first chunk rules out the fallback
+    produced = False
+
+    def recorded():
+        for piece in pieces:
+            if not produced:
+                held_text.append(piece)
+            yield piece
+
+    blocks = iter_section_blocks(iter_marked_sections(recorded()))
+    for chunk in iter_pack_blocks(blocks, max_tokens, overlap_tokens, tokenizer):
+        if not produced:
+            produced = True
+            held_text.clear()
+        yield chunk
+
+    if not produced:
+        text_content = "".join(held_text)
+        yield {"title": "Full Document", "content": text_content, "token_count": tokenizer.count(text_content)}
+
+
+def iter_text_chunks(text_content: str, max_chunk_size: int, overlap: int, chunk_unit: str = "chars") -> Iterator:
+    """Chunks of a plain-text upload, computed when first pulled (i.e. in the streaming worker thread)."""
+    if chunk_unit == "tokens":
+        yield from chunk_text_by_tokens(text_content, max_chunk_size, overlap)
+    else:
+        yield from pack_paragraphs(text_content, "Text Document", max_chunk_size, overlap)
+
+
+class PageProgress:
+    """
+    Counts page texts as they're pulled through a pipeline, queueing a record for each.
+
+    Args:
+        include_text: Put the page's text in its record
+    """
+
+    def __init__(self, include_text: bool = False):
+        self.include_text = include_text
+        self.page_count = 0
+        self.records = deque()
+
+    def track(self, page_texts: Iterable[Optional[str]]) -> Iterator[Optional[str]]:
+        for page_text in page_texts:
+            self.page_count += 1
+            record = {"type": "page", "page": self.page_count, "char_count": len(page_text or "")}
+            if self.include_text:
+                record["text"] = page_text or ""
+            self.records.append(record)
+            yield page_text
+
+    def drain(self) -> Iterator[dict]:
+        while self.records:
+            yield self.records.popleft()
+
+
+def iter_pdf_sections(page_texts: Iterable[Optional[str]], outline: Optional[List[OutlineEntry]] = None) -> Iterator[str]:
+    """
+    Streaming extract_text_from_pdf(): section-marked text for each section as it completes.
+
+    Sections follow the outline (from read_outline()) when one is given.
+    """
+    if outline:
+        return iter_outline_sections(page_texts, outline, short_text_fallback=True)
+    return iter_segment_sections(iter_page_pieces(page_texts), short_text_fallback=True)
+
+
+def iter_chunk_records(filename: str, chunks: Iterable, progress: Optional[PageProgress] = None, page_count: int = 1) -> Iterator[dict]:
+    """
+    The records of a streamed /api/chunk response.
+
+    Yields {"type": "page", "page", "char_count"} as pages are extracted (when
+    progress tracks them), {"type": "chunk", "index", "title", "content"} per
+    chunk (plus "token_count" in token mode), and finally {"type": "done",
+    "filename", "page_count", "chunk_count"}.
+    """
+    chunk_count = 0
+    for chunk in chunks:
+        if progress is not None:
+            yield from progress.drain()
+        fields = chunk.to_dict() if isinstance(chunk, ChunkSpan) else chunk
+        yield {"type": "chunk", "index": chunk_count, **fields}
+        chunk_count += 1
+
+    if progress is not None:
+        yield from progress.drain()
+        page_count = progress.page_count
+    yield {"type": "done", "filename": filename, "page_count": page_count, "chunk_count": chunk_count}
+
+
+def iter_extraction_records(filename: str, page_texts: Iterable[Optional[str]], outline: Optional[List[OutlineEntry]] = None) -> Iterator[dict]:
+    """
+    The records of a streamed /api/debug-extraction response.
+
+    Yields {"type": "page", "page", "char_count", "text"} as soon as each page
+    is extracted, then {"type": "done"} with the same totals as the buffered
+    endpoint ("filename", "page_count", "section_count", "char_count",
+    "word_count"), counted section by section. Sections follow the outline
+    (from read_outline()) when one is given, as in iter_pdf_sections().
+    """
+    totals = {"section_count": 0, "char_count": 0, "word_count": 0}
+
+    def count(sections):
+        # Sections start and end with whitespace, so their word counts add up exactly
+        for section in sections:
+            totals["section_count"] += section.count("--- SECTION:")
+            totals["char_count"] += len(section)
+            totals["word_count"] += len(section.split())
+
+    # Each page's record is queued as the page is pulled in, and sent before its text is segmented
+    progress = PageProgress(include_text=True)
+    if outline:
+        segmenter = OutlineSegmenter(outline, short_text_fallback=True)
+        pieces = progress.track(page_texts)
+    else:
+        segmenter = SectionSegmenter(short_text_fallback=True)
+        pieces = iter_page_pieces(progress.track(page_texts))
+    for piece in pieces:
+        yield from progress.drain()
+        count(segmenter.feed(piece))
+    count(segmenter.finish())
+
+    yield {"type": "done", "filename": filename, "page_count": progress.page_count, **totals}
+
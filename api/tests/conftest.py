@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The api modules and the benchmark helpers are imported as top-level modules, as the app does
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.join(API_DIR, "benchmarks"))
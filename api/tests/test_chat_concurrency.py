@@ -0,0 +1,109 @@
+"""
+/api/chat must stream concurrent chats without serializing them on the event loop.
+
+The app talks to the in-process fake upstream from
+benchmarks/bench_chat_concurrency.py, so no network or API key is needed.
+Run from the api directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import app as app_module
+from bench_chat_concurrency import make_fake_client_factory, run_chats
+from openai_pool import OpenAIClientPool
+from response_cache import ResponseCache
+from thread_store import ThreadStore
+
+CONCURRENCY = 20
+TOKENS = 20
+TOKEN_DELAY = 0.02
+# Fully blocking would be ~CONCURRENCY times a single chat
+MAX_RATIO = 2.0
+
+
+@pytest.fixture
+def upstream_requests(monkeypatch):
+    """Point the app at the fake upstream, with an empty response cache and thread store; yields the requests it receives."""
+    requests = []
+    monkeypatch.setattr(app_module, "client_pool", OpenAIClientPool(
+        max_concurrency_per_key=CONCURRENCY,
+        client_factory=make_fake_client_factory(TOKENS, TOKEN_DELAY, requests),
+    ))
+    monkeypatch.setattr(app_module, "response_cache", ResponseCache(cache_dir=None))
+    monkeypatch.setattr(app_module, "thread_store", ThreadStore(db_path=None))
+    return requests
+
+
+async def with_client(test):
+    """Run test(client) against the app, closing the pooled upstream clients afterwards."""
+    transport = httpx.ASGITransport(app=app_module.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await test(client)
+    finally:
+        await app_module.client_pool.aclose()
+
+
+def test_concurrent_chats_finish_in_about_the_time_of_one(upstream_requests):
+    async def test(client):
+        # Warm up once so client creation isn't counted
+        await run_chats(client, 1)
+        single = await run_chats(client, 1)
+        concurrent = await run_chats(client, CONCURRENCY)
+        return single, concurrent
+
+    single, concurrent = asyncio.run(with_client(test))
+
+    # Every chat reached the upstream; a replayed answer would hide a blocked event loop
+    assert len(upstream_requests) == 2 + CONCURRENCY
+    assert concurrent / single <= MAX_RATIO, f"{CONCURRENCY} concurrent chats took {concurrent:.3f}s, one took {single:.3f}s"
+
+
+def test_repeated_chat_is_replayed_unless_the_cache_is_bypassed(upstream_requests):
+    payload = {"developer_message": "You are a helpful assistant.", "user_message": "Hello", "api_key": "sk-fake"}
+
+    async def test(client):
+        responses = []
+        for body in (payload, payload, dict(payload, cache=False)):
+            response = await client.post("/api/chat", json=body)
+            response.raise_for_status()
+            responses.append(response)
+        return responses
+
+    first, repeated, bypassed = asyncio.run(with_client(test))
+
+    assert first.headers["x-cache"] == "MISS"
+    assert repeated.headers["x-cache"] == "HIT"
+    assert "x-cache" not in bypassed.headers
+    assert first.text == repeated.text == bypassed.text
+    # The miss and the bypass went upstream; the hit didn't
+    assert len(upstream_requests) == 2
+
+
+def test_follow_up_is_replayed_only_after_the_same_conversation(upstream_requests):
+    def turn(thread_id, user_message):
+        return {"developer_message": "You are a helpful assistant.", "user_message": user_message, "api_key": "sk-fake", "thread_id": thread_id}
+
+    async def test(client):
+        cache = []
+        for body in (
+            turn("a", "Hello"), turn("a", "And then?"),
+            # Same conversation in another thread: both turns are replayed
+            turn("b", "Hello"), turn("b", "And then?"),
+            # Same follow-up after a different first turn: a new answer
+            turn("c", "Hi"), turn("c", "And then?"),
+        ):
+            response = await client.post("/api/chat", json=body)
+            response.raise_for_status()
+            cache.append(response.headers["x-cache"])
+        return cache
+
+    cache = asyncio.run(with_client(test))
+
+    assert cache == ["MISS", "MISS", "HIT", "HIT", "MISS", "MISS"]
+    assert len(upstream_requests) == 4
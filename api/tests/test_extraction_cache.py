@@ -0,0 +1,51 @@
+"""
+The extraction cache's disk tier stays off the event loop and doesn't leave temp files behind.
+
+Run from the api directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+import threading
+
+from extraction_cache import ExtractionCache
+
+
+def test_disk_hit_is_read_off_the_event_loop_and_shared(tmp_path):
+    ExtractionCache(cache_dir=str(tmp_path)).put("v1-abc", ("extracted text", 3))
+    # A fresh cache has only the disk tier to go on
+    cache = ExtractionCache(cache_dir=str(tmp_path))
+    reads = []
+    read_disk = cache._read_disk
+
+    def recording_read_disk(key):
+        reads.append(threading.current_thread() is threading.main_thread())
+        return read_disk(key)
+
+    cache._read_disk = recording_read_disk
+
+    async def compute():
+        raise AssertionError("the disk entry should have been used")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("v1-abc", compute) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert results == [("extracted text", 3)] * 3
+    # One read, in a worker thread, for all three requests
+    assert reads == [False]
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_failed_disk_write_leaves_no_temp_file(tmp_path):
+    cache = ExtractionCache(cache_dir=str(tmp_path))
+
+    async def compute():
+        # Can't be written as JSON
+        return "extracted text", object()
+
+    asyncio.run(cache.get_or_compute("v1-abc", compute))
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,76 @@
+"""
+Finished extraction jobs are forgotten once their retention runs out, while the queue keeps running.
+
+Pages come from a stand-in for the page extractor, so no worker processes
+are started. Run from the api directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+import io
+
+import PyPDF2
+
+from extraction_jobs import JobQueue
+from upload_ingest import SpooledUpload
+
+
+class FakePageExtractor:
+    """Returns "page n" for every page, without extracting anything."""
+
+    def iter_pages(self, pdf, start_page=0):
+        page_count = len(PyPDF2.PdfReader(pdf).pages)
+        return (f"page {page + 1}" for page in range(start_page, page_count))
+
+
+def make_upload(page_count):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=612, height=792)
+    data = io.BytesIO()
+    writer.write(data)
+    upload = SpooledUpload("report.pdf")
+    upload.write(data.getvalue())
+    upload.finish()
+    return upload
+
+
+def test_finished_job_is_pruned_without_a_restart(tmp_path):
+    completed = []
+
+    def complete(job, pages):
+        completed.append(job.job_id)
+        return "\n\n".join(pages), len(pages)
+
+    queue = JobQueue(
+        FakePageExtractor(),
+        complete=complete,
+        jobs_dir=str(tmp_path),
+        retention_seconds=0,
+        prune_interval_seconds=0.05,
+    )
+
+    async def run():
+        await queue.start()
+        try:
+            upload = make_upload(3)
+            try:
+                job = queue.submit(upload, "report.pdf")
+            finally:
+                upload.close()
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if queue.status(job.job_id) is None:
+                    break
+            return job, queue.status(job.job_id), queue.document(job.document_id)
+        finally:
+            await queue.stop()
+
+    job, status, document = asyncio.run(run())
+
+    # The job finished, then a sweep removed it, its text and its PDF copy
+    assert completed == [job.job_id]
+    assert status is None
+    assert document is None
+    assert not (tmp_path / f"{job.job_id}.pdf").exists()
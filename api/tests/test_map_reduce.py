@@ -0,0 +1,128 @@
+"""
+Map-reduce chats retry only upstream failures, and say so in the stream when the map step fails.
+
+The map completions go, through the pool's default OpenAI clients, to a
+local HTTP server that answers every request with a fixed status. Run from
+the api directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import app as app_module
+from map_reduce import complete_with_retries
+from openai_pool import OpenAIClientPool
+from response_cache import ResponseCache
+
+
+@contextmanager
+def failing_upstream(status_code):
+    """Yield (client pool, requests) for an upstream that answers every request with status_code."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            requests.append(self.path)
+            body = json.dumps({"error": {"message": f"fake {status_code}"}}).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # No client factory: the clients are the ones the app uses, SDK retry settings included
+        yield OpenAIClientPool(base_url=f"http://127.0.0.1:{server.server_port}/v1"), requests
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+async def complete(client_pool, max_retries=2):
+    try:
+        messages = [{"role": "user", "content": "Hello"}]
+        return await complete_with_retries(client_pool, "sk-fake", "fake-model", messages, max_retries=max_retries, backoff_seconds=0)
+    finally:
+        await client_pool.aclose()
+
+
+@pytest.mark.parametrize("status_code, attempts", [(429, 3), (503, 3), (400, 1), (401, 1)])
+def test_only_rate_limits_and_server_errors_are_retried(status_code, attempts):
+    with failing_upstream(status_code) as (client_pool, requests):
+        with pytest.raises(Exception):
+            asyncio.run(complete(client_pool))
+    # Two retries after the first attempt, and none from the client itself
+    assert len(requests) == attempts
+
+
+def test_errors_without_an_upstream_response_are_not_retried():
+    class BrokenPool:
+        """Fails like a bug on this side would, before anything reaches the upstream."""
+
+        def __init__(self):
+            self.leases = 0
+
+        def lease(self, api_key):
+            self.leases += 1
+            raise KeyError("not an upstream error")
+
+        async def aclose(self):
+            pass
+
+    pool = BrokenPool()
+    with pytest.raises(KeyError):
+        asyncio.run(complete(pool))
+    assert pool.leases == 1
+
+
+def test_a_failed_map_step_ends_the_stream_with_an_error(monkeypatch):
+    monkeypatch.setattr(app_module, "response_cache", ResponseCache(cache_dir=None))
+
+    async def test(client):
+        try:
+            upload = await client.post(
+                "/api/upload",
+                files={"file": ("notes.txt", b"Every part of this document is read in map-reduce mode.", "text/plain")},
+                data={"api_key": "sk-fake"},
+            )
+            upload.raise_for_status()
+            return await client.post("/api/chat", json={
+                "developer_message": "You are a helpful assistant.",
+                "user_message": "What does the document say?",
+                "api_key": "sk-fake",
+                "document_ids": [upload.json()["file_id"]],
+                "mode": "map_reduce",
+                "cache": False,
+            })
+        finally:
+            await app_module.client_pool.aclose()
+
+    transport = httpx.ASGITransport(app=app_module.app)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await test(client)
+
+    with failing_upstream(401) as (client_pool, requests):
+        monkeypatch.setattr(app_module, "client_pool", client_pool)
+        response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.text.startswith("[Error reading the documents:")
+    # The one map completion failed with a 401, so it wasn't retried and there was no reduce step
+    assert len(requests) == 1
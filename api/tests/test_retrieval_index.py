@@ -0,0 +1,95 @@
+"""
+Retrieval indexes are built once per key, however many requests ask for one at the same time,
+and dense retrieval fills the context budget.
+
+Dense indexes use the offline HashingEmbedder and a temporary directory.
+Run from the api directory:
+
+    python -m pytest tests
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bm25_index import IndexCache
+from vector_index import HashingEmbedder, VectorIndex
+
+TEXTS = [f"Section {i}: the quarterly figures for region {i} and their revisions." for i in range(40)]
+THREADS = 4
+
+
+def build_concurrently(build):
+    """Run build() from THREADS threads released together; returns their results."""
+    barrier = threading.Barrier(THREADS)
+
+    def run():
+        barrier.wait()
+        return build()
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        return [future.result() for future in [executor.submit(run) for _ in range(THREADS)]]
+
+
+def test_concurrent_misses_share_one_build():
+    cache = IndexCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return object()
+
+    results = build_concurrently(lambda: cache.get_or_build("doc", build))
+
+    assert len(builds) == 1
+    assert all(result is results[0] for result in results)
+    assert cache.stats()["coalesced"] == THREADS - 1
+
+
+def test_concurrent_vector_builds_of_one_key_dont_collide(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+
+    # Without the index cache in front, every thread writes the key's files itself
+    indexes = build_concurrently(lambda: VectorIndex.build("doc-abc", TEXTS, embedder, index_dir=str(tmp_path), batch_size=4))
+
+    assert all(len(index) == len(TEXTS) for index in indexes)
+    assert VectorIndex.open("doc-abc", embedder, index_dir=str(tmp_path), rows=len(TEXTS)) is not None
+    # No temp files are left behind
+    assert sorted(os.listdir(tmp_path)) == [f"doc-abc-{embedder.name}.f32", f"doc-abc-{embedder.name}.json"]
+
+
+class StubEmbedder:
+    """Embeds a query as the vector given for it; chunks are given as vectors directly."""
+
+    name = "stub"
+    dim = 2
+
+    def __init__(self, query_vector):
+        self.query_vector = query_vector
+
+    def embed(self, texts):
+        return np.asarray([self.query_vector] * len(texts), dtype=np.float32)
+
+
+def stub_index(similarities, query_vector=(1.0, 0.0)):
+    """A VectorIndex whose chunks have the given cosine similarities to the query [1, 0]."""
+    vectors = np.asarray([[s, np.sqrt(1 - s * s)] for s in similarities], dtype=np.float32)
+    return VectorIndex(vectors, StubEmbedder(query_vector))
+
+
+def test_budget_left_by_long_top_chunks_goes_to_shorter_ones():
+    # The four best chunks are long; only one of them fits, which leaves room for a short one
+    index = stub_index([0.9, 0.85, 0.8, 0.75, 0.5, 0.4, 0.3, 0.2])
+    lengths = [6, 6, 6, 6, 5, 5, 5, 5]
+
+    assert index.select_within_budget("question", lengths, 11) == [0, 4]
+
+
+def test_query_matching_nothing_takes_chunks_from_the_start():
+    index = stub_index([0.9, 0.5, 0.3, 0.1], query_vector=(0.0, 0.0))
+
+    assert index.select_within_budget("summarize this", [4, 4, 4, 4], 9) == [0, 1]
@@ -0,0 +1,294 @@
+"""
+Server-side conversation threads.
+
+A chat request with a thread_id continues that thread: its earlier turns are
+kept here, so the client only sends the new message. To keep the prompt (and
+so the latency) flat as a conversation grows, only the most recent turns
+that fit a token budget go upstream verbatim; older turns are rolled into a
+running summary, which is cached with the thread and only extended, never
+rebuilt. Threads live in an in-memory LRU, optionally backed by a SQLite
+file so they survive restarts.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Store limits - can be overridden with environment variables
+DEFAULT_MAX_THREADS = int(os.environ.get("THREAD_STORE_MAX_THREADS", "1024"))
+DEFAULT_MAX_BYTES = int(os.environ.get("THREAD_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Path to a SQLite file for persistence; leave unset to keep threads in memory only
+DEFAULT_DB_PATH = os.environ.get("THREAD_STORE_PATH")
+# Tokens of recent turns sent verbatim with each request; older turns are summarized
+DEFAULT_HISTORY_TOKENS = int(os.environ.get("THREAD_HISTORY_TOKENS", "2000"))
+# Model that writes the running summaries; leave unset to use the chat request's model
+DEFAULT_SUMMARY_MODEL = os.environ.get("THREAD_SUMMARY_MODEL") or None
+# Upper bound on the length of a running summary
+DEFAULT_SUMMARY_MAX_TOKENS = int(os.environ.get("THREAD_SUMMARY_MAX_TOKENS", "400"))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant "
+    "about their documents. Update the summary with the new turns. Keep the facts, names, "
+    "numbers, decisions and open questions a follow-up question might depend on. "
+    "Reply with the updated summary only."
+)
+
+
+def _approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class Turn:
+    """One message of a thread."""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+    def to_message(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class Thread:
+    """
+    The turns of one conversation and the summary of its older ones.
+
+    summarized_turns is how many turns, from the start, the summary covers.
+    """
+
+    __slots__ = ("thread_id", "turns", "summary", "summarized_turns", "updated_at")
+
+    def __init__(self, thread_id: str, turns: Optional[List[Turn]] = None, summary: str = "", summarized_turns: int = 0, updated_at: Optional[float] = None):
+        self.thread_id = thread_id
+        self.turns = turns if turns is not None else []
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    @property
+    def size(self) -> int:
+        # Approximate memory footprint; good enough for eviction decisions
+        return len(self.summary) + sum(len(turn.content) for turn in self.turns)
+
+    def window(self, budget_tokens: int) -> Tuple[List[Turn], List[Turn]]:
+        """
+        (recent, pending): the newest turns that fit budget_tokens, and the
+        older ones the summary doesn't cover yet.
+
+        Turns are taken in user/assistant pairs so a question is never sent
+        without its answer. The window never reaches back into turns the
+        summary already covers.
+        """
+        start = len(self.turns)
+        used = 0
+        while start - 2 >= self.summarized_turns:
+            pair_tokens = self.turns[start - 2].tokens + self.turns[start - 1].tokens
+            if used + pair_tokens > budget_tokens:
+                break
+            used += pair_tokens
+            start -= 2
+        return self.turns[start:], self.turns[self.summarized_turns:start]
+
+    def to_dict(self) -> dict:
+        return {
+            "thread_id": self.thread_id,
+            "turns": [turn.to_message() for turn in self.turns],
+            "summary": self.summary,
+            "summarized_turns": self.summarized_turns,
+            "updated_at": self.updated_at,
+        }
+
+
+def build_summary_messages(summary: str, turns: List[Turn]) -> List[Dict[str, str]]:
+    """Messages asking a model to fold turns into the running summary."""
+    transcript = "\n\n".join(f"{turn.role.upper()}: {turn.content}" for turn in turns)
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Current summary:\n{summary or '(none yet)'}\n\nNew turns:\n{transcript}"},
+    ]
+
+
+class ThreadStore:
+    """
+    In-memory LRU of conversation threads with optional SQLite persistence.
+
+    Args:
+        max_threads: Maximum number of threads kept in memory
+        max_bytes: Maximum total turn and summary text kept in memory
+        db_path: Optional SQLite file path; evicted threads are reloaded from it
+        count_tokens: Token counter for turns (defaults to ~4 characters per token)
+    """
+
+    def __init__(
+        self,
+        max_threads: int = DEFAULT_MAX_THREADS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        db_path: Optional[str] = DEFAULT_DB_PATH,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ):
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.count_tokens = count_tokens or _approximate_tokens
+        self._threads: "OrderedDict[str, Thread]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        # Counters exposed through stats()
+        self.summaries = 0
+        self.summarized_turns = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS threads (
+                    thread_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    summarized_turns INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS thread_turns (
+                    thread_id TEXT NOT NULL,
+                    turn_index INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    PRIMARY KEY (thread_id, turn_index)
+                );
+                """
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._threads)
+
+    def get(self, thread_id: str) -> Optional[Thread]:
+        """Look up a thread, falling back to SQLite when it was evicted from memory."""
+        with self._lock:
+            return self._get(thread_id)
+
+    def append(self, thread_id: str, user_message: str, assistant_message: str) -> Thread:
+        """Add a completed exchange to a thread, creating the thread if needed."""
+        turns = [
+            Turn("user", user_message, self.count_tokens(user_message)),
+            Turn("assistant", assistant_message, self.count_tokens(assistant_message)),
+        ]
+        with self._lock:
+            thread = self._get(thread_id) or Thread(thread_id)
+            first_index = len(thread.turns)
+            thread.turns.extend(turns)
+            thread.updated_at = time.time()
+            self._remember(thread)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO thread_turns (thread_id, turn_index, role, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                    [(thread_id, first_index + offset, turn.role, turn.content, turn.tokens) for offset, turn in enumerate(turns)],
+                )
+                self._save_thread(thread)
+        return thread
+
+    def set_summary(self, thread_id: str, summary: str, summarized_turns: int) -> bool:
+        """
+        Store a summary covering the first summarized_turns turns.
+
+        Ignored (returns False) if the thread is gone or already has a summary
+        covering as much, e.g. when two summaries of the same thread race.
+        """
+        with self._lock:
+            thread = self._get(thread_id)
+            if thread is None or summarized_turns <= thread.summarized_turns:
+                return False
+            self.summaries += 1
+            self.summarized_turns += summarized_turns - thread.summarized_turns
+            thread.summary = summary
+            thread.summarized_turns = summarized_turns
+            self._remember(thread)
+            if self._db is not None:
+                self._save_thread(thread)
+        return True
+
+    def delete(self, thread_id: str) -> bool:
+        """Remove a thread from memory and disk. Returns True if it existed."""
+        with self._lock:
+            thread = self._threads.pop(thread_id, None)
+            self._total_bytes -= self._sizes.pop(thread_id, 0)
+            existed = thread is not None
+            if self._db is not None:
+                cursor = self._db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+                self._db.execute("DELETE FROM thread_turns WHERE thread_id = ?", (thread_id,))
+                self._db.commit()
+                existed = existed or cursor.rowcount > 0
+        return existed
+
+    def stats(self) -> Dict[str, int]:
+        """Threads and text held in memory, and how many turns have been summarized."""
+        return {
+            "threads": len(self._threads),
+            "bytes": self._total_bytes,
+            "summaries": self.summaries,
+            "summarized_turns": self.summarized_turns,
+        }
+
+    def _get(self, thread_id: str) -> Optional[Thread]:
+        """Memory lookup with SQLite fallback. Caller holds the lock."""
+        thread = self._threads.get(thread_id)
+        if thread is not None:
+            self._threads.move_to_end(thread_id)
+            return thread
+
+        if self._db is None:
+            return None
+
+        row = self._db.execute(
+            "SELECT summary, summarized_turns, updated_at FROM threads WHERE thread_id = ?",
+            (thread_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        turns = [
+            Turn(*turn_row)
+            for turn_row in self._db.execute(
+                "SELECT role, content, tokens FROM thread_turns WHERE thread_id = ? ORDER BY turn_index",
+                (thread_id,),
+            )
+        ]
+        thread = Thread(thread_id, turns, *row)
+        self._remember(thread)
+        return thread
+
+    def _save_thread(self, thread: Thread):
+        """Write a thread's summary and timestamp to SQLite. Caller holds the lock."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO threads (thread_id, summary, summarized_turns, updated_at) VALUES (?, ?, ?, ?)",
+            (thread.thread_id, thread.summary, thread.summarized_turns, thread.updated_at),
+        )
+        self._db.commit()
+
+    def _remember(self, thread: Thread):
+        """Insert into the in-memory LRU and evict down to the limits. Caller holds the lock."""
+        # Threads grow in place, so the size each was counted at is kept separately
+        self._threads.pop(thread.thread_id, None)
+        self._total_bytes -= self._sizes.pop(thread.thread_id, 0)
+
+        self._threads[thread.thread_id] = thread
+        self._sizes[thread.thread_id] = thread.size
+        self._total_bytes += thread.size
+
+        # Evict least recently used threads, but always keep the newest one
+        while len(self._threads) > 1 and (len(self._threads) > self.max_threads or self._total_bytes > self.max_bytes):
+            evicted_id, _ = self._threads.popitem(last=False)
+            self._total_bytes -= self._sizes.pop(evicted_id)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
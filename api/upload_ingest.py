@@ -0,0 +1,169 @@
+"""
+Bounded-memory ingestion of uploaded files.
+
+An upload is read in fixed-size blocks and hashed on the way in, so the
+document ID comes for free. Small uploads stay in memory; past a threshold
+the blocks go to a temp file instead, which is memory-mapped for reading. Either
+way PyPDF2 gets an in-memory view of the bytes (open()) rather than a
+fresh read of the file, and the temp file is removed by close() no matter
+how the request ends.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from typing import BinaryIO, Optional
+
+# Uploads larger than this are rejected
+DEFAULT_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Uploads up to this size are kept in memory; bigger ones are spooled to disk
+DEFAULT_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", str(8 * 1024 * 1024)))
+# Size of each read from the incoming upload
+DEFAULT_BLOCK_SIZE = int(os.environ.get("UPLOAD_BLOCK_SIZE", str(1024 * 1024)))
+# Where spooled uploads go; defaults to the system temp directory
+DEFAULT_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the maximum size."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File is too large. Maximum upload size is {max_bytes} bytes.")
+        self.max_bytes = max_bytes
+
+
+class SpooledUpload:
+    """
+    The bytes of one upload, in memory or in a temp file, plus their SHA-256.
+
+    Use ingest_upload() to create one, and always close() it.
+
+    Args:
+        filename: Original filename
+        spool_threshold: Size above which the bytes are moved to disk
+        spool_dir: Directory for the temp file
+    """
+
+    def __init__(self, filename: str, spool_threshold: int = DEFAULT_SPOOL_THRESHOLD, spool_dir: Optional[str] = DEFAULT_SPOOL_DIR):
+        self.filename = filename
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._data: Optional[bytes] = None
+        self._file = None
+        self._path: Optional[str] = None
+        self._closed = False
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 of the bytes written so far (the document ID once complete)."""
+        return self._hasher.hexdigest()
+
+    @property
+    def in_memory(self) -> bool:
+        return self._file is None
+
+    def write(self, block: bytes):
+        """Append a block, moving everything to disk once past the threshold."""
+        self._hasher.update(block)
+        self.size += len(block)
+        if self._file is None and self.size > self.spool_threshold:
+            self._spill(self._buffer.getbuffer())
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(block)
+        else:
+            self._buffer.write(block)
+
+    def finish(self):
+        """Mark the upload complete (flushes the temp file, or takes the in-memory bytes without a copy)."""
+        if self._file is not None:
+            self._file.flush()
+        else:
+            self._data = self._buffer.getvalue()
+            self._buffer = None
+
+    def open(self) -> BinaryIO:
+        """
+        A new seekable stream over the bytes, for PyPDF2 or text decoding.
+
+        In memory this is a BytesIO sharing the buffer (no copy); on disk it
+        is a read-only memory map of the temp file.
+        """
+        if self._file is None:
+            return io.BytesIO(self._data if self._data is not None else b"")
+        return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else io.BytesIO(b"")
+
+    def path(self) -> str:
+        """
+        Path of a file holding the bytes, for code that needs one (e.g. worker processes).
+
+        An in-memory upload is written out on first call.
+        """
+        if self._file is None:
+            self._spill(self._data or b"")
+            self._file.flush()
+            self._data = None
+        return self._path
+
+    def getvalue(self) -> bytes:
+        """The whole upload as bytes (a copy if it was spooled to disk)."""
+        if self._file is None:
+            return self._data or b""
+        with self.open() as stream:
+            return stream.read()
+
+    def text(self) -> str:
+        """The upload decoded as text, the way open(path, 'r', errors='ignore') would."""
+        return io.TextIOWrapper(io.BytesIO(self.getvalue()), errors='ignore').read()
+
+    def close(self):
+        """Release the bytes and delete the temp file, if any. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = None
+        self._data = None
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+    def _spill(self, data):
+        self._file = tempfile.NamedTemporaryFile(prefix="upload-", dir=self.spool_dir, delete=False)
+        self._path = self._file.name
+        self._file.write(data)
+
+
+async def ingest_upload(
+    file,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> SpooledUpload:
+    """
+    Read an UploadFile in blocks into a SpooledUpload, hashing as it goes.
+
+    Raises:
+        UploadTooLarge: if the upload is bigger than max_bytes (nothing is kept)
+    """
+    upload = SpooledUpload(file.filename or "", spool_threshold)
+    try:
+        while True:
+            block = await file.read(block_size)
+            if not block:
+                break
+            if upload.size + len(block) > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            upload.write(block)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
@@ -0,0 +1,312 @@
+"""
+Dense (embedding) retrieval index with memory-mapped vector storage.
+
+Chunks are embedded once, in batches, when a document is ingested. The
+vectors are L2-normalized float32 rows written to an `np.memmap` file per
+document, so a query is one matrix-vector product plus `argpartition` for the
+top-k, and many indexed documents don't have to stay resident in RAM.
+
+Embedders are pluggable. HashingEmbedder is deterministic and needs no
+network, so the index works offline; OpenAIEmbedder uses the embeddings API.
+With a ChunkEntryCache, chunks embedded before (e.g. the unchanged chunks of
+a revised document) reuse their vectors instead of being embedded again.
+
+Requires numpy (`pip install numpy`).
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from bm25_index import ChunkEntryCache, tokenize
+
+# Where vector files are kept; defaults to a folder in the system temp directory
+DEFAULT_INDEX_DIR = os.environ.get("DENSE_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "doc-guy-vectors")
+# Number of chunks sent to the embedder per call
+DEFAULT_BATCH_SIZE = int(os.environ.get("DENSE_EMBED_BATCH_SIZE", "64"))
+
+
+def texts_digest(texts: Sequence[str], salt: str = "") -> str:
+    """Short hex digest of a sequence of texts (and salt, e.g. a version), for naming vector files."""
+    hasher = hashlib.blake2b(salt.encode("utf-8"), digest_size=12)
+    for text in texts:
+        encoded = text.encode("utf-8")
+        # Length-prefix each text so ["ab", "c"] and ["a", "bc"] can't collide
+        hasher.update(len(encoded).to_bytes(8, "big"))
+        hasher.update(encoded)
+    return hasher.hexdigest()
+
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _fill_in_order(indexes, lengths: Sequence[int], budget: int, chosen: List[int], used: int) -> List[int]:
+    """Add indexes to chosen in the given order, skipping any that would overflow the budget."""
+    for index in indexes:
+        if used + lengths[index] <= budget:
+            chosen.append(index)
+            used += lengths[index]
+    return chosen
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place (zero rows are left as zeros)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder using signed feature hashing.
+
+    Unigrams and bigrams are hashed with CRC32 (stable across processes, unlike
+    Python's hash()) into `dim` buckets with a +/-1 sign, and counts are
+    log-scaled. Good enough for lexical similarity without any model download.
+
+    Args:
+        dim: Embedding dimension
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[int]:
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        return [zlib.crc32(feature.encode("utf-8")) for feature in features]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed a batch of texts into a (len(texts), dim) float32 matrix."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(self._features(text), dtype=np.uint32)
+            if hashes.size == 0:
+                continue
+            buckets = (hashes % self.dim).astype(np.intp)
+            # Use a high bit of the hash for the sign so it's independent of the bucket
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], buckets, signs)
+        # Dampen repeated terms
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        return matrix
+
+
+class OpenAIEmbedder:
+    """
+    Embeds texts with the OpenAI embeddings API.
+
+    Args:
+        client: A synchronous OpenAI client
+        model: Embedding model name
+        dim: Dimension of that model's embeddings
+    """
+
+    def __init__(self, client, model: str = "text-embedding-3-small", dim: int = 1536):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = model
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+
+class VectorIndex:
+    """
+    Normalized chunk embeddings for one document, stored in a memory-mapped file.
+
+    Use VectorIndex.build() to embed and persist, or VectorIndex.open() to
+    reuse vectors already on disk.
+    """
+
+    def __init__(self, vectors: np.ndarray, embedder):
+        self.vectors = vectors
+        self.embedder = embedder
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def _paths(index_dir: str, key: str, embedder):
+        base = os.path.join(index_dir, f"{key}-{embedder.name}")
+        return base + ".f32", base + ".json"
+
+    @classmethod
+    def build(
+        cls,
+        key: str,
+        texts: Sequence[str],
+        embedder,
+        index_dir: str = DEFAULT_INDEX_DIR,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        entry_cache: Optional[ChunkEntryCache] = None,
+    ) -> "VectorIndex":
+        """
+        Embed texts in batches and write the normalized vectors to disk.
+
+        Rows are written into the memory-mapped file a batch at a time, so at
+        most one batch of vectors is held in RAM besides the entry cache.
+
+        Args:
+            key: Unique name for this document's vectors (e.g. its document ID)
+            texts: The chunk texts, in order
+            embedder: Object with `name`, `dim` and `embed(texts)`
+            index_dir: Directory for the vector files
+            batch_size: Texts per embed() call
+            entry_cache: Optional cache of the vectors of chunks embedded before
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        vector_path, meta_path = cls._paths(index_dir, key, embedder)
+        rows = len(texts)
+
+        if rows == 0:
+            return cls(np.zeros((0, embedder.dim), dtype=np.float32), embedder)
+
+        def embed_batch(batch_texts: Sequence[str]) -> np.ndarray:
+            return normalize_rows(np.asarray(embedder.embed(batch_texts), dtype=np.float32))
+
+        # Write into a temp file of this build's own first, so a crash never leaves a half-written
+        # index behind and concurrent builds of the same key don't write over each other
+        fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=f"{key}-", suffix=".tmp")
+        os.close(fd)
+        try:
+            vectors = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(rows, embedder.dim))
+            for start in range(0, rows, batch_size):
+                batch_texts = texts[start:start + batch_size]
+                if entry_cache is not None:
+                    # Only the chunks the cache hasn't seen are embedded
+                    batch = entry_cache.map(f"vector-{embedder.name}", batch_texts, lambda missing: list(embed_batch(missing)))
+                else:
+                    batch = embed_batch(batch_texts)
+                vectors[start:start + len(batch_texts)] = batch
+            vectors.flush()
+            del vectors
+            os.replace(temp_path, vector_path)
+        except BaseException:
+            _unlink_quietly(temp_path)
+            raise
+
+        # The meta goes last, and is swapped in whole too: open() trusts the vectors once it reads it
+        cls._write_meta(meta_path, key, {"rows": rows, "dim": embedder.dim, "embedder": embedder.name})
+
+        return cls.open(key, embedder, index_dir, rows=rows)
+
+    @staticmethod
+    def _write_meta(meta_path: str, key: str, meta: dict):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), prefix=f"{key}-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f)
+            os.replace(temp_path, meta_path)
+        except BaseException:
+            _unlink_quietly(temp_path)
+            raise
+
+    @classmethod
+    def open(cls, key: str, embedder, index_dir: str = DEFAULT_INDEX_DIR, rows: Optional[int] = None) -> Optional["VectorIndex"]:
+        """
+        Map existing vectors read-only, or return None if there are none.
+
+        Vectors whose shape doesn't match (rows, when given, and the
+        embedder's dimension) or whose file is incomplete count as none, so
+        the caller builds them again.
+        """
+        vector_path, meta_path = cls._paths(index_dir, key, embedder)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if (rows is not None and meta.get("rows") != rows) or meta.get("dim") != embedder.dim:
+            return None
+        if meta["rows"] == 0:
+            return cls(np.zeros((0, meta["dim"]), dtype=np.float32), embedder)
+        try:
+            if os.path.getsize(vector_path) != meta["rows"] * meta["dim"] * np.dtype(np.float32).itemsize:
+                return None
+        except OSError:
+            return None
+        vectors = np.memmap(vector_path, dtype=np.float32, mode="r", shape=(meta["rows"], meta["dim"]))
+        return cls(vectors, embedder)
+
+    @staticmethod
+    def delete(key_prefix: str, index_dir: str = DEFAULT_INDEX_DIR) -> int:
+        """
+        Remove the vector files of every key starting with key_prefix (e.g. a
+        document ID), whatever the embedder. Returns how many files went.
+
+        Indexes already open keep their mapping until they're dropped.
+        """
+        removed = 0
+        for path in glob.glob(os.path.join(glob.escape(index_dir), glob.escape(key_prefix) + "*")):
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def score(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query to every chunk."""
+        query_vector = normalize_rows(np.asarray(self.embedder.embed([query]), dtype=np.float32))[0]
+        return self.vectors @ query_vector
+
+    def search(self, query: str, top_k: int = 5):
+        """Return up to top_k (chunk index, score) pairs, best first."""
+        if len(self) == 0:
+            return []
+        scores = self.score(query)
+        top_k = min(top_k, len(scores))
+        # argpartition finds the top-k in linear time; only those k get sorted
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        ordered = candidates[np.argsort(-scores[candidates])]
+        return [(int(i), float(scores[i])) for i in ordered]
+
+    def select_within_budget(self, query: str, lengths: Sequence[int], budget: int) -> List[int]:
+        """
+        Pick the most similar chunks whose combined length fits the budget.
+
+        Same contract as BM25Index.select_within_budget: returns chunk indexes
+        in document order. As there, a query with nothing in common with any
+        chunk (every score zero) takes chunks from the start of the document.
+        """
+        if len(self) == 0:
+            return []
+        scores = self.score(query)
+        lengths_array = np.asarray(lengths)
+        if not scores.any():
+            return _fill_in_order(range(len(scores)), lengths, budget, [], 0)
+
+        # Rank only as many chunks as could possibly fit, instead of sorting them all...
+        shortest_first = np.sort(lengths_array)
+        max_fit = int(np.searchsorted(np.cumsum(shortest_first), budget, side="right"))
+        if max_fit == 0:
+            return []
+        candidate_count = min(len(scores), max(max_fit * 2, 1))
+        candidates = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+        ranked = candidates[np.argsort(-scores[candidates])]
+        chosen = _fill_in_order(ranked.tolist(), lengths, budget, [], 0)
+
+        # ...unless the candidates were too long to fill the budget: then the rest are ranked too
+        if candidate_count < len(scores):
+            used = int(lengths_array[chosen].sum()) if chosen else 0
+            rest = np.ones(len(scores), dtype=bool)
+            rest[candidates] = False
+            if lengths_array[rest].min() <= budget - used:
+                ranked_rest = np.flatnonzero(rest)[np.argsort(-scores[rest])]
+                chosen = _fill_in_order(ranked_rest.tolist(), lengths, budget, chosen, used)
+        return sorted(chosen)
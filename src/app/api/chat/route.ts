@@ -3,13 +3,19 @@ import { NextRequest, NextResponse } from 'next/server';
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json();
-    const { message, apiKey, documentContext, fileIds } = body;
+    const { message, apiKey, documentContext, documentIds, threadId, mode } = body;
 
     // Create a system message with document context if available
     let developerMessage = "You are a helpful assistant that answers questions about documents. When answering questions about documents, ALWAYS reference the specific sections from the document to support your answer.";
     
+    if (documentContext || documentIds?.length) {
+      developerMessage += "\n\nHere are the document(s) to reference when answering questions. Each section is marked with '--- SECTION: [Section Name] ---'. Use these section names in your answers when referring to specific parts of the document:";
+    }
+
+    // Inline context is only sent for documents the backend doesn't store;
+    // stored documents are referenced by ID and the backend appends their text
     if (documentContext) {
-      developerMessage += "\n\nHere are the document(s) to reference when answering questions. Each section is marked with '--- SECTION: [Section Name] ---'. Use these section names in your answers when referring to specific parts of the document:\n\n" + documentContext;
+      developerMessage += "\n\n" + documentContext;
     }
 
     // Forward the request to your FastAPI backend
@@ -23,7 +29,10 @@ export async function POST(request: NextRequest) {
         developer_message: developerMessage,
         user_message: message,
         api_key: apiKey,
-        model: "gpt-4.1-mini"
+        model: "gpt-4.1-mini",
+        document_ids: documentIds,
+        thread_id: threadId,
+        mode
       }),
     });
 
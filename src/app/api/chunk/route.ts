@@ -16,6 +16,8 @@ export async function POST(request: NextRequest) {
     const apiKey = formData.get('api_key') as string;
     const maxChunkSize = formData.get('max_chunk_size') as string || '5000';
     const overlap = formData.get('overlap') as string || '200';
+    const chunkUnit = formData.get('chunk_unit') as string || 'chars';
+    const stream = formData.get('stream') === 'true';
 
     if (!file) {
       return NextResponse.json(
@@ -37,6 +39,8 @@ export async function POST(request: NextRequest) {
     newFormData.append('api_key', apiKey);
     newFormData.append('max_chunk_size', maxChunkSize);
     newFormData.append('overlap', overlap);
+    newFormData.append('chunk_unit', chunkUnit);
+    newFormData.append('stream', stream ? 'true' : 'false');
 
     const response = await fetch('http://localhost:9000/api/chunk', {
       method: 'POST',
@@ -47,6 +51,13 @@ export async function POST(request: NextRequest) {
       throw new Error(`Backend responded with status: ${response.status}`);
     }
 
+    // Pass NDJSON straight through so the client sees each chunk as soon as it's ready
+    if (stream) {
+      return new Response(response.body, {
+        headers: { 'Content-Type': 'application/x-ndjson' },
+      });
+    }
+
     const data = await response.json();
     
     // Return the chunked document data
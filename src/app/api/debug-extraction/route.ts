@@ -13,6 +13,7 @@ export async function POST(request: NextRequest) {
     // Get the form data
     const formData = await request.formData();
     const file = formData.get('file') as File;
+    const stream = formData.get('stream') === 'true';
 
     if (!file) {
       return NextResponse.json(
@@ -24,6 +25,7 @@ export async function POST(request: NextRequest) {
     // Forward the file to our FastAPI backend
     const newFormData = new FormData();
     newFormData.append('file', file);
+    newFormData.append('stream', stream ? 'true' : 'false');
 
     const response = await fetch('http://localhost:9000/api/debug-extraction', {
       method: 'POST',
@@ -34,6 +36,13 @@ export async function POST(request: NextRequest) {
       throw new Error(`Backend responded with status: ${response.status}`);
     }
 
+    // Pass NDJSON straight through so pages show up as they're extracted
+    if (stream) {
+      return new Response(response.body, {
+        headers: { 'Content-Type': 'application/x-ndjson' },
+      });
+    }
+
     const data = await response.json();
     
     // Return the debug extraction data
@@ -0,0 +1,59 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+export async function POST(request: NextRequest) {
+  try {
+    // Check if the request is multipart/form-data
+    if (!request.headers.get('content-type')?.includes('multipart/form-data')) {
+      return NextResponse.json(
+        { error: 'Content-Type must be multipart/form-data' },
+        { status: 400 }
+      );
+    }
+
+    // Get the form data
+    const formData = await request.formData();
+    const files = formData.getAll('files') as File[];
+    const apiKey = formData.get('api_key') as string;
+
+    if (files.length === 0) {
+      return NextResponse.json(
+        { error: 'No files provided' },
+        { status: 400 }
+      );
+    }
+
+    if (!apiKey) {
+      return NextResponse.json(
+        { error: 'API key is required' },
+        { status: 400 }
+      );
+    }
+
+    // Forward all the files to our FastAPI backend in one request
+    const newFormData = new FormData();
+    for (const file of files) {
+      newFormData.append('files', file);
+    }
+    newFormData.append('api_key', apiKey);
+
+    const response = await fetch('http://localhost:9000/api/upload/batch', {
+      method: 'POST',
+      body: newFormData,
+    });
+
+    if (!response.ok) {
+      throw new Error(`Backend responded with status: ${response.status}`);
+    }
+
+    // Pass NDJSON straight through so the client sees each file as soon as it's processed
+    return new Response(response.body, {
+      headers: { 'Content-Type': 'application/x-ndjson' },
+    });
+  } catch (error: any) {
+    console.error('Batch upload error:', error);
+    return NextResponse.json(
+      { error: 'Failed to upload files', details: error.message },
+      { status: 500 }
+    );
+  }
+}
@@ -15,6 +15,7 @@ type UploadedFile = {
   size: number;
   fileId?: string;
   pageCount?: number;
+  file?: File;
 };
 
 type DocumentChunk = {
@@ -32,8 +33,13 @@ export default function ChatInterface() {
   const [documentChunks, setDocumentChunks] = useState<DocumentChunk[]>([]);
   const [selectedChunk, setSelectedChunk] = useState<string>('');
   const [isFetchingChunks, setIsFetchingChunks] = useState(false);
+  const [chunkProgress, setChunkProgress] = useState('');
+  // Read every part of the documents (map-reduce) instead of just the best-matching ones
+  const [readWholeDocument, setReadWholeDocument] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  // The backend keeps this conversation's history under this ID, so only the new message is sent
+  const threadIdRef = useRef<string>(crypto.randomUUID());
 
   // Scroll to bottom whenever messages change
   useEffect(() => {
@@ -55,7 +61,8 @@ export default function ChatInterface() {
     setIsUploading(true);
     
     try {
-      // Process each file
+      // Check each file before sending them all together
+      const accepted: File[] = [];
       for (let i = 0; i < files.length; i++) {
         const file = files[i];
         
@@ -74,48 +81,62 @@ export default function ChatInterface() {
           continue;
         }
         
-        // Upload to OpenAI through our backend
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('api_key', apiKey);
-        formData.append('purpose', 'assistants');
-        
-        const response = await fetch('/api/upload', {
-          method: 'POST',
-          body: formData,
-        });
-        
-        if (!response.ok) {
-          throw new Error(`Failed to upload file: ${response.statusText}`);
+        accepted.push(file);
+      }
+      if (accepted.length === 0) return;
+      
+      // Upload every file in one request; the backend extracts them concurrently
+      const formData = new FormData();
+      for (const file of accepted) {
+        formData.append('files', file);
+      }
+      formData.append('api_key', apiKey);
+      
+      const response = await fetch('/api/upload/batch', {
+        method: 'POST',
+        body: formData,
+      });
+      
+      if (!response.ok) {
+        throw new Error(`Failed to upload files: ${response.statusText}`);
+      }
+      
+      // Each file's result arrives as soon as it's processed, in whatever order they finish
+      await readNdjson(response, (record) => {
+        if (record.type === 'error') {
+          throw new Error(record.error);
         }
+        if (record.type !== 'file') return;
         
-        const data = await response.json();
-        
-        // Use the extracted text from the backend if available
-        let content = data.text_content;
-        
-        if (!content) {
-          // Fallback to local extraction if backend extraction failed
-          content = await readFileContent(file);
+        const file = accepted[record.index];
+        if (record.status !== 'ok') {
+          setMessages(prev => [...prev, {
+            role: 'assistant',
+            content: `Sorry, I couldn't process "${file.name}": ${record.error}`
+          }]);
+          return;
         }
         
-        // Add to uploaded files
+        // Add to uploaded files, with the text the backend extracted
         setUploadedFiles(prev => [...prev, {
           name: file.name,
-          content,
+          content: record.text_content || '',
           type: file.type,
           size: file.size,
-          fileId: data.file_id,
-          pageCount: data.page_count
+          // Only files the backend extracted are stored server-side and can be referenced by ID
+          fileId: record.text_content ? record.file_id : undefined,
+          pageCount: record.page_count,
+          // Kept so the chunk debugger can have the backend re-chunk the original
+          file
         }]);
         
         // Add a system message to inform the user
-        const pageInfo = data.page_count > 1 ? ` (${data.page_count} pages)` : '';
+        const pageInfo = record.page_count > 1 ? ` (${record.page_count} pages)` : '';
         setMessages(prev => [...prev, {
           role: 'assistant',
           content: `I've processed "${file.name}"${pageInfo} (${formatFileSize(file.size)}). You can now ask questions about this document!`
         }]);
-      }
+      });
     } catch (error) {
       console.error('Error uploading file:', error);
       setMessages(prev => [...prev, {
@@ -129,26 +150,6 @@ export default function ChatInterface() {
     }
   };
   
-  const readFileContent = async (file: File): Promise<string> => {
-    if (file.type === 'application/pdf' || file.name.endsWith('.pdf')) {
-      // For PDF files, we rely on the backend extraction
-      // This is just a fallback in case backend extraction fails
-      return `[PDF Content: ${file.name} - The text content has been extracted on the server side.]`;
-    } else {
-      // For text files, read the content
-      return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = (e) => {
-          resolve(e.target?.result as string || '');
-        };
-        reader.onerror = (e) => {
-          reject(new Error('Failed to read file'));
-        };
-        reader.readAsText(file);
-      });
-    }
-  };
-  
   const formatFileSize = (bytes: number): string => {
     if (bytes < 1024) return bytes + ' bytes';
     else if (bytes < 1024 * 1024) return (bytes / 1024).toFixed(1) + ' KB';
@@ -161,6 +162,65 @@ export default function ChatInterface() {
     setSelectedChunk('');
   };
 
+  // Read an NDJSON response line by line, handing each record to onRecord as soon as it arrives
+  const readNdjson = async (response: Response, onRecord: (record: any) => void) => {
+    const reader = response.body?.getReader();
+    if (!reader) {
+      throw new Error('Streaming responses are not supported by this browser');
+    }
+    
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      
+      buffered += decoder.decode(value, { stream: true });
+      const lines = buffered.split('\n');
+      // The last piece may be a partial line - keep it for the next read
+      buffered = lines.pop() || '';
+      for (const line of lines) {
+        if (line.trim()) onRecord(JSON.parse(line));
+      }
+    }
+    if (buffered.trim()) onRecord(JSON.parse(buffered));
+  };
+
+  // Have the backend chunk the original file, showing each chunk as soon as it's ready
+  const streamDocumentChunks = async (fileInfo: UploadedFile): Promise<number> => {
+    const formData = new FormData();
+    formData.append('file', fileInfo.file as File);
+    formData.append('api_key', apiKey);
+    formData.append('stream', 'true');
+    
+    const response = await fetch('/api/chunk', {
+      method: 'POST',
+      body: formData,
+    });
+    
+    if (!response.ok) {
+      throw new Error(`Failed to chunk file: ${response.statusText}`);
+    }
+    
+    let received = 0;
+    await readNdjson(response, (record) => {
+      if (record.type === 'page') {
+        const ofPages = fileInfo.pageCount ? ` of ${fileInfo.pageCount}` : '';
+        setChunkProgress(`page ${record.page}${ofPages}`);
+      } else if (record.type === 'chunk') {
+        const chunk = { title: record.title, content: record.content };
+        const isFirst = received === 0;
+        // The first chunk replaces the "Processing..." placeholder
+        setDocumentChunks(prev => (isFirst ? [chunk] : [...prev, chunk]));
+        if (isFirst) setSelectedChunk(chunk.title);
+        received++;
+      } else if (record.type === 'error') {
+        throw new Error(record.error);
+      }
+    });
+    return received;
+  };
+
   const fetchDocumentChunks = async (fileIndex: number) => {
     if (!apiKey.trim()) {
       alert("Please enter your API key first");
@@ -177,17 +237,29 @@ export default function ChatInterface() {
         content: `Analyzing content structure of ${fileInfo.name}. Please wait...`
       }]);
       setSelectedChunk("Processing...");
+      setChunkProgress('');
+      
+      // Stream the backend's chunks when we still have the original file
+      if (fileInfo.file) {
+        try {
+          const chunkCount = await streamDocumentChunks(fileInfo);
+          if (chunkCount > 0) return;
+        } catch (error) {
+          console.error('Streaming chunks failed, analyzing the extracted content instead:', error);
+        }
+      }
       
-      // Instead of trying to re-upload the file, we'll analyze the content we already have
+      // Otherwise analyze the content we already have from the upload
       // Parse the content we already have from the upload to extract section information
-      const sections = fileInfo.content.match(/--- SECTION: [^-]+? ---[\s\S]+?(?=--- SECTION: |$)/g);
+      // (titles can contain hyphens, so each runs up to the " ---" that ends its marker line)
+      const sections = fileInfo.content.match(/--- SECTION: .+? ---[\s\S]+?(?=--- SECTION: |$)/g);
       
       if (sections && sections.length > 0) {
         // Process each section into a chunk
         const chunks = sections.map((section, idx) => {
-          const titleMatch = section.match(/--- SECTION: ([^-]+?) ---/);
+          const titleMatch = section.match(/--- SECTION: (.+?) ---/);
           const title = titleMatch ? titleMatch[1].trim() : `Section ${idx + 1}`;
-          const content = section.replace(/--- SECTION: [^-]+? ---\n\n/, '').trim();
+          const content = section.replace(/--- SECTION: .+? ---\n\n/, '').trim();
           
           return {
             title,
@@ -242,6 +314,7 @@ export default function ChatInterface() {
       setSelectedChunk("Error");
     } finally {
       setIsFetchingChunks(false);
+      setChunkProgress('');
     }
   };
 
@@ -258,10 +331,15 @@ export default function ChatInterface() {
     
     try {
       // Send message to backend
-      // Prepare document context from uploaded files with better section handling
-      const documentContext = uploadedFiles.map(file => {
+      // Files registered on the server are referenced by ID, so we don't resend their text
+      const documentIds = uploadedFiles
+        .filter(file => file.fileId)
+        .map(file => file.fileId as string);
+      
+      // Only files the server doesn't know about still need their content sent inline
+      const documentContext = uploadedFiles.filter(file => !file.fileId).map(file => {
         // Extract sections from content if possible
-        const sections = file.content.match(/--- SECTION: [^-]+? ---[\s\S]+?(?=--- SECTION: |$)/g);
+        const sections = file.content.match(/--- SECTION: .+? ---[\s\S]+?(?=--- SECTION: |$)/g);
         
         if (sections && sections.length > 0) {
           // If sections were detected, use them for context
@@ -294,7 +372,10 @@ export default function ChatInterface() {
         body: JSON.stringify({ 
           message: input,
           apiKey: apiKey,
-          documentContext: documentContext || undefined
+          documentIds: documentIds.length > 0 ? documentIds : undefined,
+          documentContext: documentContext || undefined,
+          threadId: threadIdRef.current,
+          mode: readWholeDocument && documentIds.length > 0 ? 'map_reduce' : undefined
         }),
       });
       
@@ -434,7 +515,10 @@ export default function ChatInterface() {
           <div className="mt-3 bg-gray-800/50 p-3 rounded-md border border-gray-700">
             <div className="flex justify-between items-center mb-2">
               <h3 className="text-sm font-medium text-gray-300">Document Chunks (Debug):</h3>
-              <span className="text-xs text-blue-400">{documentChunks.length} chunks found</span>
+              <span className="text-xs text-blue-400">
+                {documentChunks.length} chunks found
+                {isFetchingChunks && chunkProgress ? ` (reading ${chunkProgress}...)` : ''}
+              </span>
             </div>
             
             <div className="mb-3">
@@ -446,7 +530,6 @@ export default function ChatInterface() {
                 className="w-full bg-gray-700 text-sm text-white rounded-md p-2"
                 value={selectedChunk}
                 onChange={(e) => setSelectedChunk(e.target.value)}
-                disabled={isFetchingChunks}
               >
                 {documentChunks.map((chunk, index) => (
                   <option key={index} value={chunk.title}>
@@ -556,6 +639,15 @@ export default function ChatInterface() {
             <FaPaperPlane />
           </button>
         </div>
+        <label className="flex items-center gap-2 mt-2 ml-4 text-xs text-gray-400">
+          <input
+            type="checkbox"
+            checked={readWholeDocument}
+            onChange={(e) => setReadWholeDocument(e.target.checked)}
+            disabled={isLoading}
+          />
+          Read the whole document (slower; for questions like &quot;list every...&quot;)
+        </label>
       </form>
     </div>
   );